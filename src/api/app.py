@@ -51,6 +51,11 @@ def create_app() -> Flask:
     # init milvus
     dao.init_milvus(app)
 
+    # init vector store, the local store is used when milvus is absent
+    from flaskr.service.rag.vector_store import init_vector_store
+
+    init_vector_store(app)
+
     # Init LLM
     with app.app_context():
         from flaskr.api import llm  # noqa
@@ -1,4 +1,5 @@
 from flask import Flask
+from flaskr.common.metrics import measure_stage
 from .ilivedata import ilivedata_check
 from .yidun import yidun_check
 from .dto import (
@@ -22,9 +23,11 @@ def check_text(app: Flask, data_id: str, text: str, user_id: str):
 
     check_provider = app.config.get("CHECK_PROVIDER")
     if check_provider == "ilivedata":
-        return ilivedata_check(app, data_id, text, user_id)
+        with measure_stage("moderation"):
+            return ilivedata_check(app, data_id, text, user_id)
     elif check_provider == "yidun":
-        return yidun_check(app, data_id, text, user_id)
+        with measure_stage("moderation"):
+            return yidun_check(app, data_id, text, user_id)
     else:
         app.logger.warning(f"check_provider {check_provider} not supported")
         return CheckResultDTO(
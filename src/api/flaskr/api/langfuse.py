@@ -1,6 +1,13 @@
+import hashlib
+import queue
+import threading
+import uuid
+
 from langfuse import Langfuse
 from flask import Flask
 
+from flaskr.common.config import get_config
+
 
 class MockClient:
     def __init__(self, *args, **kwargs):
@@ -13,8 +20,167 @@ class MockClient:
         return method
 
 
+# the langfuse calls of a request are run by a background thread: a call only
+# puts a closure on a bounded queue, the client builds and serializes the
+# events in the exporter, a full queue drops the calls instead of waiting
+class TraceExporter:
+    def __init__(self, app: Flask, size: int):
+        self.app = app
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="langfuse-exporter", daemon=True
+                )
+                self.thread.start()
+
+    def submit(self, func, *args, **kwargs) -> bool:
+        self._start()
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                self.app.logger.warning(f"langfuse exporter dropped: {self.dropped}")
+            return False
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.app.logger.warning(f"langfuse export error: {e}")
+
+
+# a trace, span or generation whose langfuse client is created by the exporter
+# the children are created after their parent, as the exporter runs in order
+class TracedObservation:
+    def __init__(self, exporter: TraceExporter, create, id: str = None):
+        self.id = id
+        self._exporter = exporter
+        self._client = None
+        exporter.submit(self._create, create)
+
+    def _create(self, create):
+        self._client = create()
+
+    def _call(self, name: str, args, kwargs):
+        if self._client is not None:
+            getattr(self._client, name)(*args, **kwargs)
+
+    def _child(self, name: str, args, kwargs) -> "TracedObservation":
+        def create():
+            if self._client is None:
+                return None
+            return getattr(self._client, name)(*args, **kwargs)
+
+        return TracedObservation(self._exporter, create)
+
+    def span(self, *args, **kwargs) -> "TracedObservation":
+        return self._child("span", args, kwargs)
+
+    def generation(self, *args, **kwargs) -> "TracedObservation":
+        return self._child("generation", args, kwargs)
+
+    def event(self, *args, **kwargs) -> "TracedObservation":
+        return self._child("event", args, kwargs)
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self._exporter.submit(self._call, name, args, kwargs)
+            return self
+
+        return method
+
+
+# the trace of a study step: the output is collected in a list and the trace
+# is updated once by flush() at the end of the step, not by every script
+class StepTrace(TracedObservation):
+    def __init__(self, exporter: TraceExporter, client: Langfuse, **kwargs):
+        trace_id = str(uuid.uuid4())
+        super().__init__(
+            exporter, lambda: client.trace(id=trace_id, **kwargs), trace_id
+        )
+        self.outputs = []
+        self.pending = {}
+
+    def append_output(self, text: str):
+        self.outputs.append(text)
+        return self
+
+    def update(self, **kwargs):
+        self.pending.update(kwargs)
+        return self
+
+    def flush(self):
+        kwargs = dict(self.pending)
+        if self.outputs:
+            kwargs["output"] = (kwargs.get("output") or "") + "".join(self.outputs)
+        self.pending = {}
+        if kwargs:
+            self._exporter.submit(self._call, "update", (), kwargs)
+        return self
+
+    def end(self, **kwargs):
+        self.pending.update(kwargs)
+        return self.flush()
+
+
+def _parse_rates(value: str) -> dict:
+    rates = {}
+    for item in (value or "").split(","):
+        key, _, rate = item.partition("=")
+        if key.strip() and rate.strip():
+            rates[key.strip()] = float(rate)
+    return rates
+
+
+# LANGFUSE_SAMPLE_RATE, overridden by LANGFUSE_COURSE_SAMPLE_RATES and then by
+# LANGFUSE_USER_SAMPLE_RATES ("id=rate" pairs split by commas)
+# the decision is a hash of the session, so a session is kept or dropped whole
+def is_trace_sampled(user_id: str, course_id: str, session_id: str) -> bool:
+    rate = float(get_config("LANGFUSE_SAMPLE_RATE", "1"))
+    rate = _parse_rates(get_config("LANGFUSE_COURSE_SAMPLE_RATES", "")).get(
+        course_id, rate
+    )
+    rate = _parse_rates(get_config("LANGFUSE_USER_SAMPLE_RATES", "")).get(user_id, rate)
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    key = session_id or str(uuid.uuid4())
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF < rate
+
+
+# the trace of an unsampled step, its id is still written to the records
+class MockTrace(MockClient):
+    def __init__(self, *args, **kwargs):
+        self.id = str(uuid.uuid4())
+
+
+def start_trace(course_id: str = None, **kwargs):
+    if trace_exporter is None or not is_trace_sampled(
+        kwargs.get("user_id"), course_id, kwargs.get("session_id")
+    ):
+        return MockTrace()
+    return StepTrace(trace_exporter, langfuse_client, **kwargs)
+
+
+trace_exporter = None
+
+
 def init_langfuse(app: Flask):
-    global langfuse_client
+    global langfuse_client, trace_exporter
     app.logger.info("Initializing Langfuse client")
     if (
         app.config.get("LANGFUSE_PUBLIC_KEY")
@@ -26,6 +192,10 @@ def init_langfuse(app: Flask):
             secret_key=app.config["LANGFUSE_SECRET_KEY"],
             host=app.config["LANGFUSE_HOST"],
         )
+        trace_exporter = TraceExporter(
+            app, int(get_config("LANGFUSE_EXPORT_QUEUE_SIZE", "10000"))
+        )
     else:
         app.logger.warning("Langfuse configuration not found, using MockLangfuse")
         langfuse_client = MockClient()
+        trace_exporter = None
@@ -1,7 +1,6 @@
 from typing import Generator
 from .ernie import get_ernie_response, get_erine_models, chat_ernie
 from .glm import get_zhipu_models, invoke_glm
-import openai
 from flask import Flask
 from langfuse.client import StatefulSpanClient
 from langfuse.model import ModelUsage
@@ -10,64 +9,141 @@ from openai.types.chat import ChatCompletionStreamOptionsParam
 from openai.types.shared_params import ResponseFormatJSONObject
 from flask import current_app
 from .dify import dify_chat_message
+from .stream import create_openai_client, get_llm_provider
+from .registry import model_registry
 from flaskr.common.config import get_config
+from flaskr.common.metrics import measure_llm
 from flaskr.service.common.models import raise_error_with_args
 from ..ark.sign import request
 from datetime import datetime
 
-openai_enabled = False
+# openai compatible providers: provider -> (client, config vars)
+OPENAI_COMPATIBLE_PROVIDERS = {}
 
-OPENAI_MODELS = []
+openai_enabled = False
 if get_config("OPENAI_API_KEY"):
     openai_enabled = True
-    openai_client = openai.Client(
+    openai_client = create_openai_client(
         api_key=get_config("OPENAI_API_KEY"),
         base_url=get_config("OPENAI_BASE_URL", "https://api.openai.com/v1"),
     )
-    try:
-        OPENAI_MODELS = [
-            i.id for i in openai_client.models.list().data if i.id.startswith("gpt")
-        ]
-    except Exception as e:
-        current_app.logger.warning(f"get openai models error: {e}")
-        OPENAI_MODELS = []
 else:
     current_app.logger.warning("OPENAI_API_KEY not configured")
     openai_client = None
+OPENAI_COMPATIBLE_PROVIDERS["openai"] = (
+    openai_client,
+    "OPENAI_API_KEY,OPENAI_BASE_URL",
+)
 
-deepseek_enabled = False
-if get_config("DEEPSEEK_API_KEY"):
-    deepseek_enabled = True
-    deepseek_client = openai.Client(
-        api_key=get_config("DEEPSEEK_API_KEY"),
-        base_url=get_config("DEEPSEEK_API_URL", "https://api.deepseek.com"),
-    )
+
+def get_openai_models(app: Flask) -> dict:
+    return {
+        i.id: i.id for i in openai_client.models.list().data if i.id.startswith("gpt")
+    }
+
+
+model_registry.register_provider(
+    "openai", loader=get_openai_models if openai_enabled else None
+)
+
+# ernie
+ernie_enabled = False
+if get_config("ERNIE_API_ID") and get_config("ERNIE_API_SECRET"):
+    ernie_enabled = True
 else:
-    current_app.logger.warning("DEEPSEEK_API_KEY not configured")
-    deepseek_client = None
+    current_app.logger.warning("ERNIE_API_ID and ERNIE_API_SECRET not configured")
+model_registry.register_provider(
+    "ernie", {model: model for model in get_erine_models(current_app)}
+)
 
+# special model glm
+glm_enabled = False
+if get_config("GLM_API_KEY"):
+    glm_enabled = True
+else:
+    current_app.logger.warning("GLM_API_KEY not configured")
+model_registry.register_provider(
+    "glm", {model: model for model in get_zhipu_models(current_app)}
+)
 
 # qwen
 qwen_enabled = False
-QWEN_MODELS = []
 QWEN_PREFIX = "qwen/"
 if get_config("QWEN_API_KEY"):
     qwen_enabled = True
-    qwen_client = openai.Client(
+    qwen_client = create_openai_client(
         api_key=get_config("QWEN_API_KEY"),
         base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
     )
     # get_config("QWEN_API_URL")
     # )
-    QWEN_MODELS = [QWEN_PREFIX + i.id for i in qwen_client.models.list().data]
-    QWEN_MODELS = QWEN_MODELS + [
-        QWEN_PREFIX + "deepseek-r1",
-        QWEN_PREFIX + "deepseek-v3",
-    ]
-    current_app.logger.info(f"qwen models: {QWEN_MODELS}")
 else:
     current_app.logger.warning("QWEN_API_KEY not configured")
     qwen_client = None
+OPENAI_COMPATIBLE_PROVIDERS["qwen"] = (qwen_client, "QWEN_API_KEY,QWEN_API_URL")
+
+
+def get_qwen_models(app: Flask) -> dict:
+    models = {QWEN_PREFIX + i.id: i.id for i in qwen_client.models.list().data}
+    models[QWEN_PREFIX + "deepseek-r1"] = "deepseek-r1"
+    models[QWEN_PREFIX + "deepseek-v3"] = "deepseek-v3"
+    return models
+
+
+model_registry.register_provider(
+    "qwen", loader=get_qwen_models if qwen_enabled else None
+)
+
+# deepseek
+deepseek_enabled = False
+if get_config("DEEPSEEK_API_KEY"):
+    deepseek_enabled = True
+    deepseek_client = create_openai_client(
+        api_key=get_config("DEEPSEEK_API_KEY"),
+        base_url=get_config("DEEPSEEK_API_URL", "https://api.deepseek.com"),
+    )
+else:
+    current_app.logger.warning("DEEPSEEK_API_KEY not configured")
+    deepseek_client = None
+OPENAI_COMPATIBLE_PROVIDERS["deepseek"] = (
+    deepseek_client,
+    "DEEPSEEK_API_KEY,DEEPSEEK_API_URL",
+)
+model_registry.register_provider("deepseek", {"deepseek-chat": "deepseek-chat"})
+
+# dify
+dify_enabled = False
+if get_config("DIFY_API_KEY") and get_config("DIFY_URL"):
+    dify_enabled = True
+else:
+    current_app.logger.warning("DIFY_API_KEY and DIFY_URL not configured")
+model_registry.register_provider("dify", {"dify": "dify"} if dify_enabled else {})
+
+# silicon
+silicon_enabled = False
+SILICON_PREFIX = "silicon/"
+if get_config("SILICON_API_KEY"):
+    silicon_enabled = True
+    current_app.logger.info("SILICON CONFIGURED")
+    silicon_client = create_openai_client(
+        api_key=get_config("SILICON_API_KEY"), base_url="https://api.siliconflow.cn/v1"
+    )
+else:
+    current_app.logger.warning("SILICON_API_KEY not configured")
+    silicon_client = None
+OPENAI_COMPATIBLE_PROVIDERS["silicon"] = (
+    silicon_client,
+    "SILICON_API_KEY,SILICON_API_URL",
+)
+
+
+def get_silicon_models(app: Flask) -> dict:
+    return {SILICON_PREFIX + i.id: i.id for i in silicon_client.models.list().data}
+
+
+model_registry.register_provider(
+    "silicon", loader=get_silicon_models if silicon_enabled else None
+)
 
 # ernie v2
 ernie_v2_enabled = False
@@ -97,32 +173,43 @@ ERNIE_V2_MODELS = [
 ]
 if get_config("ERNIE_API_KEY"):
     ernie_v2_enabled = True
-    ernie_v2_client = openai.Client(
+    ernie_v2_client = create_openai_client(
         api_key=get_config("ERNIE_API_KEY"), base_url="https://qianfan.baidubce.com/v2"
     )
-    ERNIE_V2_MODELS = [ERNIE_V2_PREFIX + i for i in ERNIE_V2_MODELS]
-    current_app.logger.info(f"ernie v2 models: {ERNIE_V2_MODELS}")
 else:
     current_app.logger.warning("ERNIE_API_TOKEN not configured")
-
-# ernie
-ernie_enabled = False
-ERNIE_MODELS = []
-
-if get_config("ERNIE_API_ID") and get_config("ERNIE_API_SECRET"):
-    ernie_enabled = True
-    ERNIE_MODELS = get_erine_models(current_app)
-else:
-    current_app.logger.warning("ERNIE_API_ID and ERNIE_API_SECRET not configured")
-
-current_app.logger.info(f"ernie models: {ERNIE_MODELS}")
+    ernie_v2_client = None
+OPENAI_COMPATIBLE_PROVIDERS["ernie_v2"] = (ernie_v2_client, "ERNIE_API_KEY")
+model_registry.register_provider(
+    "ernie_v2",
+    (
+        {ERNIE_V2_PREFIX + model: model for model in ERNIE_V2_MODELS}
+        if ernie_v2_enabled
+        else {}
+    ),
+)
 
 # ark
 ark_enabled = False
-ARK_MODELS = []
 ARK_PREFIX = "ark/"
-ARK_MODELS_MAP = {}
 if get_config("ARK_ACCESS_KEY_ID") and get_config("ARK_SECRET_ACCESS_KEY"):
+    ark_enabled = True
+    current_app.logger.info("ARK CONFIGURED")
+    ark_client = create_openai_client(
+        api_key=get_config("ARK_API_KEY"),
+        base_url="https://ark.cn-beijing.volces.com/api/v3",
+    )
+else:
+    current_app.logger.warning("ARK_API_KEY not configured")
+    ark_client = None
+OPENAI_COMPATIBLE_PROVIDERS["ark"] = (
+    ark_client,
+    "ARK_ACCESS_KEY_ID,ARK_SECRET_ACCESS_KEY",
+)
+
+
+# the models of ark are served by endpoints
+def get_ark_models(app: Flask) -> dict:
     ark_list_endpoints = request(
         "POST",
         datetime.now(),
@@ -133,36 +220,23 @@ if get_config("ARK_ACCESS_KEY_ID") and get_config("ARK_SECRET_ACCESS_KEY"):
         "ListEndpoints",
         None,
     )
-    current_app.logger.info(ark_list_endpoints)
-    ark_enabled = True
-    current_app.logger.info("ARK CONFIGURED")
+    app.logger.info(ark_list_endpoints)
+    models = {}
     ark_endpoints = ark_list_endpoints.get("Result", {}).get("Items", [])
-    if ark_endpoints and len(ark_endpoints) > 0:
-        for endpoint in ark_endpoints:
-            endpoint_id = endpoint.get("Id")
-            model_name = (
-                endpoint.get("ModelReference", {})
-                .get("FoundationModel", {})
-                .get("Name", "")
-            )
-            current_app.logger.info(f"ark endpoint: {endpoint_id}, model: {model_name}")
-            ARK_MODELS.append(ARK_PREFIX + model_name)
-            ARK_MODELS_MAP[ARK_PREFIX + model_name] = endpoint_id
-    ark_client = openai.Client(
-        api_key=get_config("ARK_API_KEY"),
-        base_url="https://ark.cn-beijing.volces.com/api/v3",
-    )
-    current_app.logger.info(f"ark models: {ARK_MODELS}")
-else:
-    current_app.logger.warning("ARK_API_KEY not configured")
+    for endpoint in ark_endpoints or []:
+        endpoint_id = endpoint.get("Id")
+        model_name = (
+            endpoint.get("ModelReference", {})
+            .get("FoundationModel", {})
+            .get("Name", "")
+        )
+        app.logger.info(f"ark endpoint: {endpoint_id}, model: {model_name}")
+        models[ARK_PREFIX + model_name] = endpoint_id
+    return models
 
 
-# special model glm
-glm_enabled = False
-if get_config("GLM_API_KEY"):
-    glm_enabled = True
-else:
-    current_app.logger.warning("GLM_API_KEY not configured")
+model_registry.register_provider("ark", loader=get_ark_models if ark_enabled else None)
+
 if (
     openai_enabled
     or deepseek_enabled
@@ -175,34 +249,8 @@ if (
 else:
     current_app.logger.warning("No LLM Configured")
 
-
-# silicon
-silicon_enabled = False
-SILICON_MODELS = []
-SILICON_PREFIX = "silicon/"
-if get_config("SILICON_API_KEY"):
-    silicon_enabled = True
-    current_app.logger.info("SILICON CONFIGURED")
-    silicon_client = openai.Client(
-        api_key=get_config("SILICON_API_KEY"), base_url="https://api.siliconflow.cn/v1"
-    )
-
-    SILICON_MODELS = [SILICON_PREFIX + i.id for i in silicon_client.models.list().data]
-    current_app.logger.info(f"SILICON_MODELS: {SILICON_MODELS}")
-else:
-    current_app.logger.warning("SILICON_API_KEY not configured")
-    silicon_client = None
-
-ERNIE_MODELS = get_erine_models(Flask(__name__))
-GLM_MODELS = get_zhipu_models(Flask(__name__))
-DEEP_SEEK_MODELS = ["deepseek-chat"]
-
-DIFY_MODELS = []
-
-if get_config("DIFY_API_KEY") and get_config("DIFY_URL"):
-    DIFY_MODELS = ["dify"]
-else:
-    current_app.logger.warning("DIFY_API_KEY and DIFY_URL not configured")
+# the model lists of the providers are loaded without blocking the startup
+model_registry.load_in_background(current_app._get_current_object())
 
 
 class LLMStreamaUsage:
@@ -223,70 +271,39 @@ class LLMStreamResponse:
         self.usage = LLMStreamaUsage(**usage) if usage else None
 
 
+# provider of the model, None if the model is not supported
+def get_model_provider(model: str) -> str:
+    if model.startswith("gpt"):
+        return "openai"
+    provider, _ = model_registry.get(model)
+    if provider is None:
+        # the glm models are matched case-insensitively
+        provider, _ = model_registry.get(model.lower())
+        if provider != "glm":
+            return None
+    return provider
+
+
 def get_openai_client_and_model(model: str):
-    client = None
-    if (
-        model in OPENAI_MODELS
-        or model.startswith("gpt")
-        or model in QWEN_MODELS
-        or model in DEEP_SEEK_MODELS
-        or model in SILICON_MODELS
-        or model in ERNIE_V2_MODELS
-        or model in ARK_MODELS
-    ):
-        if model in OPENAI_MODELS or model.startswith("gpt"):
-            client = openai_client
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="OPENAI_API_KEY,OPENAI_BASE_URL",
-                )
-        elif model in QWEN_MODELS:
-            client = qwen_client
-            model = model.replace(QWEN_PREFIX, "")
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="QWEN_API_KEY,QWEN_API_URL",
-                )
-        elif model in DEEP_SEEK_MODELS:
-            client = deepseek_client
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="DEEPSEEK_API_KEY,DEEPSEEK_API_URL",
-                )
-        elif model in SILICON_MODELS:
-            client = silicon_client
-            model = model.replace(SILICON_PREFIX, "")
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="SILICON_API_KEY,SILICON_API_URL",
-                )
-        elif model in ERNIE_V2_MODELS:
-            client = ernie_v2_client
-            model = model.replace(ERNIE_V2_PREFIX, "")
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="ERNIE_API_KEY",
-                )
-        elif model in ARK_MODELS:
-            client = ark_client
-            model = ARK_MODELS_MAP[model]
-            if not client:
-                raise_error_with_args(
-                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                    model=model,
-                    config_var="ARK_ACCESS_KEY_ID,ARK_SECRET_ACCESS_KEY",
-                )
-    return client, model
+    if model.startswith("gpt"):
+        provider, invoke_model = "openai", model
+    else:
+        provider, invoke_model = model_registry.get(model)
+    if provider not in OPENAI_COMPATIBLE_PROVIDERS:
+        return None, model
+    client, config_var = OPENAI_COMPATIBLE_PROVIDERS[provider]
+    if not client:
+        raise_error_with_args(
+            "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+            model=invoke_model,
+            config_var=config_var,
+        )
+    return client, invoke_model
+
+
+# reload the model lists of the providers
+def refresh_models(app: Flask) -> list[str]:
+    return model_registry.refresh(app)
 
 
 def invoke_llm(
@@ -301,7 +318,15 @@ def invoke_llm(
     **kwargs,
 ) -> Generator[LLMStreamResponse, None, None]:
     app.logger.info(
-        f"invoke_llm [{model}] {message} ,system:{system} ,json:{json} ,kwargs:{kwargs}"
+        f"invoke_llm [{model}] message:{len(message or '')} system:{len(system or '')}"
+    )
+    app.logger.debug(
+        "invoke_llm [%s] %s ,system:%s ,json:%s ,kwargs:%s",
+        model,
+        message,
+        system,
+        json,
+        kwargs,
     )
     kwargs.update({"stream": True})
     model = model.strip()
@@ -314,26 +339,107 @@ def invoke_llm(
     )
     response_text = ""
     usage = None
-    client, invoke_model = get_openai_client_and_model(model)
-    start_completion_time = None
-    if client:
-        messages = []
-        if system:
-            messages.append({"content": system, "role": "system"})
-        messages.append({"content": message, "role": "user"})
-        if json:
-            kwargs["response_format"] = ResponseFormatJSONObject(type="json_object")
-        kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-        kwargs["stream_options"] = ChatCompletionStreamOptionsParam(include_usage=True)
-        response = client.chat.completions.create(
-            model=invoke_model, messages=messages, **kwargs
-        )
-
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            if len(res.choices) and res.choices[0].delta.content:
-                response_text += res.choices[0].delta.content
+    with measure_llm(get_model_provider(model) or "unknown", model) as timer:
+        client, invoke_model = get_openai_client_and_model(model)
+        start_completion_time = None
+        if client:
+            messages = []
+            if system:
+                messages.append({"content": system, "role": "system"})
+            messages.append({"content": message, "role": "user"})
+            if json:
+                kwargs["response_format"] = ResponseFormatJSONObject(type="json_object")
+            kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
+            kwargs["stream_options"] = ChatCompletionStreamOptionsParam(
+                include_usage=True
+            )
+            with get_llm_provider(client.base_url).limit():
+                response = client.chat.completions.create(
+                    model=invoke_model, messages=messages, **kwargs
+                )
+                # a stream dropped by the caller closes its connection at once
+                with response:
+                    for res in response:
+                        if start_completion_time is None:
+                            start_completion_time = datetime.now()
+                            timer.chunk()
+                        if len(res.choices) and res.choices[0].delta.content:
+                            response_text += res.choices[0].delta.content
+                            yield LLMStreamResponse(
+                                res.id,
+                                True if res.choices[0].finish_reason else False,
+                                False,
+                                res.choices[0].delta.content,
+                                res.choices[0].finish_reason,
+                                None,
+                            )
+                        if res.usage:
+                            usage = ModelUsage(
+                                unit="TOKENS",
+                                input=res.usage.prompt_tokens,
+                                output=res.usage.completion_tokens,
+                                total=res.usage.total_tokens,
+                            )
+        elif get_model_provider(model) == "ernie":
+            if not ernie_enabled:
+                raise_error_with_args(
+                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                    model=model,
+                    config_var="ERNIE_API_ID,ERNIE_API_SECRET",
+                )
+            if system:
+                kwargs.update({"system": system})
+            if json:
+                kwargs["response_format"] = "json_object"
+            if kwargs.get("temperature", None) is not None:
+                kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
+            response = get_ernie_response(app, model, message, **kwargs)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
+                response_text += res.result
+                if res.usage:
+                    usage = ModelUsage(
+                        unit="TOKENS",
+                        input=res.usage.prompt_tokens,
+                        output=res.usage.completion_tokens,
+                        total=res.usage.total_tokens,
+                    )
+                yield LLMStreamResponse(
+                    res.id,
+                    res.is_end,
+                    res.is_truncated,
+                    res.result,
+                    res.finish_reason,
+                    res.usage.__dict__,
+                )
+        elif get_model_provider(model) == "glm":
+            if not glm_enabled:
+                raise_error_with_args(
+                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                    model=model,
+                    config_var="GLM_API_KEY",
+                )
+            if kwargs.get("temperature", None) is not None:
+                kwargs["temperature"] = str(kwargs["temperature"])
+            messages = []
+            if system:
+                messages.append({"content": system, "role": "system"})
+            messages.append({"content": message, "role": "user"})
+            response = invoke_glm(app, model.lower(), messages, **kwargs)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
+                response_text += res.result
+                if res.usage:
+                    usage = ModelUsage(
+                        unit="TOKENS",
+                        input=res.usage.prompt_tokens,
+                        output=res.usage.completion_tokens,
+                        total=res.usage.total_tokens,
+                    )
                 yield LLMStreamResponse(
                     res.id,
                     True if res.choices[0].finish_reason else False,
@@ -342,102 +448,32 @@ def invoke_llm(
                     res.choices[0].finish_reason,
                     None,
                 )
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-    elif model in ERNIE_MODELS:
-        if not ernie_enabled:
-            raise_error_with_args(
-                "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                model=model,
-                config_var="ERNIE_API_ID,ERNIE_API_SECRET",
-            )
-        if system:
-            kwargs.update({"system": system})
-        if json:
-            kwargs["response_format"] = "json_object"
-        if kwargs.get("temperature", None) is not None:
-            kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-        response = get_ernie_response(app, model, message, **kwargs)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-            yield LLMStreamResponse(
-                res.id,
-                res.is_end,
-                res.is_truncated,
-                res.result,
-                res.finish_reason,
-                res.usage.__dict__,
-            )
-    elif model.lower() in GLM_MODELS:
-        if not glm_enabled:
+        elif get_model_provider(model) == "dify":
+            response = dify_chat_message(app, message, user_id)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
+                if res.event == "message":
+                    response_text += res.answer
+                    yield LLMStreamResponse(
+                        res.task_id,
+                        True if res.event == "message" else False,
+                        False,
+                        res.answer,
+                        None,
+                        None,
+                    )
+        else:
             raise_error_with_args(
-                "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                "LLM.MODEL_NOT_SUPPORTED",
                 model=model,
-                config_var="GLM_API_KEY",
             )
-        if kwargs.get("temperature", None) is not None:
-            kwargs["temperature"] = str(kwargs["temperature"])
-        messages = []
-        if system:
-            messages.append({"content": system, "role": "system"})
-        messages.append({"content": message, "role": "user"})
-        response = invoke_glm(app, model.lower(), messages, **kwargs)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-            yield LLMStreamResponse(
-                res.id,
-                True if res.choices[0].finish_reason else False,
-                False,
-                res.choices[0].delta.content,
-                res.choices[0].finish_reason,
-                None,
-            )
-    elif model in DIFY_MODELS:
-        response = dify_chat_message(app, message, user_id)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            if res.event == "message":
-                response_text += res.answer
-                yield LLMStreamResponse(
-                    res.task_id,
-                    True if res.event == "message" else False,
-                    False,
-                    res.answer,
-                    None,
-                    None,
-                )
-    else:
-        raise_error_with_args(
-            "LLM.MODEL_NOT_SUPPORTED",
-            model=model,
-        )
+        if usage:
+            timer.usage(usage["input"], usage["output"])
 
-    app.logger.info(f"invoke_llm response: {response_text} ")
-    app.logger.info(f"invoke_llm usage: {usage.__str__()}")
+    app.logger.debug("invoke_llm response: %s", response_text)
+    app.logger.info("invoke_llm usage: %s", usage)
     generation.end(
         input=generation_input,
         output=response_text,
@@ -458,7 +494,10 @@ def chat_llm(
     generation_name: str = "user_follow_ask",
     **kwargs,
 ) -> Generator[LLMStreamResponse, None, None]:
-    app.logger.info(f"chat_llm [{model}] {messages} ,json:{json} ,kwargs:{kwargs}")
+    app.logger.info(f"chat_llm [{model}] messages:{len(messages)}")
+    app.logger.debug(
+        "chat_llm [%s] %s ,json:%s ,kwargs:%s", model, messages, json, kwargs
+    )
     kwargs.update({"stream": True})
     model = model.strip()
     generation_input = messages
@@ -470,16 +509,88 @@ def chat_llm(
     start_completion_time = None
     if kwargs.get("temperature", None) is not None:
         kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-    client, invoke_model = get_openai_client_and_model(model)
-    if client:
-        response = client.chat.completions.create(
-            model=invoke_model, messages=messages, **kwargs
-        )
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            if len(res.choices) and res.choices[0].delta.content:
+    with measure_llm(get_model_provider(model) or "unknown", model) as timer:
+        client, invoke_model = get_openai_client_and_model(model)
+        if client:
+            with get_llm_provider(client.base_url).limit():
+                response = client.chat.completions.create(
+                    model=invoke_model, messages=messages, **kwargs
+                )
+                # a stream dropped by the caller closes its connection at once
+                with response:
+                    for res in response:
+                        if start_completion_time is None:
+                            start_completion_time = datetime.now()
+                            timer.chunk()
+                        if len(res.choices) and res.choices[0].delta.content:
+                            response_text += res.choices[0].delta.content
+                            yield LLMStreamResponse(
+                                res.id,
+                                True if res.choices[0].finish_reason else False,
+                                False,
+                                res.choices[0].delta.content,
+                                res.choices[0].finish_reason,
+                                None,
+                            )
+                        if res.usage:
+                            usage = ModelUsage(
+                                unit="TOKENS",
+                                input=res.usage.prompt_tokens,
+                                output=res.usage.completion_tokens,
+                                total=res.usage.total_tokens,
+                            )
+        elif get_model_provider(model) == "ernie":
+            if not ernie_enabled:
+                raise_error_with_args(
+                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                    model=model,
+                    config_var="ERNIE_API_ID,ERNIE_API_SECRET",
+                )
+            if kwargs.get("temperature", None) is not None:
+                kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
+            response = chat_ernie(app, model, messages, **kwargs)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
+                response_text += res.result
+                if res.usage:
+                    usage = ModelUsage(
+                        unit="TOKENS",
+                        input=res.usage.prompt_tokens,
+                        output=res.usage.completion_tokens,
+                        total=res.usage.total_tokens,
+                    )
+                yield LLMStreamResponse(
+                    res.id,
+                    res.is_end,
+                    res.is_truncated,
+                    res.result,
+                    res.finish_reason,
+                    res.usage.__dict__,
+                )
+        elif get_model_provider(model) == "glm":
+            if not glm_enabled:
+                raise_error_with_args(
+                    "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                    model=model,
+                    config_var="GLM_API_KEY",
+                )
+            if kwargs.get("temperature", None) is not None:
+                kwargs["temperature"] = str(kwargs["temperature"])
+            response = invoke_glm(app, model.lower(), messages, **kwargs)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
                 response_text += res.choices[0].delta.content
+                if res.usage:
+                    usage = ModelUsage(
+                        unit="TOKENS",
+                        input=res.usage.prompt_tokens,
+                        output=res.usage.completion_tokens,
+                        total=res.usage.total_tokens,
+                    )
                 yield LLMStreamResponse(
                     res.id,
                     True if res.choices[0].finish_reason else False,
@@ -488,94 +599,32 @@ def chat_llm(
                     res.choices[0].finish_reason,
                     None,
                 )
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-    elif model in ERNIE_MODELS:
-        if not ernie_enabled:
-            raise_error_with_args(
-                "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
-                model=model,
-                config_var="ERNIE_API_ID,ERNIE_API_SECRET",
-            )
-        if kwargs.get("temperature", None) is not None:
-            kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-        response = chat_ernie(app, model, messages, **kwargs)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-            yield LLMStreamResponse(
-                res.id,
-                res.is_end,
-                res.is_truncated,
-                res.result,
-                res.finish_reason,
-                res.usage.__dict__,
-            )
-    elif model.lower() in GLM_MODELS:
-        if not glm_enabled:
+        elif get_model_provider(model) == "dify":
+            response = dify_chat_message(app, messages[-1]["content"], user_id)
+            for res in response:
+                if start_completion_time is None:
+                    start_completion_time = datetime.now()
+                    timer.chunk()
+                if res.event == "message":
+                    response_text += res.answer
+                    yield LLMStreamResponse(
+                        res.task_id,
+                        True if res.event == "message" else False,
+                        False,
+                        res.answer,
+                        None,
+                        None,
+                    )
+        else:
             raise_error_with_args(
-                "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
+                "LLM.MODEL_NOT_SUPPORTED",
                 model=model,
-                config_var="GLM_API_KEY",
-            )
-        if kwargs.get("temperature", None) is not None:
-            kwargs["temperature"] = str(kwargs["temperature"])
-        response = invoke_glm(app, model.lower(), messages, **kwargs)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.choices[0].delta.content
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-            yield LLMStreamResponse(
-                res.id,
-                True if res.choices[0].finish_reason else False,
-                False,
-                res.choices[0].delta.content,
-                res.choices[0].finish_reason,
-                None,
             )
-    elif model in DIFY_MODELS:
-        response = dify_chat_message(app, messages[-1]["content"], user_id)
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = res.result.completion_start_time
-            if res.event == "message":
-                response_text += res.answer
-                yield LLMStreamResponse(
-                    res.task_id,
-                    True if res.event == "message" else False,
-                    False,
-                    res.answer,
-                    None,
-                    None,
-                )
-    else:
-        raise_error_with_args(
-            "LLM.MODEL_NOT_SUPPORTED",
-            model=model,
-        )
+        if usage:
+            timer.usage(usage["input"], usage["output"])
 
-    app.logger.info(f"invoke_llm response: {response_text} ")
-    app.logger.info(f"invoke_llm usage: {usage.__str__()}")
+    app.logger.debug("invoke_llm response: %s", response_text)
+    app.logger.info("invoke_llm usage: %s", usage)
     generation.end(
         input=generation_input,
         output=response_text,
@@ -586,16 +635,4 @@ def chat_llm(
 
 
 def get_current_models(app: Flask) -> list[str]:
-    return list(
-        dict.fromkeys(
-            OPENAI_MODELS
-            + ERNIE_MODELS
-            + GLM_MODELS
-            + QWEN_MODELS
-            + DEEP_SEEK_MODELS
-            + DIFY_MODELS
-            + SILICON_MODELS
-            + ERNIE_V2_MODELS
-            + ARK_MODELS
-        )
-    )
+    return model_registry.list_models()
@@ -1,8 +1,9 @@
 from flask import Flask
 from typing import Generator
-import requests
 import json
 
+from .stream import get_llm_provider
+
 
 class DifyChunkChatCompletionResponse:
     event: str
@@ -37,13 +38,9 @@ def dify_chat_message(
         "inputs": {},
         "files": [],
     }
-    response = requests.post(url, headers=headers, json=data, stream=True)
-    for res in response.iter_lines():
-        res = res.decode("utf-8")
-        app.logger.info("dify response data: {}".format(res))
-        if res.startswith("data:"):
-            json_data = res[5:].strip()
-            if json_data.replace(" ", "") == "[DONE]":
-                return
-            parsed_data = json.loads(json_data)
-            yield DifyChunkChatCompletionResponse(**parsed_data)
+    for json_data in get_llm_provider(url).stream(
+        "POST", url, headers=headers, json=data
+    ):
+        app.logger.info("dify response data: {}".format(json_data))
+        parsed_data = json.loads(json_data)
+        yield DifyChunkChatCompletionResponse(**parsed_data)
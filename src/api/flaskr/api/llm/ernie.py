@@ -1,11 +1,11 @@
 from typing import Generator
-import requests
 
 # from ..dao import redis_client
 from flask import Flask
 import json
 
 from flaskr.common.config import get_config
+from .stream import get_llm_provider
 
 
 class ErnieUsage:
@@ -59,7 +59,7 @@ def get_access_token():
         "client_id": ERNIE_API_ID,
         "client_secret": ERNIE_API_SECRET,
     }
-    response = requests.post(url, params=params)
+    response = get_llm_provider(url).post(url, params=params)
     return response.json()["access_token"]
 
 
@@ -91,23 +91,16 @@ def get_ernie_response(
     for k, v in args.items():
         data[k] = v
     app.logger.info("ernie request data: {}".format(data))
-    response = requests.post(
+    for json_data in get_llm_provider(url).stream(
+        "POST",
         url,
         params=params,
         json=data,
         headers={"Content-Type": "application/json"},
-        stream=True,
-    )
-    for res in response.iter_lines():
-        res = res.decode("utf-8")
-        app.logger.info("ernie response data: {}".format(res))
-        if res.startswith("data:"):
-            json_data = res[5:].strip()
-            # 尝试解析 JSON 数据
-            if json_data.replace(" ", "") == "[DONE]":
-                return
-            parsed_data = json.loads(json_data)
-            yield ErnieStreamResponse(**parsed_data)
+    ):
+        app.logger.info("ernie response data: {}".format(json_data))
+        parsed_data = json.loads(json_data)
+        yield ErnieStreamResponse(**parsed_data)
 
 
 def chat_ernie(
@@ -127,23 +120,16 @@ def chat_ernie(
         data[k] = v
 
     app.logger.info("ernie request data: {}".format(data))
-    response = requests.post(
+    for json_data in get_llm_provider(url).stream(
+        "POST",
         url,
         params=params,
         json=data,
         headers={"Content-Type": "application/json"},
-        stream=True,
-    )
-    for res in response.iter_lines():
-        res = res.decode("utf-8")
-        app.logger.info("ernie response data: {}".format(res))
-        if res.startswith("data:"):
-            json_data = res[5:].strip()
-            # 尝试解析 JSON 数据
-            if json_data.replace(" ", "") == "[DONE]":
-                return
-            parsed_data = json.loads(json_data)
-            yield ErnieStreamResponse(**parsed_data)
+    ):
+        app.logger.info("ernie response data: {}".format(json_data))
+        parsed_data = json.loads(json_data)
+        yield ErnieStreamResponse(**parsed_data)
 
 
 def get_erine_models(app: Flask) -> list[str]:
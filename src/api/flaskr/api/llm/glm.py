@@ -1,11 +1,11 @@
 from typing import Generator
-import requests
 from flask import Flask
 import jwt
 import time
 import json
 
 from flaskr.common.config import get_config
+from .stream import get_llm_provider
 
 URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
 
@@ -107,31 +107,13 @@ def invoke_glm(
     data = {**data, **args}
 
     headers = {"Authorization": "Bearer " + get_config("GLM_API_KEY")}
-    response = requests.post(URLS[model], json=data, headers=headers, stream=True)
     app.logger.info("request data: {}".format(json.dumps(data)))
-    for res in response.iter_lines():
-        res = res.decode("utf-8")
-        app.logger.info("zhipu response data: {}".format(res))
-        if res.startswith("data:"):
-            # 提取 'data:' 后面的内容
-            json_data = res[5:].strip()
-            # 尝试解析 JSON 数据
-            if json_data.replace(" ", "") == "[DONE]":
-                break
-            parsed_data = json.loads(json_data)
-            yield ChatResponse(**parsed_data)
-    if response.status_code != 200:
-        try:
-            app.logger.error(
-                "zhipu response status code: {}".format(response.status_code)
-            )
-            app.logger.error("zhipu response data: {}".format(response.text))
-        except Exception as e:
-            app.logger.error("zhipu response error: {}".format(e))
-            pass
-        # raise Exception('zhipu response status code: {}'.format(response.status_code))
-
-    app.logger.error("ernie response data: {}".format(response))
+    for json_data in get_llm_provider(URLS[model]).stream(
+        "POST", URLS[model], json=data, headers=headers
+    ):
+        app.logger.info("zhipu response data: {}".format(json_data))
+        parsed_data = json.loads(json_data)
+        yield ChatResponse(**parsed_data)
 
 
 def get_zhipu_models(app: Flask) -> list[str]:
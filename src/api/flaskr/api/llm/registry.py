@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from typing import Callable
+
+from flask import Flask, current_app
+
+from flaskr.common.config import get_config
+from ...dao import redis_client as redis
+
+
+# index of the models served by each provider: model name -> (provider, invoke model)
+# static models are known at import time, the models of the providers with a
+# model list api are loaded in the background and shared by redis with a ttl,
+# a failed load is retried after RETRY_SECONDS
+class ModelRegistry:
+    RETRY_SECONDS = 30
+
+    def __init__(self):
+        self.providers = []
+        self.static_models = {}
+        self.loaders = {}
+        self.remote_models = {}
+        self.models = {}
+        self.model_list = []
+        self.loaded_at = 0
+        self.retry_at = 0
+        self.loading = False
+        self.first_load = threading.Event()
+        self.lock = threading.Lock()
+
+    # the providers are listed in lookup priority order
+    def register_provider(
+        self,
+        provider: str,
+        models: dict = None,
+        loader: Callable[[Flask], dict] = None,
+    ):
+        self.providers.append(provider)
+        self.static_models[provider] = models or {}
+        if loader:
+            self.loaders[provider] = loader
+        self._build_index()
+
+    def _build_index(self):
+        models = {}
+        for provider in self.providers:
+            provider_models = {
+                **self.static_models.get(provider, {}),
+                **self.remote_models.get(provider, {}),
+            }
+            for model, invoke_model in provider_models.items():
+                models.setdefault(model, (provider, invoke_model))
+        # swap the index at once, lookups never see a partial index
+        self.models = models
+        self.model_list = list(models.keys())
+
+    def _get_cache_key(self) -> str:
+        return get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "llm_models"
+
+    def _get_ttl(self) -> int:
+        return int(get_config("LLM_MODEL_REGISTRY_TTL", "3600"))
+
+    def get(self, model: str) -> tuple[str, str]:
+        if self.loaders:
+            now = time.time()
+            if now - self.loaded_at > self._get_ttl() and now >= self.retry_at:
+                self.load_in_background()
+            # the remote models are unknown until the first load is done
+            if model not in self.models and not self.first_load.is_set():
+                self.first_load.wait(float(get_config("LLM_MODEL_REGISTRY_WAIT", "10")))
+        return self.models.get(model, (None, model))
+
+    def list_models(self) -> list[str]:
+        return self.model_list
+
+    def _load_from_cache(self, app: Flask) -> bool:
+        if redis is None:
+            return False
+        try:
+            cached = redis.get(self._get_cache_key())
+        except Exception as e:
+            app.logger.warning(f"load llm models from redis error: {e}")
+            return False
+        if not cached:
+            return False
+        self.remote_models = json.loads(cached)
+        self.loaded_at = time.time()
+        self._build_index()
+        return True
+
+    # load the model lists of the providers and share them by redis, a provider
+    # failing keeps its last list, and the lists are neither cached nor
+    # considered loaded until all providers succeed
+    def refresh(self, app: Flask) -> list[str]:
+        remote_models = {}
+        failed = False
+        for provider, loader in self.loaders.items():
+            try:
+                remote_models[provider] = loader(app)
+            except Exception as e:
+                app.logger.warning(f"get {provider} models error: {e}")
+                remote_models[provider] = self.remote_models.get(provider, {})
+                failed = True
+        self.remote_models = remote_models
+        self._build_index()
+        if failed:
+            self.retry_at = time.time() + self.RETRY_SECONDS
+        else:
+            self.loaded_at = time.time()
+        if redis is not None and not failed:
+            try:
+                redis.set(
+                    self._get_cache_key(),
+                    json.dumps(remote_models),
+                    ex=self._get_ttl(),
+                )
+            except Exception as e:
+                app.logger.warning(f"save llm models to redis error: {e}")
+        app.logger.info(f"llm models: {self.model_list}")
+        return self.model_list
+
+    def _load(self, app: Flask):
+        try:
+            with app.app_context():
+                if not self._load_from_cache(app):
+                    self.refresh(app)
+        except Exception as e:
+            app.logger.warning(f"load llm models error: {e}")
+            self.retry_at = time.time() + self.RETRY_SECONDS
+        finally:
+            self.loading = False
+            self.first_load.set()
+
+    # a single load runs at a time, the lookups meanwhile use the last index
+    def load_in_background(self, app: Flask = None):
+        with self.lock:
+            if self.loading:
+                return
+            self.loading = True
+        app = app or current_app._get_current_object()
+        threading.Thread(target=self._load, args=(app,), daemon=True).start()
+
+
+model_registry = ModelRegistry()
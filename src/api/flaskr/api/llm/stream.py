@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+from typing import Generator
+from urllib.parse import urlsplit
+
+import httpx
+import openai
+from flask import current_app
+
+from flaskr.common.config import get_config
+from flaskr.service.common.models import raise_error_with_args
+
+try:
+    import h2  # noqa: F401
+
+    http2_available = True
+except ImportError:
+    http2_available = False
+
+
+# a pooled http client and a concurrency limit shared by every stream
+# sent to one provider (scheme + host) from this worker process
+class LLMProvider:
+    def __init__(self, name: str):
+        self.name = name
+        max_concurrency = int(get_config("LLM_MAX_CONCURRENCY", "64"))
+        self.queue_timeout = float(get_config("LLM_QUEUE_TIMEOUT", "10"))
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.http_client = httpx.Client(
+            http2=http2_available
+            and str(get_config("LLM_HTTP2", "true")).lower() == "true",
+            timeout=httpx.Timeout(
+                connect=float(get_config("LLM_CONNECT_TIMEOUT", "5")),
+                read=float(get_config("LLM_READ_TIMEOUT", "60")),
+                write=float(get_config("LLM_CONNECT_TIMEOUT", "5")),
+                pool=self.queue_timeout,
+            ),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+
+    # hold a stream slot of the provider until the stream is consumed or closed
+    @contextmanager
+    def limit(self):
+        if not self.semaphore.acquire(timeout=self.queue_timeout):
+            raise_error_with_args("LLM.PROVIDER_BUSY", provider=self.name)
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+    # stream the data lines of a server-sent events response until [DONE]
+    def stream(self, method: str, url: str, **kwargs) -> Generator[str, None, None]:
+        with self.limit():
+            with self.http_client.stream(method, url, **kwargs) as response:
+                if response.status_code != 200:
+                    response.read()
+                    current_app.logger.error(
+                        "llm response status code: {} {}".format(
+                            response.status_code, response.text
+                        )
+                    )
+                    return
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data.replace(" ", "") == "[DONE]":
+                        return
+                    yield data
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        with self.limit():
+            return self.http_client.post(url, **kwargs)
+
+
+_providers = {}
+_provider_lock = threading.Lock()
+
+
+def get_llm_provider(url: str) -> LLMProvider:
+    parts = urlsplit(str(url))
+    name = "{}://{}".format(parts.scheme, parts.netloc)
+    provider = _providers.get(name)
+    if provider is None:
+        with _provider_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                provider = LLMProvider(name)
+                _providers[name] = provider
+    return provider
+
+
+# an openai compatible client sharing the pool of its provider
+def create_openai_client(api_key: str, base_url: str) -> openai.Client:
+    http_client = get_llm_provider(base_url).http_client
+    return openai.Client(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=http_client.timeout,
+        http_client=http_client,
+    )
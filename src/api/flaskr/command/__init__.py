@@ -1,6 +1,8 @@
 from flask import Flask
 import click
 from .import_user import import_user
+from ..service.rag.ingest import run_ingest_worker
+from ..service.rag.funs import kb_vector_backfill, kb_vector_rebuild
 
 
 def enable_commands(app: Flask):
@@ -16,3 +18,25 @@ def enable_commands(app: Flask):
     def import_user_command(mobile, course_id, discount_code):
         """Import user and enable course"""
         import_user(app, mobile, course_id, discount_code)
+
+    @console.command(name="kb_ingest_worker")
+    def kb_ingest_worker_command():
+        """Run the knowledge base ingestion worker"""
+        run_ingest_worker(app)
+
+    @console.command(name="kb_vector_backfill")
+    @click.option("--batch-size", default=500, help="Chunks converted per commit")
+    @click.option("--codec", default=None, help="float32, float16 or int8")
+    def kb_vector_backfill_command(batch_size, codec):
+        """Convert the JSON chunk vectors to the binary column"""
+        total = kb_vector_backfill(app, batch_size, codec)
+        click.echo(f"converted {total} chunks")
+
+    @console.command(name="kb_vector_rebuild")
+    @click.argument("kb_id")
+    @click.option("--batch-size", default=1000, help="Chunks loaded per upsert")
+    @click.option("--recreate", is_flag=True, help="Drop the collection first")
+    def kb_vector_rebuild_command(kb_id, batch_size, recreate):
+        """Rebuild the vector store collection of a knowledge base from MySQL"""
+        total = kb_vector_rebuild(app, kb_id, batch_size, recreate)
+        click.echo(f"loaded {total} chunks")
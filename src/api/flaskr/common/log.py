@@ -1,8 +1,13 @@
+import atexit
+import copy
 import logging
 import os
+import queue
+import time
+from collections import deque
 from flask import Flask, request
 import uuid
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 import threading
 import socket
 from datetime import datetime
@@ -12,6 +17,23 @@ import requests
 
 thread_local = threading.local()
 
+_REQUEST_FIELDS = ("url", "request_id", "client_ip")
+
+
+def _set_request_fields(record):
+    try:
+        request_id = getattr(thread_local, "request_id", "No_Request_ID")
+        if request_id == "No_Request_ID":
+            thread_local.request_id = uuid.uuid4().hex
+            request_id = thread_local.request_id
+        record.url = getattr(thread_local, "url", "No_URL")
+        record.request_id = request_id
+        record.client_ip = getattr(thread_local, "client_ip", "No_Client_IP")
+    except RuntimeError:
+        record.url = "No_URL"
+        record.request_id = "No_Request_ID"
+        record.client_ip = "No_Client_IP"
+
 
 class RequestFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
@@ -29,39 +51,162 @@ class RequestFormatter(logging.Formatter):
         return s
 
     def format(self, record):
-        try:
-            request_id = getattr(thread_local, "request_id", "No_Request_ID")
-            if request_id == "No_Request_ID":
-                thread_local.request_id = uuid.uuid4().hex
-                request_id = thread_local.request_id
-            record.url = getattr(thread_local, "url", "No_URL")
-            record.request_id = request_id
-            record.client_ip = getattr(thread_local, "client_ip", "No_Client_IP")
-        except RuntimeError:
-            record.url = "No_URL"
-            record.request_id = "No_Request_ID"
-            record.client_ip = "No_Client_IP"
+        # the records from the log queue carry the fields of their request
+        if not hasattr(record, "request_id"):
+            _set_request_fields(record)
         return super().format(record)
 
 
+def _truncate(text: str, limit: int, keep_tail: bool = False) -> str:
+    if limit > 0 and len(text) > limit:
+        if keep_tail:
+            # the last line of a traceback is the exception itself
+            half = limit // 2
+            return text[:half] + f"...({len(text)} chars)..." + text[-half:]
+        return text[:limit] + f"...({len(text)} chars)"
+    return text
+
+
+# the errors are posted to feishu by a thread of the handler, so a slow webhook
+# never holds the log queue, the same error is sent once in dedup_seconds and
+# at most rate_limit messages are sent in a minute, the others are counted,
+# the errors of a place differ by their last line, as the tracebacks logged
+# by the error handler of the app all start with the same one
 class FeishuLogHandler(logging.Handler):
-    def __init__(self, webhook_url):
+    def __init__(
+        self,
+        webhook_url,
+        rate_limit: int = 10,
+        dedup_seconds: float = 60,
+        max_length: int = 4000,
+    ):
         super().__init__(level=logging.ERROR)
         self.webhook_url = webhook_url
+        self.rate_limit = rate_limit
+        self.dedup_seconds = dedup_seconds
+        self.max_length = max_length
+        self.sent_at = deque()
+        self.last_sent = {}
+        self.suppressed = 0
+        self.queue = queue.Queue(maxsize=100)
+        self.thread = None
+
+    def _start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self._run, name="feishu-log", daemon=True
+            )
+            self.thread.start()
+
+    def _allow(self, record, now: float) -> bool:
+        last_line = record.getMessage().rstrip().rsplit("\n", 1)[-1]
+        key = (record.pathname, record.lineno, last_line)
+        if now - self.last_sent.get(key, -self.dedup_seconds) < self.dedup_seconds:
+            return False
+        while self.sent_at and now - self.sent_at[0] >= 60:
+            self.sent_at.popleft()
+        if len(self.sent_at) >= self.rate_limit:
+            return False
+        if len(self.last_sent) > 1000:
+            self.last_sent = {
+                k: t for k, t in self.last_sent.items() if now - t < self.dedup_seconds
+            }
+        self.last_sent[key] = now
+        self.sent_at.append(now)
+        return True
 
     def emit(self, record):
-        log_entry = self.format(record)
+        if not self._allow(record, time.monotonic()):
+            self.suppressed += 1
+            return
+        log_entry = _truncate(self.format(record), self.max_length, keep_tail=True)
+        if self.suppressed:
+            log_entry += f"\n(另有 {self.suppressed} 条错误未发送)"
+            self.suppressed = 0
         payload = {
             "msg_type": "text",
             "content": {"text": f"师傅出错啦！\n{log_entry}\n"},
         }
+        self._start()
         try:
-            response = requests.post(self.webhook_url, json=payload)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            from flask import current_app
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self.suppressed += 1
+
+    def _run(self):
+        while True:
+            payload = self.queue.get()
+            try:
+                response = requests.post(self.webhook_url, json=payload, timeout=5)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # not the app logger, the error would be posted to feishu again
+                logging.getLogger(__name__).warning(
+                    f"Failed to send log to Feishu: {e}"
+                )
 
-            current_app.logger.error(f"Failed to send log to Feishu: {e}")
+
+# the app logger only puts its records on a queue, the formatting and the
+# writes of the handlers run on the thread of a QueueListener, which is
+# started by the first record of each process, as gunicorn forks the workers
+class RequestQueueHandler(QueueHandler):
+    def __init__(self, handlers: list, size: int, max_length: int):
+        super().__init__(queue.Queue(maxsize=size))
+        self.handlers = handlers
+        self.max_length = max_length
+        self.dropped = 0
+        self.listener = None
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+
+    def _start_listener(self):
+        if self.listener_pid == os.getpid():
+            return
+        with self.listener_lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self.listener.start()
+            self.listener_pid = os.getpid()
+            atexit.register(self.stop)
+
+    # the records left in the queue are written before the listener stops
+    def stop(self):
+        with self.listener_lock:
+            listener = self.listener
+            self.listener = None
+            self.listener_pid = None
+        if listener is not None:
+            listener.stop()
+
+    # the message is merged and the request fields are read on the calling
+    # thread, the rest of the formatting is left to the listener, only the
+    # payloads logged below WARNING are truncated, never an error or its cause
+    def prepare(self, record):
+        _set_request_fields(record)
+        message = record.getMessage()
+        if record.levelno < logging.WARNING and not record.exc_info:
+            message = _truncate(message, self.max_length)
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._start_listener()
+        super().emit(record)
 
 
 class ColoredRequestFormatter(RequestFormatter, colorlog.ColoredFormatter):
@@ -118,31 +263,40 @@ def init_log(app: Flask) -> Flask:
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(color_formatter)  # use color formatter
 
+    handlers = []
     if "gunicorn" in os.getenv("SERVER_SOFTWARE", ""):
         gunicorn_logger = logging.getLogger("gunicorn.info")
         if gunicorn_logger.handlers:
             for handler in gunicorn_logger.handlers:
                 handler.setFormatter(formatter)
-            app.logger.handlers = gunicorn_logger.handlers.copy()
+            handlers = gunicorn_logger.handlers.copy()
         else:
-            app.logger.handlers = []
-            app.logger.addHandler(file_handler)
-        app.logger.addHandler(console_handler)
-        app.logger.setLevel(gunicorn_logger.level)
+            handlers.append(file_handler)
+        handlers.append(console_handler)
     else:
-        app.logger.handlers = []
-        app.logger.addHandler(file_handler)
-        app.logger.addHandler(console_handler)
+        handlers.append(file_handler)
+        handlers.append(console_handler)
     feishu_webhook_url = app.config.get("FEISHU_LOG_WEBHOOK_URL", None)
     if feishu_webhook_url:
-        app.logger.info("Feishu enabled.")
-        feishu_handler = FeishuLogHandler(feishu_webhook_url)
+        feishu_handler = FeishuLogHandler(
+            feishu_webhook_url,
+            rate_limit=int(app.config.get("FEISHU_LOG_RATE_LIMIT", 10)),
+            dedup_seconds=float(app.config.get("FEISHU_LOG_DEDUP_SECONDS", 60)),
+            max_length=int(app.config.get("FEISHU_LOG_MAX_LENGTH", 4000)),
+        )
         feishu_handler.setFormatter(formatter)
-        app.logger.addHandler(feishu_handler)
-    else:
-        app.logger.info("Feishu disabled.")
-    app.logger.setLevel(logging.INFO)
+        handlers.append(feishu_handler)
+    app.logger.handlers = [
+        RequestQueueHandler(
+            handlers,
+            int(app.config.get("LOG_QUEUE_SIZE", 10000)),
+            int(app.config.get("LOG_MAX_MESSAGE_LENGTH", 2000)),
+        )
+    ]
+    # the full prompts and responses of the llm are logged at DEBUG
+    app.logger.setLevel(app.config.get("LOG_LEVEL", "INFO").upper())
     app.logger.propagate = False
+    app.logger.info("Feishu enabled." if feishu_webhook_url else "Feishu disabled.")
     return app
 
 
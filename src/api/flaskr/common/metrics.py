@@ -0,0 +1,251 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# latency histograms of the study steps and the llm streams, kept by each
+# worker process and rendered in the prometheus text format by /api/metrics
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+_registry = []
+_local = threading.local()
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    items = [
+        '{}="{}"'.format(
+            name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name) or "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                # the counts of each bucket, then the sum and the count
+                item = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self.values[key] = item
+            item[index] += 1
+            item[-2] += value
+            item[-1] += 1
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            values = {key: list(item) for key, item in self.values.items()}
+        for key, item in values.items():
+            count = 0
+            for bucket, bucket_count in zip(self.buckets, item):
+                count += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{bucket}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {item[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {item[-2]}")
+            lines.append(f"{self.name}_count{labels} {item[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name) or "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self.lock:
+            values = dict(self.values)
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+def histogram(
+    name: str, documentation: str, labelnames: tuple, buckets=DEFAULT_BUCKETS
+) -> Histogram:
+    metric = Histogram(name, documentation, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def counter(name: str, documentation: str, labelnames: tuple) -> Counter:
+    metric = Counter(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STUDY_STEP_SECONDS = histogram(
+    "ai_shifu_study_step_seconds",
+    "Duration of a study step, from the request to the end of its stream",
+    ("course_id",),
+)
+STUDY_STAGE_SECONDS = histogram(
+    "ai_shifu_study_stage_seconds",
+    "Time of a study step spent in a stage: db, moderation, rag, llm or sse",
+    ("stage", "course_id"),
+)
+LLM_TTFT_SECONDS = histogram(
+    "ai_shifu_llm_ttft_seconds",
+    "Time from the llm request to its first chunk",
+    ("provider", "model", "course_id"),
+)
+LLM_DURATION_SECONDS = histogram(
+    "ai_shifu_llm_duration_seconds",
+    "Time from the llm request to its last chunk, without the sse writes",
+    ("provider", "model", "course_id"),
+)
+LLM_TOKENS_PER_SECOND = histogram(
+    "ai_shifu_llm_output_tokens_per_second",
+    "Output tokens of an llm stream by the time from its first to its last chunk",
+    ("provider", "model", "course_id"),
+    RATE_BUCKETS,
+)
+LLM_TOKENS = counter(
+    "ai_shifu_llm_tokens_total",
+    "Tokens of the llm requests, by type input or output",
+    ("provider", "model", "type"),
+)
+
+
+# the stage times of the study step run by the current thread, they are
+# observed once per step when the step ends
+class StudyStep:
+    def __init__(self, course_id: str):
+        self.course_id = course_id
+        self.thread_id = threading.get_ident()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def get(self, stage: str) -> float:
+        return self.stages.get(stage, 0.0)
+
+
+def get_study_step() -> StudyStep:
+    return getattr(_local, "step", None)
+
+
+# a thread working for the step, like the speculative llm stream, adds its
+# stage times to the step of the request
+def set_study_step(step: StudyStep):
+    _local.step = step
+
+
+@contextmanager
+def study_step(course_id: str = None):
+    step = StudyStep(course_id)
+    set_study_step(step)
+    start = time.perf_counter()
+    try:
+        yield step
+    finally:
+        set_study_step(None)
+        STUDY_STEP_SECONDS.observe(
+            time.perf_counter() - start, course_id=step.course_id
+        )
+        for stage, seconds in step.stages.items():
+            STUDY_STAGE_SECONDS.observe(seconds, stage=stage, course_id=step.course_id)
+
+
+def add_stage_time(stage: str, seconds: float):
+    step = get_study_step()
+    if step is None:
+        STUDY_STAGE_SECONDS.observe(seconds, stage=stage)
+    else:
+        step.add(stage, seconds)
+
+
+@contextmanager
+def measure_stage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - start)
+
+
+class LLMStreamTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_chunk = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def chunk(self):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+
+    def usage(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+
+
+# an llm stream, its times leave out the sse writes of its chunks made by
+# the same thread while it was streaming
+@contextmanager
+def measure_llm(provider: str, model: str):
+    timer = LLMStreamTimer()
+    step = get_study_step()
+    sse_start = step.get("sse") if step is not None else 0.0
+    try:
+        yield timer
+    finally:
+        seconds = time.perf_counter() - timer.start
+        if step is not None and step.thread_id == threading.get_ident():
+            seconds -= step.get("sse") - sse_start
+        course_id = step.course_id if step is not None else None
+        labels = {"provider": provider, "model": model, "course_id": course_id}
+        LLM_DURATION_SECONDS.observe(seconds, **labels)
+        if timer.first_chunk is not None:
+            ttft = timer.first_chunk - timer.start
+            LLM_TTFT_SECONDS.observe(ttft, **labels)
+            if timer.output_tokens and seconds > ttft:
+                LLM_TOKENS_PER_SECOND.observe(
+                    timer.output_tokens / (seconds - ttft), **labels
+                )
+        LLM_TOKENS.inc(timer.input_tokens, provider=provider, model=model, type="input")
+        LLM_TOKENS.inc(
+            timer.output_tokens, provider=provider, model=model, type="output"
+        )
+        add_stage_time("llm", seconds)
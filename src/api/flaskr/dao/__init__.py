@@ -6,7 +6,8 @@ from sqlalchemy import event
 import sqlparse
 import logging
 import traceback
-import os
+
+from .profiler import get_caller_info, init_sql_profiler
 
 
 def init_db(app: Flask):
@@ -40,6 +41,7 @@ def init_db(app: Flask):
 
     db = SQLAlchemy()
     db.init_app(app)
+    init_sql_profiler(app)
 
     # Enable formatted SQL output in the development environment
     if app.debug:
@@ -49,19 +51,7 @@ def init_db(app: Flask):
             def before_cursor_execute(
                 conn, cursor, statement, parameters, context, executemany
             ):
-                stack = traceback.extract_stack()
-                project_root = os.path.abspath(
-                    os.path.join(os.path.dirname(__file__), "../../../")
-                )
-                caller_info = "Unknown location"
-
-                for frame in reversed(stack[:-2]):
-                    if (
-                        project_root in frame.filename
-                        and "site-packages" not in frame.filename
-                    ):
-                        caller_info = f"File: {os.path.relpath(frame.filename, project_root)}, Line: {frame.lineno}, Function: {frame.name}"
-                        break
+                caller_info = get_caller_info(traceback.extract_stack())
 
                 # Format the SQL statement
                 formatted_sql = sqlparse.format(
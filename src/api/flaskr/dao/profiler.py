@@ -0,0 +1,191 @@
+import os
+import random
+import threading
+import time
+import traceback
+
+from flask import Flask, Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# the statements of a request are counted by two engine events, a statement
+# run again with the same text (only its parameters differ) is a duplicate,
+# the n+1 pattern of a query in a loop, the stack is only taken for a sample
+# of the slow statements
+_local = threading.local()
+_metrics = {}
+_metrics_lock = threading.Lock()
+_settings = {
+    "logger": None,
+    "slow_ms": 500.0,
+    "stack_sample_rate": 0.1,
+    "duplicate_threshold": 10,
+}
+
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
+
+
+class SQLProfile:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = {}
+
+    def add(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def duplicates(self) -> int:
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def top_statement(self):
+        if not self.statements:
+            return None, 0
+        return max(self.statements.items(), key=lambda item: item[1])
+
+
+# the first frame of the project above the sqlalchemy event
+def get_caller_info(stack) -> str:
+    for frame in reversed(stack[:-2]):
+        if _PROJECT_ROOT in frame.filename and "site-packages" not in frame.filename:
+            return f"File: {os.path.relpath(frame.filename, _PROJECT_ROOT)}, Line: {frame.lineno}, Function: {frame.name}"
+    return "Unknown location"
+
+
+def start_sql_profile(endpoint: str) -> SQLProfile:
+    _local.profile = SQLProfile(endpoint)
+    return _local.profile
+
+
+def get_sql_profile() -> SQLProfile:
+    return getattr(_local, "profile", None)
+
+
+def end_sql_profile() -> SQLProfile:
+    profile = get_sql_profile()
+    _local.profile = None
+    return profile
+
+
+# the start is kept on the execution context of the statement, a statement
+# that fails never reaches after_cursor_execute, its time is counted by the
+# handle_error event instead
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._sql_profile_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _add_statement(context, statement)
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    if context is not None:
+        _add_statement(context, exception_context.statement)
+
+
+def _add_statement(context, statement: str):
+    start = getattr(context, "_sql_profile_start", None)
+    if start is None:
+        return
+    context._sql_profile_start = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    profile = get_sql_profile()
+    if profile is not None:
+        profile.add(statement, elapsed_ms)
+    if (
+        elapsed_ms >= _settings["slow_ms"]
+        and random.random() < _settings["stack_sample_rate"]
+    ):
+        _settings["logger"].warning(
+            f"slow sql {elapsed_ms:.1f}ms {get_caller_info(traceback.extract_stack())}\n{statement[:1000]}"
+        )
+
+
+def record_sql_profile(app: Flask, profile: SQLProfile):
+    if profile is None:
+        return
+    duplicates = profile.duplicates()
+    with _metrics_lock:
+        item = _metrics.setdefault(
+            profile.endpoint,
+            {
+                "requests": 0,
+                "queries": 0,
+                "db_ms": 0.0,
+                "duplicates": 0,
+                "max_queries": 0,
+            },
+        )
+        item["requests"] += 1
+        item["queries"] += profile.count
+        item["db_ms"] += profile.total_ms
+        item["duplicates"] += duplicates
+        item["max_queries"] = max(item["max_queries"], profile.count)
+    statement, count = profile.top_statement()
+    if count >= _settings["duplicate_threshold"]:
+        app.logger.warning(
+            f"n+1 sql {profile.endpoint}: {count} of {profile.count} queries\n{statement[:1000]}"
+        )
+
+
+# queries per request of each endpoint, since the start of the process
+def get_sql_metrics() -> dict:
+    with _metrics_lock:
+        metrics = {endpoint: dict(item) for endpoint, item in _metrics.items()}
+    for item in metrics.values():
+        item["queries_per_request"] = round(item["queries"] / item["requests"], 2)
+        item["db_ms_per_request"] = round(item["db_ms"] / item["requests"], 2)
+        item["db_ms"] = round(item["db_ms"], 2)
+    return metrics
+
+
+def _set_headers(response: Response, profile: SQLProfile):
+    response.headers["X-SQL-Queries"] = str(profile.count)
+    response.headers["X-SQL-Time-Ms"] = f"{profile.total_ms:.1f}"
+    response.headers["X-SQL-Duplicates"] = str(profile.duplicates())
+
+
+def init_sql_profiler(app: Flask):
+    if str(app.config.get("SQL_PROFILE_ENABLED", "true")).lower() != "true":
+        return
+    _settings["logger"] = app.logger
+    _settings["slow_ms"] = float(app.config.get("SQL_PROFILE_SLOW_MS", 500))
+    _settings["stack_sample_rate"] = float(
+        app.config.get("SQL_PROFILE_STACK_SAMPLE_RATE", 0.1)
+    )
+    _settings["duplicate_threshold"] = int(
+        app.config.get("SQL_PROFILE_DUPLICATE_THRESHOLD", 10)
+    )
+    headers = str(app.config.get("SQL_PROFILE_HEADERS", app.debug)).lower() == "true"
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+    @app.before_request
+    def start_request_sql_profile():
+        rule = request.url_rule.rule if request.url_rule else "unknown"
+        start_sql_profile(f"{request.method} {rule}")
+
+    # a streamed response runs its queries after this, so its headers only
+    # count the queries made before the stream, the metrics count them all
+    @app.after_request
+    def end_request_sql_profile(response: Response):
+        profile = get_sql_profile()
+        if profile is None:
+            return response
+        if headers:
+            _set_headers(response, profile)
+
+        def close():
+            if get_sql_profile() is profile:
+                end_sql_profile()
+            record_sql_profile(app, profile)
+
+        response.call_on_close(close)
+        return response
+
+    app.logger.info("sql profiler enabled")
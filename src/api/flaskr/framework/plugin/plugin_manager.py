@@ -43,7 +43,7 @@ class PluginManager:
         self.extension_functions[target_func_name].append(func)
 
     def execute_extensions(self, func_name, result, *args, **kwargs):
-        self.app.logger.info(f"execute_extensions: {func_name}")
+        self.app.logger.debug("execute_extensions: %s", func_name)
         if func_name in self.extension_functions:
             for func in self.extension_functions[func_name]:
                 result = func(result, *args, **kwargs)
@@ -61,7 +61,7 @@ class PluginManager:
         self.extensible_generic_functions[func_name].append(func)
 
     def execute_extensible_generic(self, func_name, result, *args, **kwargs):
-        self.app.logger.info(f"execute_extensible_generic: {func_name}")
+        self.app.logger.debug("execute_extensible_generic: %s", func_name)
         if func_name in self.extensible_generic_functions:
             for runc in self.extensible_generic_functions[func_name]:
                 while hasattr(runc, "__wrapped__"):
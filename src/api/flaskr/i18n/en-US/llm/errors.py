@@ -3,3 +3,4 @@ SPECIFIED_LLM_NOT_CONFIGURED = (
     "Model {model} is not configured. Check .env file variable: {config_var}"
 )
 MODEL_NOT_SUPPORTED = "Model {model} is not supported"
+PROVIDER_BUSY = "Too many requests to {provider}, please try again later"
@@ -1 +1,2 @@
 MILVUS_NOT_CONFIGURED = "MILVUS is not configured"
+KB_NOT_FOUND = "Knowledge base not found"
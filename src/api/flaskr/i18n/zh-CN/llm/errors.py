@@ -3,3 +3,4 @@ SPECIFIED_LLM_NOT_CONFIGURED = (
     "模型 {model} 没有配置，请检查 .env 中的变量：{config_var}"
 )
 MODEL_NOT_SUPPORTED = "模型 {model} 不支持"
+PROVIDER_BUSY = "{provider} 请求过多，请稍后再试"
@@ -1 +1,2 @@
 MILVUS_NOT_CONFIGURED = "Milvus未配置"
+KB_NOT_FOUND = "知识库不存在"
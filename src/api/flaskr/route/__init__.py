@@ -9,6 +9,7 @@ from .callback import register_callback_handler
 from .test import register_test_routes
 from .rag import register_rag_handler
 from .tag import register_tag_handler
+from .metrics import register_metrics_handler
 
 
 def register_route(app):
@@ -24,4 +25,5 @@ def register_route(app):
     app = register_test_routes(app, prefix + "/test")
     app = register_rag_handler(app, prefix + "/rag")
     app = register_tag_handler(app, prefix + "/tag")
+    app = register_metrics_handler(app, prefix + "/metrics")
     return app
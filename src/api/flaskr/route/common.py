@@ -1,6 +1,6 @@
 import datetime
 from functools import wraps
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from werkzeug.exceptions import HTTPException
 from ..service.common import AppException
 import json
@@ -74,3 +74,12 @@ def make_common_response(data):
         {"code": 0, "message": "success", "data": data}, default=fmt, ensure_ascii=False
     )
     return response
+
+
+# one json document per line, each line is encoded while the response is sent
+def make_ndjson_response(items):
+    def generate():
+        for item in items:
+            yield json.dumps(item, default=fmt, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
@@ -0,0 +1,98 @@
+import hmac
+
+from flask import Flask, Response, request
+from flaskr.common.config import get_config
+from .common import bypass_token_validation, make_common_response
+from ..common.metrics import render_metrics
+from ..dao.profiler import get_sql_metrics
+
+
+# the metrics are only served to the scrapers sending METRICS_TOKEN as a
+# bearer token, and not at all when it is not configured
+def get_metrics_denied_response() -> Response:
+    token = get_config("METRICS_TOKEN", "")
+    if not token:
+        return Response(status=404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(
+        authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")
+    ):
+        return Response(status=401)
+    return None
+
+
+def register_metrics_handler(app: Flask, path_prefix: str) -> Flask:
+    @app.route(path_prefix, methods=["GET"])
+    @bypass_token_validation
+    def get_metrics_api():
+        """
+        获取 Prometheus 格式的监控指标
+        ---
+        tags:
+            - 监控
+        parameters:
+            -   name: Authorization
+                in: header
+                type: string
+                required: true
+                description: Bearer 加配置 METRICS_TOKEN，未配置时接口不可用
+        responses:
+            200:
+                description: 学习步骤及各阶段耗时、LLM 首字耗时、生成耗时、生成速度和 token 数，为本进程启动以来的统计
+                content:
+                    text/plain:
+                        schema:
+                            type: string
+            401:
+                description: Token 错误
+            404:
+                description: 未配置 METRICS_TOKEN
+        """
+        denied = get_metrics_denied_response()
+        if denied is not None:
+            return denied
+        return Response(
+            render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    @app.route(path_prefix + "/sql", methods=["GET"])
+    @bypass_token_validation
+    def get_sql_metrics_api():
+        """
+        获取 SQL 统计
+        ---
+        tags:
+            - 监控
+        parameters:
+            -   name: Authorization
+                in: header
+                type: string
+                required: true
+                description: Bearer 加配置 METRICS_TOKEN，未配置时接口不可用
+        responses:
+            200:
+                description: 本进程启动以来每个接口的请求数、SQL 数、数据库耗时、重复 SQL 数，及每次请求的平均 SQL 数和耗时
+                content:
+                    application/json:
+                        schema:
+                            properties:
+                                code:
+                                    type: integer
+                                    description: 返回码
+                                message:
+                                    type: string
+                                    description: 返回信息
+                                data:
+                                    type: object
+                                    description: 以 "方法 路径" 为键的统计
+            401:
+                description: Token 错误
+            404:
+                description: 未配置 METRICS_TOKEN
+        """
+        denied = get_metrics_denied_response()
+        if denied is not None:
+            return denied
+        return make_common_response(get_sql_metrics())
+
+    return app
@@ -14,7 +14,10 @@ from ..service.rag.funs import (
     get_kb_file_list,
     kb_file_add,
     kb_file_query,
+    get_kb_file_status,
+    kb_file_retry,
     retrieval,
+    get_embedding_cache_stats,
 )
 
 
@@ -596,8 +599,8 @@ def register_rag_handler(app: Flask, path_prefix: str) -> Flask:
                                     type: string
                                     description: 返回信息
                                 data:
-                                    type: list
-                                    description: 测试返回结果
+                                    type: dict
+                                    description: 入库任务信息，job_id 即文件ID，文件在后台入库
         """
         kb_id = request.get_json().get("kb_id", None)
         if not kb_id:
@@ -686,6 +689,78 @@ def register_rag_handler(app: Flask, path_prefix: str) -> Flask:
             )
         )
 
+    @app.route(path_prefix + "/kb-file-status", methods=["GET"])
+    def run_kb_file_status():
+        """
+        查询知识库文件入库进度
+        ---
+        tags:
+        - 知识库
+        parameters:
+            - name: file_id
+              in: query
+              description: 文件ID（入库任务ID）
+              required: true
+              schema:
+                type: string
+        responses:
+            200:
+                description: 操作成功
+                content:
+                    application/json:
+                        schema:
+                            properties:
+                                code:
+                                    type: integer
+                                    description: 返回码
+                                message:
+                                    type: string
+                                    description: 返回信息
+                                data:
+                                    type: dict
+                                    description: 入库状态（0 等待，1 处理中，2 完成，3 失败）和分段进度
+        """
+        file_id = request.args.get("file_id")
+        if not file_id:
+            raise_param_error("file_id is not found")
+        return make_common_response(get_kb_file_status(app, file_id))
+
+    @app.route(path_prefix + "/kb-file-retry", methods=["POST"])
+    def run_kb_file_retry():
+        """
+        重试知识库文件入库，从已完成的分段继续
+        ---
+        tags:
+        - 知识库
+        parameters:
+            - name: file_id
+              in: query
+              description: 文件ID（入库任务ID）
+              required: true
+              schema:
+                type: string
+        responses:
+            200:
+                description: 操作成功
+                content:
+                    application/json:
+                        schema:
+                            properties:
+                                code:
+                                    type: integer
+                                    description: 返回码
+                                message:
+                                    type: string
+                                    description: 返回信息
+                                data:
+                                    type: dict
+                                    description: 入库任务信息
+        """
+        file_id = request.get_json().get("file_id")
+        if not file_id:
+            raise_param_error("file_id is not found")
+        return make_common_response(kb_file_retry(app, file_id))
+
     @app.route(path_prefix + "/retrieval", methods=["POST"])
     def run_retrieval():
         """
@@ -697,9 +772,15 @@ def register_rag_handler(app: Flask, path_prefix: str) -> Flask:
             - name: kb_id
               in: query
               description: 知识库ID
-              required: true
+              required: false
               schema:
                 type: string
+            - name: kb_id_list
+              in: query
+              description: 知识库ID列表，同时检索多个知识库并按相似度合并结果
+              required: false
+              schema:
+                type: list
             - name: query
               in: query
               description: 查询文本
@@ -739,10 +820,11 @@ def register_rag_handler(app: Flask, path_prefix: str) -> Flask:
                                     description: 返回信息
                                 data:
                                     type: string
-                                    description: 检索结果
+                                    description: 检索结果，传入 kb_id_list 时返回检索文本、命中列表和各阶段耗时
         """
         kb_id = request.get_json().get("kb_id")
-        if not kb_id:
+        kb_id_list = request.get_json().get("kb_id_list", [])
+        if not kb_id and not kb_id_list:
             raise_param_error("kb_id is not found")
         query = request.get_json().get("query")
         if not query:
@@ -751,16 +833,44 @@ def register_rag_handler(app: Flask, path_prefix: str) -> Flask:
         limit = request.get_json().get("limit", 3)
         output_fields = request.get_json().get("output_fields", ["text"])
         app.logger.info(f"kb_id: {kb_id}")
+        app.logger.info(f"kb_id_list: {kb_id_list}")
         app.logger.info(f"query: {query}")
-        return make_common_response(
-            retrieval(
-                app,
-                kb_id,
-                query,
-                my_filter,
-                limit,
-                output_fields,
-            )
+        result = retrieval(
+            app,
+            kb_id_list if kb_id_list else [kb_id],
+            query,
+            my_filter,
+            limit,
+            output_fields,
         )
+        if kb_id_list:
+            return make_common_response(result)
+        return make_common_response(result.text)
+
+    @app.route(path_prefix + "/embedding-cache-stats", methods=["GET"])
+    def run_embedding_cache_stats():
+        """
+        查询向量缓存命中情况
+        ---
+        tags:
+        - 知识库
+        responses:
+            200:
+                description: 操作成功
+                content:
+                    application/json:
+                        schema:
+                            properties:
+                                code:
+                                    type: integer
+                                    description: 返回码
+                                message:
+                                    type: string
+                                    description: 返回信息
+                                data:
+                                    type: object
+                                    description: 当前进程的 LRU 命中数、Redis 命中数、未命中数和命中率
+        """
+        return make_common_response(get_embedding_cache_stats(app))
 
     return app
@@ -1,5 +1,6 @@
 from flask import Flask, Response, request
-from flaskr.route.common import make_common_response
+from flaskr.common.config import get_config
+from flaskr.route.common import make_common_response, make_ndjson_response
 from flaskr.service.common.models import raise_param_error
 from flaskr.service.study import (
     get_lesson_tree_to_study,
@@ -8,10 +9,23 @@ from flaskr.service.study import (
     get_script_info,
     reset_user_study_info_by_lesson,
     set_script_content_operation,
+    StudyRecordDTO,
 )
 from flaskr.service.study.const import VALID_INTERACTION_TYPES
 
 
+def get_record_limit(limit: str) -> int:
+    if limit is None or limit == "":
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise_param_error("limit")
+    if limit <= 0:
+        raise_param_error("limit")
+    return limit
+
+
 def register_study_handler(app: Flask, path_prefix: str) -> Flask:
     @app.route(path_prefix + "/run", methods=["POST"])
     def run_lesson_script():
@@ -49,6 +63,10 @@ def register_study_handler(app: Flask, path_prefix: str) -> Flask:
                             type: boolean
                             default: false
                             description: 预览模式
+                        stream_mode:
+                            type: string
+                            enum: [char, word, sentence, instant]
+                            description: 固定内容的输出方式（默认为配置 FIX_OUTPUT_STREAM_MODE，预览模式默认为 instant）
         responses:
             200:
                 description: 返回脚本运行结果
@@ -65,6 +83,7 @@ def register_study_handler(app: Flask, path_prefix: str) -> Flask:
         input = request.get_json().get("input", None)
         input_type = request.get_json().get("input_type", "start")
         preview_mode = request.get_json().get("preview_mode", False)
+        stream_mode = request.get_json().get("stream_mode", None)
         if course_id == "":
             course_id = None
         user_id = request.user.user_id
@@ -81,6 +100,7 @@ def register_study_handler(app: Flask, path_prefix: str) -> Flask:
                     script_id=script_id,
                     log_id=log_id,
                     preview_mode=preview_mode,
+                    stream_mode=stream_mode,
                 ),
                 headers={"Cache-Control": "no-cache"},
                 mimetype="text/event-stream",
@@ -166,10 +186,67 @@ def register_study_handler(app: Flask, path_prefix: str) -> Flask:
         preview_mode = request.args.get("preview_mode", "False").lower() == "true"
         if not lesson_id:
             raise_param_error("lesson_id is not found")
+        limit = get_record_limit(request.args.get("limit", None))
+        before = request.args.get("before", None)
         user_id = request.user.user_id
         return make_common_response(
-            get_study_record(app, user_id, lesson_id, preview_mode)
+            get_study_record(app, user_id, lesson_id, preview_mode, limit, before)
+        )
+
+    @app.route(path_prefix + "/lesson-study-records", methods=["GET"])
+    def get_lesson_study_records():
+        """
+        分页获取课程学习记录
+        ---
+        tags:
+        - 学习
+        parameters:
+        -   name: lesson_id
+            in: query
+            type: string
+            required: true
+            description: 课时ID
+        -   name: limit
+            in: query
+            type: integer
+            required: false
+            description: 记录条数，默认 STUDY_RECORD_PAGE_SIZE
+        -   name: before
+            in: query
+            type: string
+            required: false
+            description: 获取此记录(log id)之前的记录，为空时获取最新的记录
+        responses:
+            200:
+                description: |
+                    NDJSON，每行一个记录 {"type":"record","data":StudyRecordItemDTO}，
+                    最后一行为 {"type":"page","data":{ui,ask_mode,ask_ui,teach_avator,has_more,next_cursor}}
+                content:
+                    application/x-ndjson:
+                        schema:
+                            $ref: "#/components/schemas/StudyRecordItemDTO"
+            400:
+                description: 参数错误
+        """
+        lesson_id = request.args.get("lesson_id")
+        preview_mode = request.args.get("preview_mode", "False").lower() == "true"
+        if not lesson_id:
+            raise_param_error("lesson_id is not found")
+        limit = get_record_limit(
+            request.args.get("limit", get_config("STUDY_RECORD_PAGE_SIZE", "50"))
         )
+        before = request.args.get("before", None)
+        user_id = request.user.user_id
+        record = get_study_record(
+            app, user_id, lesson_id, preview_mode, limit, before
+        ) or StudyRecordDTO([])
+
+        def lines():
+            for item in record.records:
+                yield {"type": "record", "data": item}
+            yield {"type": "page", "data": record.get_page_info()}
+
+        return make_ndjson_response(lines())
 
     @app.route(path_prefix + "/get-lesson-study-progress", methods=["GET"])
     def get_lesson_study_progress():
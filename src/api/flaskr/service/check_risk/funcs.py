@@ -1,11 +1,11 @@
 from flask import Flask
-from ...dao import db
-from .models import RiskControlResult
+from .writer import enqueue_risk_control_result
 from flaskr.api.check import check_text, CHECK_RESULT_REJECT, CHECK_RESULT_PASS
 from flaskr.service.common.models import raise_error
 from datetime import datetime
 
 
+# the result is written by the background writer, not in the request
 def add_risk_control_result(
     app: Flask,
     chat_id,
@@ -17,20 +17,22 @@ def add_risk_control_result(
     is_pass,
     check_strategy,
 ):
-    with app.app_context():
-        risk_control_result = RiskControlResult(
-            chat_id=chat_id,
-            user_id=user_id,
-            text=text,
-            check_vendor=check_vendor,
-            check_result=check_result,
-            check_resp=check_resp,
-            is_pass=is_pass,
-            check_strategy=check_strategy,
-        )
-        db.session.add(risk_control_result)
-        db.session.commit()
-        return risk_control_result.id
+    now = datetime.now()
+    enqueue_risk_control_result(
+        app,
+        {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "text": text,
+            "check_vendor": check_vendor,
+            "check_result": check_result,
+            "check_resp": check_resp,
+            "is_pass": is_pass,
+            "check_strategy": check_strategy,
+            "created": now,
+            "updated": now,
+        },
+    )
 
 
 def check_text_with_risk_control(app: Flask, check_id, user_id, text):
@@ -0,0 +1,258 @@
+import atexit
+import json
+import os
+import queue
+import tempfile
+import threading
+from datetime import datetime
+
+from flask import Flask, current_app
+from sqlalchemy.exc import (
+    InterfaceError,
+    InternalError,
+    OperationalError,
+    ProgrammingError,
+)
+
+from ...common.config import get_config
+from ...dao import db
+from .models import RiskControlResult
+
+# the risk control results are written behind the request: they are queued in
+# memory and inserted in batches by a background thread (a greenlet under the
+# gevent worker), when the queue is full or the database fails the rows are
+# appended to a spill file, which is loaded again after the next good batch,
+# the rows the database rejects are moved to a dead letter file
+_queue = None
+_queue_lock = threading.Lock()
+_writer_lock = threading.Lock()
+_writer_thread = None
+_spill_lock = threading.Lock()
+
+_DATETIME_FIELDS = ("created", "updated")
+
+# errors of the database itself, the rows are written again later
+_TRANSIENT_ERRORS = (OperationalError, InterfaceError, InternalError, ProgrammingError)
+
+
+def _get_queue() -> queue.Queue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = queue.Queue(
+                    maxsize=int(get_config("RISK_CONTROL_QUEUE_SIZE", "10000"))
+                )
+    return _queue
+
+
+def _get_batch_size() -> int:
+    return int(get_config("RISK_CONTROL_BATCH_SIZE", "100"))
+
+
+def _get_spill_path() -> str:
+    path = get_config("RISK_CONTROL_SPILL_PATH", "")
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), "ai-shifu-risk-control.jsonl")
+    return path
+
+
+def _get_dead_letter_path() -> str:
+    return get_config("RISK_CONTROL_DEAD_LETTER_PATH", "") or (
+        _get_spill_path() + ".dead"
+    )
+
+
+def _dump_row(row: dict, error: str = None) -> str:
+    item = dict(row)
+    for field in _DATETIME_FIELDS:
+        if isinstance(item.get(field), datetime):
+            item[field] = item[field].isoformat()
+    if error is not None:
+        item["error"] = error
+    return json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+
+def _append_lines(path: str, lines: list):
+    with _spill_lock:
+        with open(path, "a", encoding="UTF-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _spill(app: Flask, rows: list):
+    if not rows:
+        return
+    try:
+        _append_lines(_get_spill_path(), [_dump_row(row) for row in rows])
+        app.logger.warning(f"spill risk control results: {len(rows)}")
+    except Exception as e:
+        app.logger.error(f"spill risk control results error: {e}, rows: {rows}")
+
+
+# lines of the rows, or of the spilled lines, that will never be inserted
+def _dead_letter(app: Flask, lines: list):
+    if not lines:
+        return
+    try:
+        _append_lines(_get_dead_letter_path(), lines)
+        app.logger.error(f"dead letter risk control results: {len(lines)}")
+    except Exception as e:
+        app.logger.error(f"dead letter risk control results error: {e}, {lines}")
+
+
+def _load_spill(app: Flask, path: str) -> list:
+    rows = []
+    bad_lines = []
+    with open(path, "r", encoding="UTF-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                for field in _DATETIME_FIELDS:
+                    row[field] = datetime.fromisoformat(row[field])
+            except Exception:
+                bad_lines.append(line if line.endswith("\n") else line + "\n")
+                continue
+            rows.append(row)
+    _dead_letter(app, bad_lines)
+    return rows
+
+
+def _insert(app: Flask, rows: list) -> Exception:
+    with app.app_context():
+        try:
+            db.session.bulk_insert_mappings(RiskControlResult, rows)
+            db.session.commit()
+            return None
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"insert risk control results error: {e}")
+            return e
+
+
+# returns the rows to write again later, a batch rejected by the database is
+# inserted row by row, so one bad row does not hold back the others
+def _write(app: Flask, rows: list) -> list:
+    error = _insert(app, rows)
+    if error is None:
+        return []
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return rows
+    dead_lines = []
+    if len(rows) == 1:
+        dead_lines.append(_dump_row(rows[0], str(error)))
+    else:
+        for index, row in enumerate(rows):
+            error = _insert(app, [row])
+            if error is None:
+                continue
+            if isinstance(error, _TRANSIENT_ERRORS):
+                _dead_letter(app, dead_lines)
+                return rows[index:]
+            dead_lines.append(_dump_row(row, str(error)))
+    _dead_letter(app, dead_lines)
+    return []
+
+
+# the spill file is renamed before it is loaded,
+# so each worker process takes its own part of it
+def _replay_spill(app: Flask):
+    path = _get_spill_path()
+    if not os.path.exists(path):
+        return
+    replay_path = f"{path}.{os.getpid()}.replay"
+    try:
+        with _spill_lock:
+            os.replace(path, replay_path)
+        rows = _load_spill(app, replay_path)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        app.logger.error(f"load risk control spill error: {e}")
+        return
+    batch_size = _get_batch_size()
+    for start in range(0, len(rows), batch_size):
+        end = start + batch_size
+        remaining = _write(app, rows[start:end])
+        if remaining:
+            _spill(app, remaining + rows[end:])
+            break
+    os.remove(replay_path)
+    app.logger.info(f"replay risk control results: {len(rows)}")
+
+
+def flush_risk_control_results(app: Flask, timeout: float = None) -> int:
+    result_queue = _get_queue()
+    rows = []
+    try:
+        rows.append(
+            result_queue.get(timeout=timeout) if timeout else result_queue.get_nowait()
+        )
+        while len(rows) < _get_batch_size():
+            rows.append(result_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if not rows:
+        return 0
+    remaining = _write(app, rows)
+    if remaining:
+        _spill(app, remaining)
+    else:
+        _replay_spill(app)
+    return len(rows)
+
+
+def _run_writer(app: Flask):
+    app.logger.info("risk control writer started")
+    if not get_config("RISK_CONTROL_SPILL_PATH", ""):
+        app.logger.warning(
+            f"RISK_CONTROL_SPILL_PATH not configured, spilling to {_get_spill_path()}, which may not outlive the container"
+        )
+    while True:
+        try:
+            # an idle writer loads the rows spilled by any process
+            if not flush_risk_control_results(app, timeout=5):
+                _replay_spill(app)
+        except Exception as e:
+            app.logger.error(f"risk control writer error: {e}")
+
+
+def _start_writer(app: Flask):
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is not None:
+            return
+        app = current_app._get_current_object() if app is current_app else app
+        _writer_thread = threading.Thread(
+            target=_run_writer,
+            args=(app,),
+            name="risk-control-writer",
+            daemon=True,
+        )
+        _writer_thread.start()
+        atexit.register(_spill_queue, app)
+
+
+# the rows left in the queue at exit go to the spill file
+def _spill_queue(app: Flask):
+    result_queue = _get_queue()
+    rows = []
+    try:
+        while True:
+            rows.append(result_queue.get_nowait())
+    except queue.Empty:
+        pass
+    _spill(app, rows)
+
+
+def enqueue_risk_control_result(app: Flask, row: dict):
+    _start_writer(app)
+    try:
+        _get_queue().put_nowait(row)
+    except queue.Full:
+        _spill(app, [row])
@@ -82,6 +82,7 @@ ERROR_CODE = {
     "LLM.NO_DEFAULT_LLM": 8001,
     "LLM.SPECIFIED_LLM_NOT_CONFIGURED": 8002,
     "LLM.MODEL_NOT_SUPPORTED": 8003,
+    "LLM.PROVIDER_BUSY": 8004,
     # api errors
     "API.ALIBABA_CLOUD_NOT_CONFIGURED": 9001,
     "SCENARIO.NO_PERMISSION": 9002,
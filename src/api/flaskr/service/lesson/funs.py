@@ -2,25 +2,25 @@ from flaskr.common.swagger import register_schema_to_swagger
 from flaskr.service.common.models import raise_error
 from .models import AICourse, AILesson, AILessonScript
 from .const import (
-    ASK_MODE_DEFAULT,
     ASK_MODE_ENABLE,
-    CONTENT_TYPE_TEXT,
     CONTENT_TYPES,
     LESSON_TYPE_NORMAL,
-    SCRIPT_TYPE_FIX,
     SCRIPT_TYPES,
-    UI_TYPE_EMPTY,
-    UI_TYPE_SELECTION,
     UI_TYPES,
     STATUS_PUBLISH,
     STATUS_DRAFT,
 )
 from flask import Flask
 from ...dao import db
-from flaskr.api.doc.feishu import list_records
+from .graph import bump_course_graph_version
+from .importer import (
+    LessonTableImport,
+    iter_feishu_record_pages,
+    prefetch_record_pages,
+    read_record_pages,
+)
 from flaskr.util.uuid import generate_id
 from sqlalchemy import func, text
-import json
 from flaskr.framework.plugin.plugin_manager import extensible
 
 
@@ -328,9 +328,6 @@ def update_lesson_info(
             course.course_desc = "Demo Lesson"
             db.session.add(course)
         course_id = course.course_id
-        page_token = None
-        lesson = None
-        unconf_fields = []
 
         lessonNo = str(index).zfill(2)
         db.session.execute(
@@ -375,178 +372,32 @@ def update_lesson_info(
                 parent_lesson.pre_lesson_no = str(int(index) - 1).zfill(2)
             else:
                 parent_lesson.pre_lesson_no = ""
-        subIndex = 0
-        childLessons = [AILesson]
-        script_index = 0
         kwargs = {}
         if app_id is not None:
             kwargs["app_id"] = app_id
         if app_secret is not None:
             kwargs["app_secret"] = app_secret
-        while True:
-            if file_name:
-                with open(file_name, "r", encoding="UTF-8") as json_file:
-                    json_data = json_file.read()
-                    resp = json.loads(json_data)
-            else:
-                resp = list_records(
-                    app,
-                    doc_id,
-                    table_id,
-                    view_id=view_id,
-                    page_token=page_token,
-                    page_size=100,
-                    **kwargs
-                )
-                # with open(lessonNo+".json", "w") as f:
-                #     json.dump(resp,f, ensure_ascii=False)
-
-            records = resp["data"]["items"]
-            app.logger.info("records:" + str(len(records)))
-            for record in records:
-                if record["fields"].get("小节", None):
-                    title = "".join(t["text"] for t in record["fields"]["小节"]).strip()
-                    if title is None:
-                        app.logger.info("title is None")
-                    if title is None or title == "" and lesson is not None:
-                        pass
-                    else:
-                        lesson = next(
-                            (
-                                tl
-                                for tl in childLessons
-                                if hasattr(tl, "lesson_name")
-                                and tl.lesson_name == title
-                            ),
-                            None,
-                        )
-                else:
-                    lesson = parent_lesson
-                if lesson is None:
-                    # 新来的一个小节
-                    script_index = 0
-                    subIndex = subIndex + 1
-                    lesson = AILesson.query.filter(
-                        AILesson.course_id == course_id,
-                        AILesson.lesson_feishu_id == table_id,
-                        AILesson.lesson_name == title,
-                    ).first()
-                    if lesson is None:
-                        lesson = AILesson()
-                        lesson.lesson_id = str(generate_id(app))
-                        lesson.course_id = course.course_id
-                        lesson.lesson_name = title
-                        lesson.lesson_desc = ""
-                        lesson.status = 1
-                        lesson.lesson_feishu_id = table_id
-                        lesson.lesson_no = lessonNo + str(subIndex).zfill(2)
-                        lesson.lesson_type = lesson_type
-                        lesson.parent_id = parent_lesson.lesson_id
-                        lesson.lesson_index = subIndex
-                        if subIndex > 1:
-                            lesson.pre_lesson_no = lessonNo + str(subIndex - 1).zfill(2)
-                        else:
-                            lesson.pre_lesson_no = ""
-                        db.session.add(lesson)
-                    else:
-                        lesson.lesson_name = title
-                        lesson.lesson_desc = ""
-                        lesson.status = 1
-                        lesson.lesson_feishu_id = table_id
-                        lesson.lesson_type = lesson_type
-                        lesson.parent_id = parent_lesson.lesson_id
-                        lesson.lesson_no = lessonNo + str(subIndex).zfill(2)
-                        lesson.lesson_index = subIndex
-                        if subIndex > 1:
-                            lesson.pre_lesson_no = lessonNo + str(subIndex - 1).zfill(2)
-                        else:
-                            lesson.pre_lesson_no = ""
-                    db.session.execute(
-                        text(
-                            "update ai_lesson_script set status=0 where lesson_id=:lesson_id"
-                        ),
-                        {"lesson_id": lesson.lesson_id},
-                    )
-                    childLessons.append(lesson)
-                script_index = script_index + 1
-                record_id = record["record_id"]
-                scripDb = {}
-                scripDb["script_feishu_id"] = str(record_id)
-                scripDb["lesson_id"] = lesson.lesson_id
-                scripDb["script_desc"] = ""
-                scripDb["script_prompt"] = ""
-                scripDb["script_ui_profile"] = ""
-                scripDb["script_end_action"] = ""
-                scripDb["script_other_conf"] = ""
-                scripDb["script_profile"] = ""
-                scripDb["script_media_url"] = ""
-                scripDb["script_ui_content"] = ""
-                scripDb["script_check_prompt"] = ""
-                scripDb["script_check_flag"] = ""
-                scripDb["script_index"] = script_index
-                scripDb["script_ui_type"] = UI_TYPE_EMPTY
-                scripDb["script_type"] = SCRIPT_TYPE_FIX
-                scripDb["script_content_type"] = CONTENT_TYPE_TEXT
-                scripDb["script_model"] = ""
-                scripDb["status"] = 1
-                scripDb["script_temprature"] = 0.4
-                scripDb["ask_count_limit"] = 5
-                scripDb["ask_mode"] = ASK_MODE_DEFAULT
-                scripDb["ask_prompt"] = ""
-                scripDb["ask_with_history"] = 5
-                scripDb["ask_model"] = ""
-                scripDb["script_ui_profile_id"] = ""
-                for field in record["fields"]:
-                    val_obj = record["fields"][field]
-                    db_field = DB_SAVE_MAP.get(field.strip())
-                    val = ""
-                    if isinstance(val_obj, str):
-                        val = val_obj
-                    elif isinstance(val_obj, list):
-                        val = "".join(
-                            t["text"] if isinstance(t, dict) else "[" + t + "]"
-                            for t in val_obj
-                        )
-                    elif isinstance(val_obj, dict):
-                        val = val_obj.get("text")
-                    else:
-                        app.logger.info("val_obj:" + str(val_obj))
-                        val = str(val_obj)
-                    if db_field:
-                        if field in DB_SAVE_DICT_MAP:
-                            orig_val = val
-                            val = DB_SAVE_DICT_MAP[field.strip()].get(orig_val.strip())
-                            if val is None:
-                                app.logger.info(
-                                    "val is None:" + field + ",value:" + orig_val
-                                )
-                        if val is not None and val != "":
-                            scripDb[db_field] = val
-                    else:
-                        if unconf_fields.count(field) == 0:
-                            unconf_fields.append(field)
-                    continue
-                scrip = AILessonScript.query.filter(
-                    AILessonScript.script_feishu_id == record_id,
-                    AILessonScript.lesson_id == lesson.lesson_id,
-                ).first()
-                if scripDb["script_ui_type"] == UI_TYPE_SELECTION:
-                    data = scripDb["script_ui_content"]
-                    app.logger.info("data:" + str(data))
-
-                if scrip is None:
-                    scripDb["script_id"] = str(generate_id(app))
-                    db.session.add(AILessonScript(**scripDb))
-                else:
-                    for key in scripDb:
-                        setattr(scrip, key, scripDb[key])
-
-            if resp["data"]["has_more"]:
-                page_token = resp["data"]["page_token"]
-            else:
-                break
-        app.logger.info("unconf_fields:" + str(unconf_fields))
+        if file_name:
+            pages = read_record_pages(file_name)
+        else:
+            pages = prefetch_record_pages(
+                app,
+                iter_feishu_record_pages(app, doc_id, table_id, view_id, **kwargs),
+            )
+        table_import = LessonTableImport(
+            app,
+            course_id,
+            table_id,
+            lesson_type,
+            parent_lesson,
+            DB_SAVE_MAP,
+            DB_SAVE_DICT_MAP,
+        )
+        for page in pages:
+            table_import.import_page(page)
+        table_import.save()
         db.session.commit()
+        bump_course_graph_version(app, course_id)
         return
 
 
@@ -642,6 +493,8 @@ def delete_lesson(app: Flask, table_id: str, course_id: str, lesson_no: str):
         for lesson in lessons:
             lesson.status = 0
         db.session.commit()
+        for course_id in {lesson.course_id for lesson in lessons}:
+            bump_course_graph_version(app, course_id)
         return True
 
 
@@ -671,6 +524,7 @@ def update_lesson_ask_info(
         lesson.lesson_summary_multi_language = lesson_summary_multi_language
         lesson.ask_mode = ASK_MODE_ENABLE
         db.session.commit()
+        bump_course_graph_version(app, lesson.course_id)
         return True
 
 
@@ -0,0 +1,374 @@
+import threading
+from collections import OrderedDict
+
+from flask import Flask, g
+
+from .const import (
+    ASK_MODE_DEFAULT,
+    ASK_MODE_DISABLE,
+    LESSON_TYPE_BRANCH_HIDDEN,
+    SCRIPT_TYPE_SYSTEM,
+    STATUS_PUBLISH,
+    UI_TYPE_BUTTON,
+    UI_TYPE_EMPTY,
+)
+from .models import AICourse, AILesson, AILessonScript
+from ...common.config import get_config
+from ...dao import db, redis_client as redis
+
+
+# the lesson tree shown to a student: (lesson, children) nodes of the chapters
+# the lessons are ordered by (len(lesson_no), lesson_no), the first lesson of
+# a lesson_no wins and a lesson without a parent lesson_no is left out
+def build_lesson_tree(lessons: list[AILesson]) -> list[tuple]:
+    nodes = {}
+    tree = []
+    for lesson in lessons:
+        if lesson.lesson_no in nodes:
+            continue
+        node = (lesson, [])
+        nodes[lesson.lesson_no] = node
+        if len(lesson.lesson_no) == 2:
+            tree.append(node)
+        else:
+            parent = nodes.get(lesson.lesson_no[:-2])
+            if parent is not None:
+                parent[1].append(node)
+    return tree
+
+
+# compiled, read-only graph of the published content of a course
+# it is held by each worker process and keyed by the publish version,
+# so a study step can resolve lessons, scripts and settings without
+# sending any content query to the database
+class CourseGraph:
+    course_id: str
+    version: int
+    course: AICourse
+
+    def __init__(
+        self,
+        course_id: str,
+        version: int,
+        course: AICourse,
+        lessons: list[AILesson],
+        scripts: list[AILessonScript],
+    ):
+        self.course_id = course_id
+        self.version = version
+        self.course = course
+        # all the published rows, newest first
+        self.lesson_rows = sorted(lessons, key=lambda x: x.id, reverse=True)
+        self.lessons = {}
+        self.lessons_by_no = {}
+        for lesson in self.lesson_rows:
+            self.lessons.setdefault(lesson.lesson_id, lesson)
+            self.lessons_by_no.setdefault(lesson.lesson_no, lesson)
+
+        # the skeleton of the lesson tree to study, shared by all the users,
+        # only the attend status of each user is laid over it per request
+        self.study_lessons = sorted(
+            [
+                lesson
+                for lesson in self.lesson_rows
+                if lesson.lesson_type != LESSON_TYPE_BRANCH_HIDDEN
+            ],
+            key=lambda x: (len(x.lesson_no), x.lesson_no),
+        )
+        self.study_lesson_map = {x.lesson_id: x for x in self.study_lessons}
+        self.study_tree = build_lesson_tree(self.study_lessons)
+
+        # children grouped by the parent lesson_no, ordered by lesson_no
+        self.children = {}
+        for lesson in self.lessons.values():
+            if lesson.lesson_no and len(lesson.lesson_no) >= 2:
+                self.children.setdefault(lesson.lesson_no[:-2], []).append(lesson)
+        for children in self.children.values():
+            children.sort(key=lambda x: x.lesson_no)
+
+        self.scripts = {}
+        self.scripts_by_id = {}
+        self.system_prompts = {}
+        last_scripts = {}
+        for script in sorted(scripts, key=lambda x: x.id, reverse=True):
+            last = last_scripts.get(script.lesson_id)
+            if last is None or (script.script_index, script.id) > (
+                last.script_index,
+                last.id,
+            ):
+                last_scripts[script.lesson_id] = script
+            if script.script_type == SCRIPT_TYPE_SYSTEM:
+                self.system_prompts.setdefault(script.lesson_id, script.script_prompt)
+                continue
+            lesson_scripts = self.scripts.setdefault(script.lesson_id, {})
+            lesson_scripts.setdefault(script.script_index, script)
+            self.scripts_by_id.setdefault(script.script_id, script)
+
+        # the last lesson of each chapter and its last script,
+        # keyed by the chapter lesson_no
+        self.last_lesson_scripts = {}
+        last_lessons = {}
+        for lesson in self.lesson_rows:
+            if not lesson.lesson_no or len(lesson.lesson_no) < 2:
+                continue
+            parent_no = lesson.lesson_no[:-2]
+            last = last_lessons.get(parent_no)
+            if last is None or (lesson.lesson_no, lesson.id) > (
+                last.lesson_no,
+                last.id,
+            ):
+                last_lessons[parent_no] = lesson
+        for parent_no, lesson in last_lessons.items():
+            self.last_lesson_scripts[parent_no] = (
+                lesson.lesson_id,
+                last_scripts.get(lesson.lesson_id),
+            )
+
+        self.model_settings = {}
+        self.follow_ups = {}
+        for script in self.scripts_by_id.values():
+            self.model_settings[script.script_id] = self._resolve_model_setting(script)
+            self.follow_ups[script.script_id] = self._resolve_follow_up(script)
+
+    def _resolve_model_setting(self, script: AILessonScript) -> dict:
+        if script.script_model and script.script_model.strip():
+            return {
+                "model_name": script.script_model,
+                "model_args": {"temperature": script.script_temprature},
+            }
+        lesson = self.lessons.get(script.lesson_id)
+        if (
+            lesson
+            and lesson.lesson_default_model
+            and lesson.lesson_default_model.strip()
+        ):
+            return {
+                "model_name": lesson.lesson_default_model,
+                "model_args": {"temperature": lesson.lesson_default_temprature},
+            }
+        if (
+            self.course
+            and self.course.course_default_model
+            and self.course.course_default_model.strip()
+        ):
+            return {
+                "model_name": self.course.course_default_model,
+                "model_args": {"temperature": self.course.course_default_temprature},
+            }
+        # fall back to the default model of the app
+        return None
+
+    def _resolve_follow_up(self, script: AILessonScript) -> dict:
+        if script.ask_mode != ASK_MODE_DEFAULT:
+            return self._make_follow_up(script, script.ask_mode)
+        lesson = self.lessons.get(script.lesson_id)
+        if not lesson:
+            return {
+                "ask_model": "",
+                "ask_prompt": "",
+                "ask_history_count": 0,
+                "ask_limit_count": 0,
+                "model_args": {},
+                "ask_mode": ASK_MODE_DISABLE,
+            }
+        if lesson.ask_mode != ASK_MODE_DEFAULT:
+            return self._make_follow_up(lesson, lesson.ask_mode)
+        parent_lesson = self.lessons_by_no.get((lesson.lesson_no or "")[:2])
+        if parent_lesson and parent_lesson.ask_mode != ASK_MODE_DEFAULT:
+            return self._make_follow_up(parent_lesson, parent_lesson.ask_mode)
+        if not self.course:
+            return self._make_follow_up(lesson, lesson.ask_mode)
+        return self._make_follow_up(self.course, self.course.ask_mode)
+
+    @staticmethod
+    def _make_follow_up(item, ask_mode: int) -> dict:
+        return {
+            "ask_model": item.ask_model,
+            "ask_prompt": item.ask_prompt,
+            "ask_history_count": item.ask_with_history,
+            "ask_limit_count": item.ask_count_limit,
+            "model_args": {},
+            "ask_mode": ask_mode,
+        }
+
+    def owns(self, script_info: AILessonScript) -> bool:
+        return (
+            script_info is not None
+            and self.scripts_by_id.get(script_info.script_id) is script_info
+        )
+
+    def get_lesson(self, lesson_id: str) -> AILesson:
+        return self.lessons.get(lesson_id)
+
+    def get_lesson_by_no(self, lesson_no: str) -> AILesson:
+        return self.lessons_by_no.get(lesson_no)
+
+    def get_children(self, lesson_no: str) -> list[AILesson]:
+        return self.children.get(lesson_no, [])
+
+    # the published rows whose lesson_no starts with the prefix, newest first
+    def get_lessons_by_prefix(self, prefix: str) -> list[AILesson]:
+        return [
+            lesson
+            for lesson in self.lesson_rows
+            if lesson.lesson_no and lesson.lesson_no.startswith(prefix)
+        ]
+
+    def get_script(self, lesson_id: str, script_index: int) -> AILessonScript:
+        return self.scripts.get(lesson_id, {}).get(script_index)
+
+    def get_script_by_id(self, script_id: str) -> AILessonScript:
+        return self.scripts_by_id.get(script_id)
+
+    def get_lesson_system(self, lesson_id: str) -> str:
+        if lesson_id in self.system_prompts:
+            return self.system_prompts[lesson_id]
+        lesson = self.lessons.get(lesson_id)
+        if lesson and lesson.lesson_no and len(lesson.lesson_no) > 2:
+            parent_lesson = self.lessons_by_no.get(lesson.lesson_no[:2])
+            if parent_lesson:
+                return self.system_prompts.get(parent_lesson.lesson_id)
+        return None
+
+    def is_last_script(self, script_info: AILessonScript, lesson_no: str) -> bool:
+        parent_no = lesson_no
+        if len(parent_no) > 2:
+            parent_no = parent_no[:2]
+        last_lesson_id, last_script = self.last_lesson_scripts.get(
+            parent_no, (None, None)
+        )
+        return (
+            last_lesson_id == script_info.lesson_id
+            and last_script is not None
+            and last_script.script_id == script_info.script_id
+            and last_script.script_ui_type in [UI_TYPE_BUTTON, UI_TYPE_EMPTY]
+        )
+
+    def get_model_setting(self, script_id: str) -> dict:
+        return self.model_settings.get(script_id)
+
+    def get_follow_up(self, script_id: str) -> dict:
+        return self.follow_ups.get(script_id)
+
+
+_graphs = OrderedDict()
+_lesson_courses = {}
+_graph_lock = threading.Lock()
+
+
+def _get_version_key(course_id: str) -> str:
+    return (
+        get_config("REDIS_KEY_PREFIX", "ai-shifu:")
+        + "course_graph_version:"
+        + course_id
+    )
+
+
+# the version is read once per app context, a study step runs in its own
+# app context so it pays a single redis GET for the whole step
+def get_course_graph_version(app: Flask, course_id: str) -> int:
+    versions = g.setdefault("course_graph_versions", {})
+    if course_id not in versions:
+        version = redis.get(_get_version_key(course_id))
+        versions[course_id] = int(version) if version else 0
+    return versions[course_id]
+
+
+# bump the publish version of the course,
+# every worker rebuilds its graph on the next access
+def bump_course_graph_version(app: Flask, course_id: str) -> int:
+    version = redis.incr(_get_version_key(course_id))
+    versions = g.get("course_graph_versions", None)
+    if versions is not None:
+        versions.pop(course_id, None)
+    app.logger.info(f"bump course graph version: {course_id} {version}")
+    return version
+
+
+def _snapshot(row):
+    obj = row.clone()
+    obj.id = row.id
+    return obj
+
+
+def build_course_graph(app: Flask, course_id: str, version: int) -> CourseGraph:
+    course = (
+        AICourse.query.filter(
+            AICourse.course_id == course_id,
+            AICourse.status == STATUS_PUBLISH,
+        )
+        .order_by(AICourse.id.desc())
+        .first()
+    )
+    lessons = AILesson.query.filter(
+        AILesson.course_id == course_id,
+        AILesson.status == STATUS_PUBLISH,
+    ).all()
+    lesson_ids = list({lesson.lesson_id for lesson in lessons})
+    scripts = []
+    if lesson_ids:
+        scripts = AILessonScript.query.filter(
+            AILessonScript.lesson_id.in_(lesson_ids),
+            AILessonScript.status == STATUS_PUBLISH,
+        ).all()
+    # the graph is shared across requests, so it must not hold any row
+    # attached to the session of the request that built it
+    graph = CourseGraph(
+        course_id,
+        version,
+        _snapshot(course) if course else None,
+        [_snapshot(lesson) for lesson in lessons],
+        [_snapshot(script) for script in scripts],
+    )
+    app.logger.info(
+        f"build course graph: {course_id} version:{version} "
+        f"lessons:{len(graph.lessons)} scripts:{len(graph.scripts_by_id)}"
+    )
+    return graph
+
+
+def get_course_graph(app: Flask, course_id: str) -> CourseGraph:
+    if not course_id:
+        return None
+    version = get_course_graph_version(app, course_id)
+    graph = _graphs.get(course_id)
+    if graph is not None and graph.version == version:
+        return graph
+    with _graph_lock:
+        graph = _graphs.get(course_id)
+        if graph is None or graph.version != version:
+            graph = build_course_graph(app, course_id, version)
+            _graphs[course_id] = graph
+            for lesson_id in graph.lessons:
+                _lesson_courses[lesson_id] = course_id
+        _graphs.move_to_end(course_id)
+        max_size = int(get_config("COURSE_GRAPH_CACHE_SIZE", "64"))
+        while len(_graphs) > max_size:
+            _graphs.popitem(last=False)
+    return graph
+
+
+def get_course_graph_by_lesson(app: Flask, lesson_id: str) -> CourseGraph:
+    course_id = _lesson_courses.get(lesson_id)
+    if course_id is None:
+        lesson = (
+            db.session.query(AILesson.course_id)
+            .filter(AILesson.lesson_id == lesson_id)
+            .first()
+        )
+        if lesson is None:
+            return None
+        course_id = lesson.course_id
+    return get_course_graph(app, course_id)
+
+
+# return the graph the script was served from,
+# None if the script was loaded from the database (e.g. preview mode)
+def get_course_graph_of_script(app: Flask, script_info: AILessonScript) -> CourseGraph:
+    course_id = _lesson_courses.get(script_info.lesson_id)
+    if course_id is None:
+        return None
+    graph = get_course_graph(app, course_id)
+    if graph is not None and graph.owns(script_info):
+        return graph
+    return None
@@ -0,0 +1,285 @@
+import json
+import queue
+import threading
+
+from flask import Flask, current_app
+from sqlalchemy import update
+
+from ...dao import db
+from flaskr.api.doc.feishu import list_records
+from flaskr.util.uuid import generate_id
+from .models import AILesson, AILessonScript
+from .const import (
+    ASK_MODE_DEFAULT,
+    CONTENT_TYPE_TEXT,
+    SCRIPT_TYPE_FIX,
+    STATUS_DELETE,
+    UI_TYPE_EMPTY,
+)
+
+FEISHU_PAGE_SIZE = 100
+# pages fetched ahead while the current page is imported
+PREFETCH_PAGES = 2
+
+_PAGES_END = object()
+
+
+# the pages of a local dump of the bitable:
+# one records/search response, or a list of them
+def read_record_pages(file_name: str) -> list:
+    with open(file_name, "r", encoding="UTF-8") as json_file:
+        data = json.load(json_file)
+    return data if isinstance(data, list) else [data]
+
+
+def iter_feishu_record_pages(
+    app: Flask, doc_id: str, table_id: str, view_id: str, **kwargs
+):
+    page_token = None
+    while True:
+        resp = list_records(
+            app,
+            doc_id,
+            table_id,
+            view_id=view_id,
+            page_token=page_token,
+            page_size=FEISHU_PAGE_SIZE,
+            **kwargs,
+        )
+        yield resp
+        if not resp["data"]["has_more"]:
+            break
+        page_token = resp["data"]["page_token"]
+
+
+# fetch the pages in a thread, so the next page is on the way
+# while the current one is imported
+def prefetch_record_pages(app: Flask, pages, size: int = PREFETCH_PAGES):
+    app = current_app._get_current_object() if app is current_app else app
+    page_queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                page_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        with app.app_context():
+            try:
+                for page in pages:
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            put(_PAGES_END)
+
+    thread = threading.Thread(target=produce, name="lesson-import-pages", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = page_queue.get()
+            if item is _PAGES_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# the import of the records of one bitable into a chapter and its lessons
+# the lessons and scripts of the table are loaded once and matched in memory,
+# the scripts are written by a few bulk statements in save()
+class LessonTableImport:
+    def __init__(
+        self,
+        app: Flask,
+        course_id: str,
+        table_id: str,
+        lesson_type: int,
+        parent_lesson: AILesson,
+        save_map: dict,
+        save_dict_map: dict,
+    ):
+        self.app = app
+        self.course_id = course_id
+        self.table_id = table_id
+        self.lesson_type = lesson_type
+        self.parent_lesson = parent_lesson
+        self.lesson_no = parent_lesson.lesson_no
+        self.save_map = save_map
+        self.save_dict_map = save_dict_map
+
+        self.lesson = None
+        self.sub_index = 0
+        self.script_index = 0
+        self.child_lessons = {}
+        self.unconf_fields = []
+        self.reset_lesson_ids = []
+        self.new_scripts = {}
+        self.updated_scripts = {}
+
+        lessons = (
+            AILesson.query.filter(
+                AILesson.course_id == course_id,
+                AILesson.lesson_feishu_id == table_id,
+            )
+            .order_by(AILesson.id)
+            .all()
+        )
+        self.lessons_by_name = {}
+        for lesson in lessons:
+            self.lessons_by_name.setdefault(lesson.lesson_name, lesson)
+        lesson_ids = {lesson.lesson_id for lesson in lessons}
+        lesson_ids.add(parent_lesson.lesson_id)
+        self.script_ids = {}
+        for row_id, script_feishu_id, lesson_id in (
+            db.session.query(
+                AILessonScript.id,
+                AILessonScript.script_feishu_id,
+                AILessonScript.lesson_id,
+            )
+            .filter(AILessonScript.lesson_id.in_(list(lesson_ids)))
+            .order_by(AILessonScript.id)
+        ):
+            self.script_ids.setdefault((script_feishu_id, lesson_id), row_id)
+        app.logger.info(
+            f"lesson import prefetch: lessons:{len(lessons)} scripts:{len(self.script_ids)}"
+        )
+
+    def _add_child_lesson(self, title: str) -> AILesson:
+        self.script_index = 0
+        self.sub_index = self.sub_index + 1
+        lesson = self.lessons_by_name.get(title)
+        if lesson is None:
+            lesson = AILesson()
+            lesson.lesson_id = str(generate_id(self.app))
+            lesson.course_id = self.course_id
+            lesson.lesson_desc = ""
+            db.session.add(lesson)
+            self.lessons_by_name[title] = lesson
+        lesson.lesson_name = title
+        lesson.lesson_desc = ""
+        lesson.status = 1
+        lesson.lesson_feishu_id = self.table_id
+        lesson.lesson_type = self.lesson_type
+        lesson.parent_id = self.parent_lesson.lesson_id
+        lesson.lesson_no = self.lesson_no + str(self.sub_index).zfill(2)
+        lesson.lesson_index = self.sub_index
+        if self.sub_index > 1:
+            lesson.pre_lesson_no = self.lesson_no + str(self.sub_index - 1).zfill(2)
+        else:
+            lesson.pre_lesson_no = ""
+        # the scripts of the lesson are disabled unless they are in the table
+        self.reset_lesson_ids.append(lesson.lesson_id)
+        self.child_lessons.setdefault(title, lesson)
+        return lesson
+
+    def _make_script(self, record: dict, lesson_id: str) -> dict:
+        script = {}
+        script["script_feishu_id"] = str(record["record_id"])
+        script["lesson_id"] = lesson_id
+        script["script_desc"] = ""
+        script["script_prompt"] = ""
+        script["script_ui_profile"] = ""
+        script["script_end_action"] = ""
+        script["script_other_conf"] = ""
+        script["script_profile"] = ""
+        script["script_media_url"] = ""
+        script["script_ui_content"] = ""
+        script["script_check_prompt"] = ""
+        script["script_check_flag"] = ""
+        script["script_index"] = self.script_index
+        script["script_ui_type"] = UI_TYPE_EMPTY
+        script["script_type"] = SCRIPT_TYPE_FIX
+        script["script_content_type"] = CONTENT_TYPE_TEXT
+        script["script_model"] = ""
+        script["status"] = 1
+        script["script_temprature"] = 0.4
+        script["ask_count_limit"] = 5
+        script["ask_mode"] = ASK_MODE_DEFAULT
+        script["ask_prompt"] = ""
+        script["ask_with_history"] = 5
+        script["ask_model"] = ""
+        script["script_ui_profile_id"] = ""
+        for field, val_obj in record["fields"].items():
+            db_field = self.save_map.get(field.strip())
+            val = ""
+            if isinstance(val_obj, str):
+                val = val_obj
+            elif isinstance(val_obj, list):
+                val = "".join(
+                    t["text"] if isinstance(t, dict) else "[" + t + "]" for t in val_obj
+                )
+            elif isinstance(val_obj, dict):
+                val = val_obj.get("text")
+            else:
+                self.app.logger.info("val_obj:" + str(val_obj))
+                val = str(val_obj)
+            if db_field:
+                if field in self.save_dict_map:
+                    orig_val = val
+                    val = self.save_dict_map[field.strip()].get(orig_val.strip())
+                    if val is None:
+                        self.app.logger.info(
+                            "val is None:" + field + ",value:" + orig_val
+                        )
+                if val is not None and val != "":
+                    script[db_field] = val
+            elif field not in self.unconf_fields:
+                self.unconf_fields.append(field)
+        return script
+
+    def import_record(self, record: dict):
+        if record["fields"].get("小节", None):
+            title = "".join(t["text"] for t in record["fields"]["小节"]).strip()
+            if title != "" or self.lesson is None:
+                self.lesson = self.child_lessons.get(title)
+        else:
+            title = None
+            self.lesson = self.parent_lesson
+        if self.lesson is None:
+            self.lesson = self._add_child_lesson(title)
+        self.script_index = self.script_index + 1
+        script = self._make_script(record, self.lesson.lesson_id)
+        key = (script["script_feishu_id"], script["lesson_id"])
+        row_id = self.script_ids.get(key)
+        if row_id is not None:
+            self.updated_scripts[row_id] = {"id": row_id, **script}
+        elif key in self.new_scripts:
+            self.new_scripts[key].update(script)
+        else:
+            script["script_id"] = str(generate_id(self.app))
+            self.new_scripts[key] = script
+
+    def import_page(self, page: dict):
+        records = page["data"]["items"]
+        self.app.logger.info("records:" + str(len(records)))
+        for record in records:
+            self.import_record(record)
+
+    def save(self):
+        if self.reset_lesson_ids:
+            db.session.execute(
+                update(AILessonScript)
+                .where(AILessonScript.lesson_id.in_(self.reset_lesson_ids))
+                .values(status=STATUS_DELETE)
+            )
+        if self.updated_scripts:
+            db.session.execute(
+                update(AILessonScript), list(self.updated_scripts.values())
+            )
+        if self.new_scripts:
+            db.session.bulk_insert_mappings(
+                AILessonScript, list(self.new_scripts.values())
+            )
+        self.app.logger.info(
+            f"lesson import: lessons:{len(self.child_lessons)} "
+            f"inserted:{len(self.new_scripts)} updated:{len(self.updated_scripts)}"
+        )
+        self.app.logger.info("unconf_fields:" + str(self.unconf_fields))
@@ -1,12 +1,11 @@
 from flaskr.api.llm import invoke_llm
-from flaskr.api.langfuse import langfuse_client
+from flaskr.api.langfuse import start_trace
 from flaskr.service.study.utils import get_model_setting
-from flaskr.service.study.utils import extract_variables
+from flaskr.util.prompt_template import get_prompt_template
 from flaskr.service.shifu.block_funcs import (
     get_block_by_id,
     get_system_block_by_outline_id,
 )
-from langchain.prompts import PromptTemplate
 from flaskr.service.common import raise_error
 from flaskr.service.study.dtos import ScriptDTO
 from flaskr.service.study.utils import make_script_dto_to_stream
@@ -14,15 +13,14 @@ from flaskr.service.lesson.const import STATUS_PUBLISH, STATUS_DRAFT
 
 
 def format_script_prompt(script_prompt: str, script_variables: dict) -> str:
-    prompt_template_lc = PromptTemplate.from_template(script_prompt)
-    keys = extract_variables(script_prompt)
+    prompt_template = get_prompt_template(script_prompt)
     fmt_keys = {}
-    for key in keys:
+    for key in prompt_template.variables:
         if key in script_variables:
             fmt_keys[key] = script_variables[key]
         else:
             fmt_keys[key] = "目前未知"
-    return prompt_template_lc.format(**fmt_keys)
+    return prompt_template.format(fmt_keys)
 
 
 def get_system_prompt(app, block_id):
@@ -59,7 +57,7 @@ def debug_script(
             trace_args["session_id"] = "debug-" + block_id
             trace_args["input"] = block_prompt
             trace_args["name"] = "debug"
-            trace = langfuse_client.trace(**trace_args)
+            trace = start_trace(**trace_args)
             app.logger.info(f"debug_script {block_id} ")
             model_setting = get_model_setting(
                 app, block_info, [STATUS_PUBLISH, STATUS_DRAFT]
@@ -1,7 +1,7 @@
 from flask import Flask
 from flaskr.route.common import make_common_response
 from flaskr.framework.plugin.inject import inject
-from flaskr.api.llm import get_current_models
+from flaskr.api.llm import get_current_models, refresh_models
 from flaskr.service.llm.funcs import get_system_prompt, debug_script
 from flask import request, Response
 
@@ -30,6 +30,26 @@ def register_llm_routes(app: Flask, path_prefix="/api/llm"):
         """
         return make_common_response(get_current_models(app))
 
+    @app.route(path_prefix + "/refresh-models", methods=["POST"])
+    def refresh_models_api():
+        """
+        refresh model list
+        ---
+        tags:
+            - llm
+            - cook
+        responses:
+            200:
+                description: model list
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items:
+                                type: string
+        """
+        return make_common_response(refresh_models(app))
+
     @app.route(path_prefix + "/get-system-prompt", methods=["GET"])
     def get_system_prompt_api():
         """
@@ -1,7 +1,7 @@
-from flask import Flask
+from flask import Flask, g, has_app_context
 
 
-from .models import UserProfile
+from .models import UserProfile, ProfileItem
 from ...dao import db
 from ..user.models import User
 from ...i18n import _
@@ -153,6 +153,7 @@ def save_user_profile(
                 )
             setattr(user_info, profile_lable["mapping"], profile_value)
     db.session.flush()
+    invalidate_user_profile_snapshot(user_id)
     return UserProfileDTO(
         user_profile.user_id,
         user_profile.profile_key,
@@ -205,29 +206,62 @@ def save_user_profiles(app: Flask, user_id: str, course_id: str, profiles: dict)
                     value = profile_lable["items_mapping"].get(value, value)
                 setattr(user_info, profile_lable["mapping"], value)
     db.session.flush()
+    invalidate_user_profile_snapshot(user_id)
     return True
 
 
+# profile values of the user visible to the course,
+# loaded once per app context (a study step) and shared by every prompt
+def get_user_profile_snapshot(app: Flask, user_id: str, course_id: str) -> dict:
+    snapshots = g.setdefault("user_profile_snapshots", {}) if has_app_context() else {}
+    snapshot = snapshots.get((user_id, course_id))
+    if snapshot is not None:
+        return snapshot
+    profile_ids = {
+        item.profile_id
+        for item in db.session.query(ProfileItem.profile_id).filter(
+            ProfileItem.parent_id.in_([course_id, ""]), ProfileItem.status == 1
+        )
+    }
+    profile_ids.add("")
+    user_profiles = (
+        db.session.query(
+            UserProfile.profile_key,
+            UserProfile.profile_value,
+            UserProfile.profile_id,
+        )
+        .filter(UserProfile.user_id == user_id)
+        .order_by(UserProfile.id.asc())
+        .all()
+    )
+    snapshot = {
+        user_profile.profile_key: user_profile.profile_value
+        for user_profile in user_profiles
+        if user_profile.profile_id in profile_ids
+    }
+    snapshots[(user_id, course_id)] = snapshot
+    return snapshot
+
+
+# drop the snapshots of the user after the profiles are changed
+def invalidate_user_profile_snapshot(user_id: str):
+    if not has_app_context():
+        return
+    snapshots = g.get("user_profile_snapshots", None)
+    if not snapshots:
+        return
+    for key in [key for key in snapshots if key[0] == user_id]:
+        snapshots.pop(key, None)
+
+
 def get_user_profiles(
     app: Flask, user_id: str, course_id: str, keys: list = None
 ) -> dict:
-    profiles_items = get_profile_item_definition_list(app, course_id)
-    user_profiles = UserProfile.query.filter_by(user_id=user_id).all()
-    result = {}
+    snapshot = get_user_profile_snapshot(app, user_id, course_id)
     if keys is None or len(keys) == 0:
-        for user_profile in user_profiles:
-            if user_profile.profile_id == "" or user_profile.profile_id in [
-                item.profile_id for item in profiles_items
-            ]:
-                result[user_profile.profile_key] = user_profile.profile_value
-        return result
-    for user_profile in user_profiles:
-        if user_profile.profile_key in keys:
-            if user_profile.profile_id == "" or user_profile.profile_id in [
-                item.profile_id for item in profiles_items
-            ]:
-                result[user_profile.profile_key] = user_profile.profile_value
-    return result
+        return dict(snapshot)
+    keys = set(keys)
+    return {key: value for key, value in snapshot.items() if key in keys}
 
 
 def get_user_profile_labels(app: Flask, user_id: str, course_id: str):
@@ -354,4 +388,5 @@ def update_user_profile_with_lable(
             if user_profile and (profile_value != default_value):
                 user_profile.profile_value = profile_value
         db.session.flush()
+        invalidate_user_profile_snapshot(user_id)
         return True
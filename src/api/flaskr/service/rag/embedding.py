@@ -0,0 +1,139 @@
+import hashlib
+import struct
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable
+
+from flask import current_app
+
+from ...common.config import get_config
+from ...dao import redis_client as redis
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def pack_vector(vector: list) -> bytes:
+    return struct.pack(f"<{len(vector)}f", *vector)
+
+
+def unpack_vector(data: bytes) -> list:
+    return list(struct.unpack(f"<{len(data) // 4}f", data))
+
+
+# two tier cache of embeddings keyed by (model, normalized text hash):
+# an in-process lru and redis, where the vectors are stored as packed float32
+class EmbeddingCache:
+    def __init__(self):
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"lru_hits": 0, "redis_hits": 0, "misses": 0, "embedded": 0}
+
+    def _get_key(self, embedding_model: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return embedding_model + ":" + digest
+
+    def _get_redis_key(self, key: str) -> str:
+        return get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "embedding:" + key
+
+    def _lru_get(self, key: str) -> list:
+        with self.lock:
+            vector = self.lru.get(key)
+            if vector is not None:
+                self.lru.move_to_end(key)
+            return vector
+
+    def _lru_put(self, key: str, vector: list):
+        with self.lock:
+            self.lru[key] = vector
+            self.lru.move_to_end(key)
+            max_size = int(get_config("EMBEDDING_CACHE_SIZE", "4096"))
+            while len(self.lru) > max_size:
+                self.lru.popitem(last=False)
+
+    def _count(self, name: str, count: int):
+        if count:
+            with self.lock:
+                self.stats[name] += count
+
+    def _redis_get(self, keys: list) -> list:
+        if redis is None or not keys:
+            return [None] * len(keys)
+        try:
+            return redis.mget([self._get_redis_key(key) for key in keys])
+        except Exception as e:
+            current_app.logger.warning(f"get embedding cache error: {e}")
+            return [None] * len(keys)
+
+    def _redis_put(self, items: dict):
+        if redis is None or not items:
+            return
+        expire = int(get_config("EMBEDDING_CACHE_EXPIRE_TIME", "604800"))
+        try:
+            pipeline = redis.pipeline(transaction=False)
+            for key, data in items.items():
+                pipeline.set(self._get_redis_key(key), data, ex=expire)
+            pipeline.execute()
+        except Exception as e:
+            current_app.logger.warning(f"set embedding cache error: {e}")
+
+    # embed the texts, only the texts missing in both tiers are sent to embed_func
+    def get_vectors(
+        self,
+        text_list: list,
+        embedding_model: str,
+        embed_func: Callable[[list, str], list],
+    ) -> list:
+        keys = [self._get_key(embedding_model, text) for text in text_list]
+        vectors = [self._lru_get(key) for key in keys]
+        lru_missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self._count("lru_hits", len(keys) - len(lru_missing))
+
+        redis_missing = []
+        for i, data in zip(
+            lru_missing, self._redis_get([keys[i] for i in lru_missing])
+        ):
+            if data:
+                vectors[i] = unpack_vector(data)
+                self._lru_put(keys[i], vectors[i])
+            else:
+                redis_missing.append(i)
+        self._count("redis_hits", len(lru_missing) - len(redis_missing))
+
+        # embed each distinct missing text once
+        missing = {}
+        for i in redis_missing:
+            missing.setdefault(keys[i], []).append(i)
+        self._count("misses", len(redis_missing))
+        self._count("embedded", len(missing))
+        if missing:
+            first_indexes = [indexes[0] for indexes in missing.values()]
+            new_vectors = embed_func(
+                [text_list[i] for i in first_indexes], embedding_model
+            )
+            to_cache = {}
+            for key, vector in zip(missing.keys(), new_vectors):
+                data = pack_vector(vector)
+                # return the float32 values a cache hit would return
+                vector = unpack_vector(data)
+                to_cache[key] = data
+                self._lru_put(key, vector)
+                for i in missing[key]:
+                    vectors[i] = vector
+            self._redis_put(to_cache)
+        return vectors
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["lru_size"] = len(self.lru)
+        total = stats["lru_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["lru_hits"] + stats["redis_hits"]) / total if total else 0
+        )
+        return stats
+
+
+embedding_cache = EmbeddingCache()
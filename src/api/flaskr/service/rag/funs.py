@@ -1,26 +1,36 @@
 import json
+import time
 import uuid
 import datetime
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 # from typing import Optional
 
 import oss2
 import pytz
 import openai
-from sqlalchemy import or_
+from redis.exceptions import LockError
+from sqlalchemy import insert, update, or_
 from flask import Flask, current_app
 
 from .models import (
+    KB_FILE_STATUS_DONE,
+    KB_FILE_STATUS_PENDING,
+    KB_FILE_STATUS_PROCESSING,
+    KB_FILE_STATUS_FAILED,
     KnowledgeBase,
     KnowledgeFile,
     KnowledgeChunk,
-    kb_schema,
-    kb_index_params,
 )
+from .embedding import embedding_cache
+from .vector_codec import encode_vector, decode_vectors
+from .vector_store import get_vector_store
+from .ingest import enqueue_kb_file_job, get_kb_file_lock
 from ..tag.models import Tag
-from ...dao import db, milvus_client
+from ...dao import db
 from ...common.config import get_config
+from ...common.metrics import measure_stage
 from ..common.models import raise_error, raise_error_with_args
 
 bj_time = pytz.timezone("Asia/Shanghai")
@@ -114,8 +124,7 @@ def kb_add(
         if KnowledgeBase.query.filter_by(kb_name=kb_name).first():
             app.logger.error("kb_name already exists")
             return False
-        if milvus_client is not None:
-            raise_error("RAG.MILVUS_NOT_CONFIGURED")
+        vector_store = get_vector_store()
 
         kb_item = KnowledgeBase(
             kb_id=kb_id,
@@ -134,13 +143,7 @@ def kb_add(
             "create_user": user_id,
             "create_time": get_datetime_now_str(),
         }
-        milvus_client.create_collection(
-            # collection name can only contain numbers, letters and underscores
-            collection_name=kb_id,
-            schema=kb_schema(dim),
-            index_params=kb_index_params(),
-            properties=properties,
-        )
+        vector_store.create_collection(kb_id, dim, properties)
 
         db.session.commit()
 
@@ -181,15 +184,13 @@ def kb_update(
             return False
 
 
-def milvus_kb_exist(kb_id: str):
-    if milvus_client is None:
-        raise_error("RAG.MILVUS_NOT_CONFIGURED")
-    return milvus_client.has_collection(collection_name=kb_id)
+def kb_collection_exist(kb_id: str):
+    return get_vector_store().has_collection(kb_id)
 
 
 def kb_query(app: Flask, kb_id: str):
     with app.app_context():
-        if milvus_kb_exist(kb_id):
+        if kb_collection_exist(kb_id):
             kb_item = KnowledgeBase.query.filter_by(kb_id=kb_id).first()
             if kb_item:
                 return {
@@ -213,14 +214,13 @@ def kb_query(app: Flask, kb_id: str):
 
 def kb_drop(app: Flask, kb_id_list: list):
     with app.app_context():
-        if milvus_client is None:
-            raise_error("RAG.MILVUS_NOT_CONFIGURED")
+        vector_store = get_vector_store()
         for kb_id in kb_id_list:
             kb_item = KnowledgeBase.query.filter_by(kb_id=kb_id).first()
             if kb_item:
                 db.session.delete(kb_item)
-                if milvus_kb_exist(kb_id) is True:
-                    milvus_client.drop_collection(collection_name=kb_id)
+                if vector_store.has_collection(kb_id):
+                    vector_store.drop_collection(kb_id)
                 db.session.commit()
             # break
         return True
@@ -232,8 +232,6 @@ def kb_tag_bind(
     tag_id: str,
 ):
     with app.app_context():
-        if milvus_client is None:
-            raise_error("RAG.MILVUS_NOT_CONFIGURED")
         kb_item = KnowledgeBase.query.filter_by(kb_id=kb_id).first()
         if not kb_item:
             app.logger.error(f"KnowledgeBase with kb_id {kb_id} not found")
@@ -361,7 +359,7 @@ def text_spilt(
     return [x.strip() for x in str(text).split(split_separator) if x.strip() != ""]
 
 
-def get_vector_list(text_list: list, embedding_model: str):
+def embed_text_list(text_list: list, embedding_model: str):
     return [
         x.embedding
         for x in embedding_client.embeddings.create(
@@ -370,6 +368,14 @@ def get_vector_list(text_list: list, embedding_model: str):
     ]
 
 
+def get_vector_list(text_list: list, embedding_model: str):
+    return embedding_cache.get_vectors(text_list, embedding_model, embed_text_list)
+
+
+def get_embedding_cache_stats(app: Flask):
+    return embedding_cache.get_stats()
+
+
 def get_embedding_model(kb_id: str):
     embedding_model = get_config("DEFAULT_EMBEDDING_MODEL")
     return embedding_model
@@ -407,72 +413,199 @@ def kb_file_add(
     user_id: str,
 ):
     with app.app_context():
-        if milvus_client is None:
-            raise_error("RAG.MILVUS_NOT_CONFIGURED")
+        # fail before the job is queued when there is no vector store
+        get_vector_store()
         file_id = str(uuid.uuid4()).replace("-", "")
-
-        embedding_model = get_embedding_model(kb_id)
-
-        # file_parser
-        extension = file_key.split(".")[-1]
-        file_content = bucket.get_object(file_key)
-        all_text = file_parser(file_content, extension)
-        app.logger.info(f"all_text:\n{all_text}")
-
-        # text_spilt
-        all_text_list = text_spilt(
-            all_text, split_separator, split_max_length, split_chunk_overlap
-        )
-
-        file_meta_data = json.dumps({})
-        file_extra_data = json.dumps({})
         file_item = KnowledgeFile(
             kb_id=kb_id,
+            file_tag_id=file_tag_id,
             file_id=file_id,
             file_key=file_key,
             file_name=file_name,
-            file_text=all_text,
-            meta_data=file_meta_data,
-            extra_data=file_extra_data,
+            file_text="",
+            status=KB_FILE_STATUS_PENDING,
+            meta_data=json.dumps({}),
+            extra_data=json.dumps(
+                {
+                    "split_separator": split_separator,
+                    "split_max_length": split_max_length,
+                    "split_chunk_overlap": split_chunk_overlap,
+                }
+            ),
             created_user_id=user_id,
         )
         db.session.add(file_item)
+        db.session.commit()
+        # the file is ingested by the ingestion worker, the file id is the job id
+        enqueue_kb_file_job(app, file_id)
+        return get_kb_file_status(app, file_id)
+
+
+def get_kb_file_status(app: Flask, file_id: str):
+    with app.app_context():
+        file_item = KnowledgeFile.query.filter_by(file_id=file_id).first()
+        if not file_item:
+            raise_error("FILE.FILE_NOT_FOUND")
+        return {
+            "job_id": file_item.file_id,
+            "kb_id": file_item.kb_id,
+            "file_id": file_item.file_id,
+            "status": file_item.status,
+            "chunk_count": file_item.chunk_count,
+            "chunk_done": file_item.chunk_done,
+            "retry_count": file_item.retry_count,
+            "error_message": file_item.error_message,
+        }
+
 
-        index = 0
-        processing_batch_size = 32
-        for text_list in (
-            list(itertools.islice(all_text_list, i, i + processing_batch_size))
-            for i in range(0, len(all_text_list), processing_batch_size)
+# put an unfinished file back to the ingestion queue,
+# the job resumes from the last ingested batch, a file being processed is
+# only queued again if no worker holds its lock, the one that did crashed
+def kb_file_retry(app: Flask, file_id: str):
+    with app.app_context():
+        file_item = KnowledgeFile.query.filter_by(file_id=file_id).first()
+        if not file_item:
+            raise_error("FILE.FILE_NOT_FOUND")
+        if file_item.status == KB_FILE_STATUS_PROCESSING and (
+            get_kb_file_lock(file_id).locked()
         ):
-            app.logger.info(f"text_list:\n{text_list}")
+            app.logger.info(f"kb file {file_id} is being ingested, not retried")
+        elif file_item.status != KB_FILE_STATUS_DONE:
+            file_item.status = KB_FILE_STATUS_PENDING
+            file_item.retry_count = 0
+            db.session.commit()
+            enqueue_kb_file_job(app, file_id)
+        return get_kb_file_status(app, file_id)
 
-            # vector_list
-            vector_list = get_vector_list(text_list, embedding_model)
 
-            # milvus insert
-            data = []
+def get_chunk_id(file_id: str, index: int):
+    # stable across retries, so a resumed batch overwrites its own rows
+    return f"{file_id[:8]}-{str(index).zfill(8)}-{file_id}"
+
+
+# a file is ingested by one worker at a time, the job of a file another
+# worker is ingesting is dropped, that worker finishes or requeues the file
+def ingest_kb_file(app: Flask, file_id: str):
+    with app.app_context():
+        lock = get_kb_file_lock(file_id)
+        if not lock.acquire(blocking=False):
+            app.logger.info(f"ingest kb file {file_id} is running elsewhere")
+            return
+        try:
+            retry = _ingest_kb_file_locked(app, file_id, lock)
+        finally:
+            try:
+                lock.release()
+            except LockError as e:
+                app.logger.warning(f"ingest kb file {file_id} lock lost: {e}")
+        # queued once the lock is released, so the next worker can take it
+        if retry:
+            enqueue_kb_file_job(app, file_id)
+
+
+# returns True when the file is to be queued again
+def _ingest_kb_file_locked(app: Flask, file_id: str, lock) -> bool:
+    file_item = KnowledgeFile.query.filter_by(file_id=file_id).first()
+    if not file_item or file_item.status == KB_FILE_STATUS_DONE:
+        return False
+    kb_id = file_item.kb_id
+    file_item.status = KB_FILE_STATUS_PROCESSING
+    db.session.commit()
+    try:
+        ingest_kb_file_chunks(app, file_item, lock)
+    except Exception as e:
+        db.session.rollback()
+        file_item = KnowledgeFile.query.filter_by(file_id=file_id).first()
+        file_item.retry_count += 1
+        file_item.error_message = str(e)
+        max_retries = int(get_config("KB_INGEST_MAX_RETRIES", "3"))
+        if file_item.retry_count < max_retries:
+            file_item.status = KB_FILE_STATUS_PENDING
+            db.session.commit()
+            app.logger.warning(
+                f"ingest kb file {kb_id} {file_id} retry "
+                f"{file_item.retry_count}: {e}"
+            )
+            return True
+        file_item.status = KB_FILE_STATUS_FAILED
+        db.session.commit()
+        app.logger.error(f"ingest kb file {kb_id} {file_id} failed: {e}")
+    return False
+
+
+def ingest_kb_file_chunks(app: Flask, file_item: KnowledgeFile, lock=None):
+    kb_id = file_item.kb_id
+    file_id = file_item.file_id
+    user_id = file_item.created_user_id
+    file_tag_id = file_item.file_tag_id or ""
+    embedding_model = get_embedding_model(kb_id)
+    split_args = json.loads(file_item.extra_data or "{}")
+    vector_store = get_vector_store()
+
+    # file_parser, a resumed job reuses the text of the first run
+    if not file_item.file_text:
+        extension = file_item.file_key.split(".")[-1]
+        file_content = bucket.get_object(file_item.file_key)
+        file_item.file_text = file_parser(file_content, extension)
+
+    # text_spilt
+    all_text_list = text_spilt(
+        file_item.file_text,
+        split_args.get("split_separator", "\n\n"),
+        split_args.get("split_max_length", 500),
+        split_args.get("split_chunk_overlap", 50),
+    )
+    file_item.chunk_count = len(all_text_list)
+    # drop the rows of a batch interrupted before its progress was saved
+    KnowledgeChunk.query.filter(
+        KnowledgeChunk.file_id == file_id,
+        KnowledgeChunk.chunk_index >= file_item.chunk_done,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    app.logger.info(
+        f"ingest kb file {kb_id} {file_id} chunks: {file_item.chunk_done}"
+        f"/{file_item.chunk_count}"
+    )
+
+    processing_batch_size = int(get_config("KB_INGEST_BATCH_SIZE", "32"))
+    batches = [
+        (i, list(itertools.islice(all_text_list, i, i + processing_batch_size)))
+        for i in range(file_item.chunk_done, len(all_text_list), processing_batch_size)
+    ]
+
+    def embed_batch(batch):
+        with app.app_context():
+            return get_vector_list(batch[1], embedding_model)
+
+    chunk_meta_data = json.dumps({})
+    chunk_extra_data = json.dumps({})
+    # the batches are embedded concurrently and written in order,
+    # so the saved progress is always a prefix of the file
+    with ThreadPoolExecutor(
+        max_workers=int(get_config("KB_INGEST_EMBEDDING_CONCURRENCY", "4")),
+        thread_name_prefix="kb-ingest",
+    ) as executor:
+        for (start, text_list), vector_list in zip(
+            batches, executor.map(embed_batch, batches)
+        ):
             create_time = get_datetime_now_str()
-            chunk_meta_data = json.dumps({})
-            chunk_extra_data = json.dumps({})
-            for text, vector in zip(text_list, vector_list):
-                app.logger.info(f"text: {text}")
-                app.logger.info(f"vector[:10]: {vector[:10]}")
-
-                chunk_id = f'{file_id[:8]}-{str(index).zfill(8)}-{str(uuid.uuid4()).replace("-", "")}'
-
-                chunk_item = KnowledgeChunk(
-                    kb_id=kb_id,
-                    file_id=file_id,
-                    chunk_id=chunk_id,
-                    chunk_index=index,
-                    chunk_text=text,
-                    chunk_vector=json.dumps(vector),
-                    meta_data=chunk_meta_data,
-                    extra_data=chunk_extra_data,
-                    created_user_id=user_id,
+            data = []
+            chunk_rows = []
+            for index, (text, vector) in enumerate(zip(text_list, vector_list), start):
+                chunk_id = get_chunk_id(file_id, index)
+                chunk_rows.append(
+                    {
+                        "kb_id": kb_id,
+                        "file_id": file_id,
+                        "chunk_id": chunk_id,
+                        "chunk_index": index,
+                        "chunk_text": text,
+                        "chunk_vector_data": encode_vector(vector),
+                        "meta_data": chunk_meta_data,
+                        "extra_data": chunk_extra_data,
+                        "created_user_id": user_id,
+                    }
                 )
-                db.session.add(chunk_item)
-
                 data.append(
                     {
                         "id": chunk_id,
@@ -490,18 +623,138 @@ def kb_file_add(
                         "extra_data": chunk_extra_data,
                     }
                 )
+            vector_store.upsert(kb_id, data)
+            db.session.execute(insert(KnowledgeChunk), chunk_rows)
+            file_item.chunk_done = start + len(text_list)
+            db.session.commit()
+            if lock is not None:
+                lock.reacquire()
 
-                index += 1
+    file_item.status = KB_FILE_STATUS_DONE
+    file_item.error_message = None
+    db.session.commit()
+    app.logger.info(f"ingest kb file {kb_id} {file_id} done: {file_item.chunk_done}")
 
-                # break
 
-            milvus_client.insert(collection_name=kb_id, data=data)
+# convert the json vectors of knowledge_chunk to the binary column,
+# the json text is cleared to give its space back
+def kb_vector_backfill(app: Flask, batch_size: int = 500, codec: str = None):
+    with app.app_context():
+        last_id = 0
+        total = 0
+        while True:
+            rows = (
+                db.session.query(KnowledgeChunk.id, KnowledgeChunk.chunk_vector)
+                .filter(
+                    KnowledgeChunk.id > last_id,
+                    KnowledgeChunk.chunk_vector_data.is_(None),
+                    KnowledgeChunk.chunk_vector.isnot(None),
+                )
+                .order_by(KnowledgeChunk.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            db.session.execute(
+                update(KnowledgeChunk),
+                [
+                    {
+                        "id": row.id,
+                        "chunk_vector_data": (
+                            encode_vector(json.loads(row.chunk_vector), codec)
+                            if row.chunk_vector not in ("", "[]")
+                            else None
+                        ),
+                        "chunk_vector": None,
+                    }
+                    for row in rows
+                ],
+            )
+            db.session.commit()
+            total += len(rows)
+            app.logger.info(f"kb vector backfill: {total}")
+        return total
 
-            # break
 
-        db.session.commit()
+# reload the vector store collection of a knowledge base from the chunks
+# saved in mysql, each page of vectors is decoded by numpy at once
+def kb_vector_rebuild(
+    app: Flask, kb_id: str, batch_size: int = 1000, recreate: bool = False
+):
+    with app.app_context():
+        vector_store = get_vector_store()
+        kb_item = KnowledgeBase.query.filter_by(kb_id=kb_id).first()
+        if not kb_item:
+            raise_error("RAG.KB_NOT_FOUND")
+        if recreate and vector_store.has_collection(kb_id):
+            vector_store.drop_collection(kb_id)
+        if not vector_store.has_collection(kb_id):
+            vector_store.create_collection(
+                kb_id,
+                kb_item.dim,
+                {
+                    "dim": kb_item.dim,
+                    "create_user": kb_item.created_user_id,
+                    "create_time": get_datetime_now_str(),
+                },
+            )
 
-        return "success"
+        file_tag_ids = {
+            x.file_id: x.file_tag_id or ""
+            for x in db.session.query(
+                KnowledgeFile.file_id, KnowledgeFile.file_tag_id
+            ).filter(KnowledgeFile.kb_id == kb_id)
+        }
+        last_id = 0
+        total = 0
+        while True:
+            rows = (
+                KnowledgeChunk.query.filter(
+                    KnowledgeChunk.kb_id == kb_id, KnowledgeChunk.id > last_id
+                )
+                .order_by(KnowledgeChunk.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            rows = [
+                x
+                for x in rows
+                if x.chunk_vector_data or x.chunk_vector not in (None, "", "[]")
+            ]
+            vectors = decode_vectors(
+                [x.chunk_vector_data or x.chunk_vector for x in rows]
+            ).tolist()
+            data = [
+                {
+                    "id": x.chunk_id,
+                    "knowledge_id": kb_id,
+                    "file_tag_id": file_tag_ids.get(x.file_id, ""),
+                    "file_id": x.file_id,
+                    "index": x.chunk_index,
+                    "text": x.chunk_text,
+                    "vector": vector,
+                    "create_time": (
+                        x.created.strftime("%Y-%m-%d %H:%M:%S") if x.created else ""
+                    ),
+                    "update_time": "",
+                    "create_user": x.created_user_id or "",
+                    "update_user": "",
+                    "meta_data": x.meta_data or "{}",
+                    "extra_data": x.extra_data or "{}",
+                }
+                for x, vector in zip(rows, vectors)
+            ]
+            if data:
+                vector_store.upsert(kb_id, data)
+            total += len(data)
+            app.logger.info(f"kb vector rebuild {kb_id}: {total}")
+            db.session.expunge_all()
+        return total
 
 
 def kb_file_query(
@@ -537,6 +790,94 @@ def kb_file_query(
         }
 
 
+class RetrievalResult:
+    def __init__(self, hits: list, timings: dict):
+        self.hits = hits
+        self.timings = timings
+        self.text = "\n\n".join(
+            [x["entity"]["text"] for x in hits if "text" in x.get("entity", {})]
+        )
+
+    def __json__(self):
+        return {
+            "text": self.text,
+            "hits": self.hits,
+            "timings": self.timings,
+        }
+
+
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(get_config("RAG_RETRIEVAL_CONCURRENCY", "8")),
+    thread_name_prefix="rag-retrieval",
+)
+
+
+def search_kb(
+    kb_id: str,
+    vector: list,
+    my_filter: str,
+    limit: int,
+    output_fields: list,
+) -> tuple[list, float]:
+    start = time.perf_counter()
+    hits = get_vector_store().search(kb_id, vector, my_filter, limit, output_fields)
+    for hit in hits:
+        hit["kb_id"] = kb_id
+    return hits, (time.perf_counter() - start) * 1000
+
+
+# retrieve from several knowledge bases with one query embedding,
+# the searches run concurrently and the hits are merged by score
+def retrieval_kbs(
+    kb_id_list: list,
+    query: str,
+    my_filter: str,
+    limit: int,
+    output_fields: list,
+) -> RetrievalResult:
+    # initialized here, search_kb runs outside of the app context
+    get_vector_store()
+    if "text" not in output_fields:
+        output_fields = output_fields + ["text"]
+    start = time.perf_counter()
+    timings = {}
+
+    kb_models = {}
+    for kb_id in dict.fromkeys(kb_id_list):
+        kb_models.setdefault(get_embedding_model(kb_id), []).append(kb_id)
+    vectors = {}
+    for embedding_model in kb_models:
+        vectors[embedding_model] = get_vector_list(
+            text_list=[query], embedding_model=embedding_model
+        )[0]
+    timings["embedding_ms"] = (time.perf_counter() - start) * 1000
+
+    search_start = time.perf_counter()
+    futures = {
+        kb_id: retrieval_executor.submit(
+            search_kb, kb_id, vectors[embedding_model], my_filter, limit, output_fields
+        )
+        for embedding_model, kb_ids in kb_models.items()
+        for kb_id in kb_ids
+    }
+    hits = []
+    timings["search_kb_ms"] = {}
+    for kb_id, future in futures.items():
+        kb_hits, cost = future.result()
+        hits.extend(kb_hits)
+        timings["search_kb_ms"][kb_id] = cost
+    timings["search_ms"] = (time.perf_counter() - search_start) * 1000
+
+    merge_start = time.perf_counter()
+    # cosine distance, the larger the closer
+    hits.sort(key=lambda x: x["distance"], reverse=True)
+    hits = hits[:limit]
+    timings["merge_ms"] = (time.perf_counter() - merge_start) * 1000
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    current_app.logger.info(f"retrieval timings: {timings}")
+    return RetrievalResult(hits, timings)
+
+
 def retrieval_fun(
     kb_id: str,
     query: str,
@@ -544,36 +885,17 @@ def retrieval_fun(
     limit: int,
     output_fields: list,
 ):
-    if milvus_client is not None:
-        raise_error("RAG.MILVUS_NOT_CONFIGURED")
-    embedding_model = get_embedding_model(kb_id)
-    return "\n\n".join(
-        [
-            x["entity"]["text"]
-            for x in milvus_client.search(
-                collection_name=kb_id,
-                anns_field="vector",
-                data=[
-                    get_vector_list(text_list=[query], embedding_model=embedding_model)[
-                        0
-                    ]
-                ],
-                filter=my_filter,
-                limit=limit,
-                search_params={"metric_type": "COSINE"},
-                output_fields=output_fields,
-            )[0]
-        ]
-    )
+    with measure_stage("rag"):
+        return retrieval_kbs([kb_id], query, my_filter, limit, output_fields).text
 
 
 def retrieval(
     app: Flask,
-    kb_id: str,
+    kb_id_list: list,
     query: str,
     my_filter: str,
     limit: int,
     output_fields: list,
-):
-    with app.app_context():
-        return retrieval_fun(kb_id, query, my_filter, limit, output_fields)
+) -> RetrievalResult:
+    with app.app_context(), measure_stage("rag"):
+        return retrieval_kbs(kb_id_list, query, my_filter, limit, output_fields)
@@ -0,0 +1,80 @@
+import threading
+
+from flask import Flask
+
+from ...common.config import get_config
+from ...dao import redis_client as redis
+
+
+KB_INGEST_WORKER_THREAD = "thread"
+KB_INGEST_WORKER_PROCESS = "process"
+
+_worker_lock = threading.Lock()
+_worker_thread = None
+
+
+def _get_queue_key() -> str:
+    return get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "kb_ingest_queue"
+
+
+# held by the worker ingesting a file, its timeout is renewed after each batch,
+# so the lock of a worker that died expires and the file can be retried
+def get_kb_file_lock(file_id: str):
+    return redis.lock(
+        get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "kb_ingest_lock:" + file_id,
+        timeout=int(get_config("KB_INGEST_LOCK_TIMEOUT", "600")),
+    )
+
+
+# queue a knowledge file for ingestion
+# with KB_INGEST_WORKER=thread the web process drains the queue itself,
+# with KB_INGEST_WORKER=process a `flask console kb_ingest_worker` does
+def enqueue_kb_file_job(app: Flask, file_id: str):
+    redis.rpush(_get_queue_key(), file_id)
+    app.logger.info(f"enqueue kb file job: {file_id}")
+    if get_config("KB_INGEST_WORKER", KB_INGEST_WORKER_THREAD) == (
+        KB_INGEST_WORKER_THREAD
+    ):
+        start_ingest_worker_thread(app)
+
+
+def run_ingest_worker(app: Flask, stop_when_empty: bool = False):
+    from .funs import ingest_kb_file
+
+    app.logger.info("kb ingest worker started")
+    while True:
+        item = redis.blpop(_get_queue_key(), timeout=5)
+        if item is None:
+            if stop_when_empty and _stop_worker_thread_if_idle():
+                break
+            continue
+        file_id = item[1].decode("utf-8")
+        try:
+            ingest_kb_file(app, file_id)
+        except Exception as e:
+            app.logger.error(f"kb ingest job {file_id} error: {e}")
+    app.logger.info("kb ingest worker stopped")
+
+
+# checked under the lock, so a job queued meanwhile starts a new thread
+def _stop_worker_thread_if_idle() -> bool:
+    global _worker_thread
+    with _worker_lock:
+        if redis.llen(_get_queue_key()):
+            return False
+        _worker_thread = None
+        return True
+
+
+def start_ingest_worker_thread(app: Flask):
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(
+            target=run_ingest_worker,
+            args=(app, True),
+            name="kb-ingest-worker",
+            daemon=True,
+        )
+        _worker_thread.start()
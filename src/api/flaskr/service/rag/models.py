@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, TIMESTAMP, Text
+from sqlalchemy import Column, String, Integer, TIMESTAMP, Text, LargeBinary
 from sqlalchemy.dialects.mysql import BIGINT
 from sqlalchemy.sql import func
 from pymilvus import MilvusClient, DataType
@@ -9,6 +9,12 @@ from ...dao import db, milvus_client
 default_embedding_model = get_config("DEFAULT_EMBEDDING_MODEL")
 default_embedding_model_dim = get_config("DEFAULT_EMBEDDING_MODEL_DIM")
 
+# ingestion status of a knowledge file
+KB_FILE_STATUS_PENDING = 0
+KB_FILE_STATUS_PROCESSING = 1
+KB_FILE_STATUS_DONE = 2
+KB_FILE_STATUS_FAILED = 3
+
 
 class KnowledgeBase(db.Model):
     __tablename__ = "knowledge_base"
@@ -96,6 +102,19 @@ class KnowledgeFile(db.Model):
     file_key = Column(String(255), nullable=False, default="", comment="File oss key")
     file_name = Column(String(255), nullable=True, default="", comment="File name")
     file_text = Column(Text, nullable=True, comment="File text", default="")
+    status = Column(
+        Integer,
+        nullable=False,
+        default=KB_FILE_STATUS_PENDING,
+        comment="Ingestion status: 0 pending, 1 processing, 2 done, 3 failed",
+        index=True,
+    )
+    chunk_count = Column(Integer, nullable=False, default=0, comment="Chunk count")
+    chunk_done = Column(
+        Integer, nullable=False, default=0, comment="Ingested chunk count"
+    )
+    retry_count = Column(Integer, nullable=False, default=0, comment="Retry count")
+    error_message = Column(Text, nullable=True, comment="Last error message")
     meta_data = Column(Text, nullable=True, comment="Meta Data", default="{}")
     extra_data = Column(Text, nullable=True, comment="Extra Data", default="{}")
     created_user_id = Column(
@@ -147,7 +166,15 @@ class KnowledgeChunk(db.Model):
         comment="Chunk index",
     )
     chunk_text = Column(Text, nullable=True, comment="Chunk text", default="")
-    chunk_vector = Column(Text, nullable=True, comment="Chunk vector", default="[]")
+    chunk_vector = Column(
+        Text, nullable=True, comment="Chunk vector (legacy JSON)", default=None
+    )
+    chunk_vector_data = Column(
+        LargeBinary,
+        nullable=True,
+        comment="Chunk vector, encoded by vector_codec",
+        default=None,
+    )
     meta_data = Column(Text, nullable=True, comment="Meta Data", default="{}")
     extra_data = Column(Text, nullable=True, comment="Extra Data", default="{}")
     created_user_id = Column(
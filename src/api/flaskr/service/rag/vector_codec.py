@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+
+from ...common.config import get_config
+
+# binary layout of a stored vector: one codec byte followed by the payload
+# float32 / float16: the little-endian values
+# int8: a little-endian float32 scale, then the values divided by the scale
+VECTOR_CODEC_FLOAT32 = "float32"
+VECTOR_CODEC_FLOAT16 = "float16"
+VECTOR_CODEC_INT8 = "int8"
+
+_CODEC_IDS = {
+    VECTOR_CODEC_FLOAT32: 1,
+    VECTOR_CODEC_FLOAT16: 2,
+    VECTOR_CODEC_INT8: 3,
+}
+_CODEC_NAMES = {codec_id: name for name, codec_id in _CODEC_IDS.items()}
+# the int8 values follow the codec byte and the float32 scale
+_INT8_OFFSET = 5
+
+
+def get_default_codec() -> str:
+    return get_config("KB_VECTOR_CODEC", VECTOR_CODEC_FLOAT32)
+
+
+def encode_vector(vector, codec: str = None) -> bytes:
+    codec = codec or get_default_codec()
+    if codec not in _CODEC_IDS:
+        raise ValueError(f"unknown vector codec: {codec}")
+    values = np.asarray(vector, dtype=np.float32)
+    header = bytes([_CODEC_IDS[codec]])
+    if codec == VECTOR_CODEC_FLOAT32:
+        return header + values.astype("<f4").tobytes()
+    if codec == VECTOR_CODEC_FLOAT16:
+        return header + values.astype("<f2").tobytes()
+    max_abs = float(np.abs(values).max()) if values.size else 0.0
+    scale = max_abs / 127 if max_abs else 1.0
+    quantized = np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+    return header + np.float32(scale).astype("<f4").tobytes() + quantized.tobytes()
+
+
+def get_codec(data: bytes) -> str:
+    return _CODEC_NAMES.get(data[0]) if data else None
+
+
+# the rows written before the binary column hold a json list
+def _is_json(data) -> bool:
+    if isinstance(data, str):
+        return True
+    return data[:1] == b"["
+
+
+def decode_vector(data) -> np.ndarray:
+    if data is None or len(data) == 0:
+        return np.zeros(0, dtype=np.float32)
+    if _is_json(data):
+        return np.asarray(json.loads(data), dtype=np.float32)
+    return decode_vectors([data])[0]
+
+
+# decode a batch of vectors into one (n, dim) float32 matrix,
+# the rows sharing a codec and dim are decoded by a single numpy view
+def decode_vectors(data_list: list) -> np.ndarray:
+    if not data_list:
+        return np.zeros((0, 0), dtype=np.float32)
+    first = data_list[0]
+    if any(
+        data is None or len(data) != len(first) or _is_json(data) or data[0] != first[0]
+        for data in data_list
+    ):
+        return np.stack([decode_vector(data) for data in data_list])
+
+    codec = get_codec(first)
+    rows = np.frombuffer(b"".join(data_list), dtype=np.uint8).reshape(
+        len(data_list), len(first)
+    )
+    if codec == VECTOR_CODEC_FLOAT32:
+        return rows[:, 1:].copy().view("<f4").astype(np.float32)
+    if codec == VECTOR_CODEC_FLOAT16:
+        return rows[:, 1:].copy().view("<f2").astype(np.float32)
+    if codec == VECTOR_CODEC_INT8:
+        scales = rows[:, 1:_INT8_OFFSET].copy().view("<f4")
+        values = rows[:, _INT8_OFFSET:].copy().view(np.int8)
+        return values.astype(np.float32) * scales
+    raise ValueError(f"unknown vector codec id: {first[0]}")
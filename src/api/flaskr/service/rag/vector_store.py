@@ -0,0 +1,534 @@
+import ast
+import json
+import operator
+import os
+import re
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # windows, the locks are exclusive
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from flask import Flask, current_app
+
+from ...common.config import get_config
+from ... import dao
+from ..common.models import raise_error
+
+VECTOR_STORE_MILVUS = "milvus"
+VECTOR_STORE_LOCAL = "local"
+
+
+# the storage of the chunk vectors of the knowledge bases,
+# a collection is named by its kb_id and the chunks are dicts with an
+# "id", a "vector" and the scalar fields of kb_schema
+class VectorStore(ABC):
+    name = ""
+
+    @abstractmethod
+    def has_collection(self, kb_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def create_collection(self, kb_id: str, dim: int, properties: dict = None):
+        pass
+
+    @abstractmethod
+    def drop_collection(self, kb_id: str):
+        pass
+
+    @abstractmethod
+    def upsert(self, kb_id: str, data: list):
+        pass
+
+    # hits of {"id", "distance", "entity"} by cosine similarity, the larger the closer
+    @abstractmethod
+    def search(
+        self, kb_id: str, vector: list, my_filter: str, limit: int, output_fields: list
+    ) -> list:
+        pass
+
+
+class MilvusVectorStore(VectorStore):
+    name = VECTOR_STORE_MILVUS
+
+    def __init__(self, client):
+        self.client = client
+
+    def has_collection(self, kb_id: str) -> bool:
+        return self.client.has_collection(collection_name=kb_id)
+
+    def create_collection(self, kb_id: str, dim: int, properties: dict = None):
+        from .models import kb_schema, kb_index_params
+
+        self.client.create_collection(
+            # collection name can only contain numbers, letters and underscores
+            collection_name=kb_id,
+            schema=kb_schema(dim),
+            index_params=kb_index_params(),
+            properties=properties or {},
+        )
+
+    def drop_collection(self, kb_id: str):
+        self.client.drop_collection(collection_name=kb_id)
+
+    def upsert(self, kb_id: str, data: list):
+        self.client.upsert(collection_name=kb_id, data=data)
+
+    def search(
+        self, kb_id: str, vector: list, my_filter: str, limit: int, output_fields: list
+    ) -> list:
+        return [
+            {
+                "id": hit["id"],
+                "distance": hit["distance"],
+                "entity": dict(hit["entity"]),
+            }
+            for hit in self.client.search(
+                collection_name=kb_id,
+                anns_field="vector",
+                data=[vector],
+                filter=my_filter,
+                limit=limit,
+                search_params={"metric_type": "COSINE"},
+                output_fields=output_fields,
+            )[0]
+        ]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+_COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+
+# the scalar subset of the milvus filter expressions:
+# comparisons, in / not in lists, and / or / not and parentheses
+def compile_filter(my_filter: str):
+    expression = my_filter.replace("&&", " and ").replace("||", " or ")
+    node = ast.parse(expression.strip(), mode="eval").body
+
+    def evaluate(node, entity):
+        if isinstance(node, ast.BoolOp):
+            values = (evaluate(value, entity) for value in node.values)
+            return all(values) if isinstance(node.op, ast.And) else any(values)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return not evaluate(node.operand, entity)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand, entity)
+        if isinstance(node, ast.Compare):
+            left = evaluate(node.left, entity)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = evaluate(comparator, entity)
+                try:
+                    if not _COMPARE_OPERATORS[type(op)](left, right):
+                        return False
+                except TypeError:
+                    return False
+                left = right
+            return True
+        if isinstance(node, ast.Name):
+            return entity.get(node.id)
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [evaluate(x, entity) for x in node.elts]
+        raise ValueError(f"unsupported filter: {my_filter}")
+
+    # check the whole expression once, not only the branches a row reaches
+    for child in ast.walk(node):
+        if not isinstance(
+            child,
+            (
+                ast.BoolOp,
+                ast.And,
+                ast.Or,
+                ast.UnaryOp,
+                ast.Not,
+                ast.USub,
+                ast.Compare,
+                ast.Name,
+                ast.Load,
+                ast.Constant,
+                ast.List,
+                ast.Tuple,
+                *_COMPARE_OPERATORS.keys(),
+            ),
+        ):
+            raise ValueError(f"unsupported filter: {my_filter}")
+    return lambda entity: evaluate(node, entity)
+
+
+# an inverted file index: the vectors are clustered by spherical k-means,
+# a search only scores the rows of the clusters nearest to the query
+class IVFIndex:
+    def __init__(self, vectors: np.ndarray, rows: np.ndarray, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(len(rows), int(4 * np.sqrt(len(rows)))))
+        sample_rows = rows
+        if len(rows) > nlist * 64:
+            sample_rows = np.sort(rng.choice(rows, nlist * 64, replace=False))
+        sample = np.asarray(vectors[sample_rows])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(10):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.flatnonzero(~sums.any(axis=1))
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.assign = np.full(len(vectors), -1, dtype=np.int32)
+        self.size = len(rows)
+        self.add(vectors, rows)
+
+    def add(self, vectors: np.ndarray, rows: np.ndarray):
+        if len(self.assign) < len(vectors):
+            self.assign = np.concatenate(
+                [
+                    self.assign,
+                    np.full(len(vectors) - len(self.assign), -1, dtype=np.int32),
+                ]
+            )
+        for start in range(0, len(rows), 4096):
+            end = start + 4096
+            part = rows[start:end]
+            self.assign[part] = np.argmax(
+                np.asarray(vectors[part]) @ self.centroids.T, axis=1
+            )
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        scores = self.centroids @ query
+        nprobe = min(nprobe, len(scores))
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.flatnonzero(np.isin(self.assign, probe))
+
+
+# one knowledge base on disk:
+#   meta.json       the dim and properties
+#   vectors.f32     the normalized float32 rows, memory mapped
+#   entities.jsonl  the scalar fields of each row, in the same order
+# an upsert appends rows and hides the older rows of the same ids,
+# the files are compacted when most of the rows are hidden
+class LocalCollection:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.dim = int(self.meta["dim"])
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.entities_path = os.path.join(path, "entities.jsonl")
+        self.lock = threading.RLock()
+        self.file_state = None
+        self.ann = None
+        with self._file_lock(False):
+            self._load()
+
+    # the writers of all worker processes are serialized by a file lock
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(os.path.join(self.path, ".lock"), "a") as f:
+            if fcntl is None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                return
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _get_file_state(self):
+        state = []
+        for path in [self.vectors_path, self.entities_path]:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_ino, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _load(self):
+        vector_rows = 0
+        if os.path.exists(self.vectors_path):
+            vector_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        entities = []
+        entities_size = 0
+        if os.path.exists(self.entities_path):
+            with open(self.entities_path, "rb") as f:
+                for line in f:
+                    # the rows of an interrupted write
+                    if len(entities) == vector_rows or not line.endswith(b"\n"):
+                        break
+                    entities.append(json.loads(line))
+                    entities_size += len(line)
+        row_count = len(entities)
+        self.entities = entities
+        self.entities_size = entities_size
+        self.vectors = self._map_vectors(row_count)
+        self.alive = np.zeros(row_count, dtype=bool)
+        self.id_rows = {}
+        self._add_rows(0)
+        self.filter_masks = {}
+        self.ann = None
+        self.file_state = self._get_file_state()
+
+    def _map_vectors(self, row_count: int) -> np.ndarray:
+        if not row_count:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(
+            self.vectors_path, dtype="<f4", mode="r", shape=(row_count, self.dim)
+        )
+
+    def _add_rows(self, start: int):
+        for row in range(start, len(self.entities)):
+            chunk_id = self.entities[row]["id"]
+            old_row = self.id_rows.get(chunk_id)
+            if old_row is not None:
+                self.alive[old_row] = False
+            self.id_rows[chunk_id] = row
+            self.alive[row] = True
+
+    def _dump_entity(self, entity: dict) -> bytes:
+        return (json.dumps(entity, ensure_ascii=False) + "\n").encode("utf-8")
+
+    # pick up the rows written by the other worker processes
+    def sync(self):
+        if self._get_file_state() != self.file_state:
+            with self.lock, self._file_lock(False):
+                self._load()
+
+    def upsert(self, data: list):
+        vectors = _normalize(
+            np.asarray([x["vector"] for x in data], dtype=np.float32).reshape(
+                len(data), -1
+            )
+        )
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"vector dim {vectors.shape[1]} != {self.dim}")
+        lines = [
+            self._dump_entity({k: v for k, v in x.items() if k != "vector"})
+            for x in data
+        ]
+        with self.lock, self._file_lock(True):
+            if self._get_file_state() != self.file_state:
+                self._load()
+            start = len(self.entities)
+            # drop the tail of an interrupted write before appending
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * 4 * self.dim)
+                f.write(vectors.astype("<f4").tobytes())
+            with open(self.entities_path, "ab") as f:
+                f.truncate(self.entities_size)
+                f.write(b"".join(lines))
+            self.entities.extend(json.loads(line) for line in lines)
+            self.entities_size += sum(len(line) for line in lines)
+            self.vectors = self._map_vectors(len(self.entities))
+            self.alive = np.concatenate([self.alive, np.zeros(len(data), dtype=bool)])
+            self._add_rows(start)
+            self.filter_masks = {}
+            if self.ann is not None:
+                self.ann.add(self.vectors, np.arange(start, len(self.entities)))
+            self.file_state = self._get_file_state()
+            dead_count = len(self.alive) - int(self.alive.sum())
+            if dead_count > max(1024, len(self.alive) - dead_count):
+                self._compact()
+
+    def _compact(self):
+        rows = np.flatnonzero(self.alive)
+        vectors_tmp = self.vectors_path + ".tmp"
+        entities_tmp = self.entities_path + ".tmp"
+        with open(vectors_tmp, "wb") as f:
+            f.write(np.asarray(self.vectors[rows]).astype("<f4").tobytes())
+        with open(entities_tmp, "wb") as f:
+            f.write(b"".join(self._dump_entity(self.entities[row]) for row in rows))
+        os.replace(vectors_tmp, self.vectors_path)
+        os.replace(entities_tmp, self.entities_path)
+        self._load()
+
+    def _get_filter_mask(self, my_filter: str) -> np.ndarray:
+        my_filter = (my_filter or "").strip()
+        if not my_filter:
+            return self.alive
+        mask = self.filter_masks.get(my_filter)
+        if mask is None:
+            predicate = compile_filter(my_filter)
+            mask = self.alive & np.fromiter(
+                (bool(predicate(entity)) for entity in self.entities),
+                dtype=bool,
+                count=len(self.entities),
+            )
+            # the masks of the latest filters, they are dropped on every write
+            if len(self.filter_masks) >= 64:
+                self.filter_masks.clear()
+            self.filter_masks[my_filter] = mask
+        return mask
+
+    def _get_ann(self):
+        min_rows = int(get_config("LOCAL_VECTOR_ANN_MIN_ROWS", "50000"))
+        alive_count = int(self.alive.sum())
+        if not min_rows or alive_count < min_rows:
+            return None
+        # rebuild the clusters when the collection has doubled since they were built
+        if self.ann is None or self.ann.size * 2 < alive_count:
+            self.ann = IVFIndex(self.vectors, np.flatnonzero(self.alive))
+        return self.ann
+
+    def search(
+        self, vector: list, my_filter: str, limit: int, output_fields: list
+    ) -> list:
+        self.sync()
+        with self.lock:
+            vectors = self.vectors
+            entities = self.entities
+            mask = self._get_filter_mask(my_filter)
+            ann = self._get_ann()
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        if ann is not None:
+            rows = ann.candidates(
+                query, int(get_config("LOCAL_VECTOR_ANN_NPROBE", "16"))
+            )
+            rows = rows[mask[rows]]
+            scores = np.asarray(vectors[rows]) @ query
+        else:
+            rows = np.flatnonzero(mask)
+            scores = (vectors @ query)[rows]
+        limit = min(limit, len(rows))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "id": entities[rows[i]]["id"],
+                "distance": float(scores[i]),
+                "entity": {
+                    field: entities[rows[i]].get(field)
+                    for field in output_fields
+                    if field in entities[rows[i]]
+                },
+            }
+            for i in top
+        ]
+
+
+# the knowledge bases kept in memory mapped files under LOCAL_VECTOR_STORE_PATH,
+# searched exactly by numpy, or by an ivf index for large collections
+class LocalVectorStore(VectorStore):
+    name = VECTOR_STORE_LOCAL
+
+    def __init__(self, path: str):
+        self.path = path
+        self.collections = {}
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _get_path(self, kb_id: str) -> str:
+        # kb_id is also a directory name
+        if not re.fullmatch(r"\w+", kb_id or ""):
+            raise ValueError(f"invalid kb_id: {kb_id}")
+        return os.path.join(self.path, kb_id)
+
+    def load(self) -> list:
+        for kb_id in sorted(os.listdir(self.path)):
+            if os.path.exists(os.path.join(self.path, kb_id, "meta.json")):
+                self._get_collection(kb_id)
+        return list(self.collections.keys())
+
+    def _get_collection(self, kb_id: str) -> LocalCollection:
+        collection = self.collections.get(kb_id)
+        if collection is not None and os.path.exists(collection.path):
+            return collection
+        path = self._get_path(kb_id)
+        with self.lock:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                self.collections.pop(kb_id, None)
+                return None
+            collection = LocalCollection(path)
+            self.collections[kb_id] = collection
+            return collection
+
+    def has_collection(self, kb_id: str) -> bool:
+        return self._get_collection(kb_id) is not None
+
+    def create_collection(self, kb_id: str, dim: int, properties: dict = None):
+        path = self._get_path(kb_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": int(dim), "properties": properties or {}}, f)
+
+    def drop_collection(self, kb_id: str):
+        with self.lock:
+            self.collections.pop(kb_id, None)
+            shutil.rmtree(self._get_path(kb_id), ignore_errors=True)
+
+    def _get_existing_collection(self, kb_id: str) -> LocalCollection:
+        collection = self._get_collection(kb_id)
+        if collection is None:
+            raise ValueError(f"collection not found: {kb_id}")
+        return collection
+
+    def upsert(self, kb_id: str, data: list):
+        if data:
+            self._get_existing_collection(kb_id).upsert(data)
+
+    def search(
+        self, kb_id: str, vector: list, my_filter: str, limit: int, output_fields: list
+    ) -> list:
+        return self._get_existing_collection(kb_id).search(
+            vector, my_filter, limit, output_fields
+        )
+
+
+vector_store = None
+
+
+# VECTOR_STORE=milvus|local, by default milvus when it is configured
+def init_vector_store(app: Flask) -> VectorStore:
+    global vector_store
+    store = app.config.get("VECTOR_STORE") or (
+        VECTOR_STORE_MILVUS if dao.milvus_client is not None else VECTOR_STORE_LOCAL
+    )
+    if store == VECTOR_STORE_MILVUS:
+        if dao.milvus_client is None:
+            app.logger.warning("VECTOR_STORE is milvus but milvus is not configured")
+            vector_store = None
+            return None
+        vector_store = MilvusVectorStore(dao.milvus_client)
+    else:
+        vector_store = LocalVectorStore(
+            app.config.get("LOCAL_VECTOR_STORE_PATH") or "data/vector_store"
+        )
+        app.logger.info(f"local vector store loaded: {vector_store.load()}")
+    app.logger.info(f"init vector store: {vector_store.name}")
+    return vector_store
+
+
+def get_vector_store() -> VectorStore:
+    store = vector_store or init_vector_store(current_app)
+    if store is None:
+        raise_error("RAG.MILVUS_NOT_CONFIGURED")
+    return store
@@ -10,7 +10,8 @@ from flaskr.service.profile.models import ProfileItem
 from flaskr.service.common.models import raise_error
 from flaskr.service.shifu.utils import (
     get_existing_blocks,
-    get_original_outline_tree,
+    get_outline_tree_index,
+    BlockIndex,
     change_block_status_to_history,
     mark_block_to_delete,
 )
@@ -24,7 +25,6 @@ from flaskr.service.lesson.const import (
     STATUS_DELETE,
 )
 from flaskr.service.check_risk.funcs import check_text_with_risk_control
-import queue
 from flaskr.dao import redis_client
 
 
@@ -36,28 +36,13 @@ def get_block_list(app, user_id: str, outline_id: str):
         ).first()
         if not lesson:
             raise_error("SHIFU.OUTLINE_NOT_FOUND")
-        tree = get_original_outline_tree(app, lesson.course_id)
-
-        q = queue.Queue()
-        for node in tree:
-            q.put(node)
-        sub_outline_ids = []
-        find_outline = False
-        sub_outlines = []
-        while not q.empty():
-            node = q.get()
-            if node.outline_id == outline_id:
-                find_outline = True
-                q.queue.clear()
-            if find_outline:
-                sub_outline_ids.append(node.outline_id)
-                sub_outlines.append(node.outline)
-            if node.children and len(node.children) > 0:
-                for child in node.children:
-                    q.put(child)
+        index = get_outline_tree_index(app, lesson.course_id)
+        sub_outlines = [node.outline for node in index.get_sub_nodes(outline_id)]
+        sub_outline_ids = [sub_outline.lesson_id for sub_outline in sub_outlines]
         # get sub outline list
         app.logger.info(f"sub_outline_ids : {sub_outline_ids}")
         blocks = get_existing_blocks(app, sub_outline_ids)
+        block_index = BlockIndex(blocks)
         ret = []
         app.logger.info(f"blocks : {len(blocks)}")
 
@@ -77,11 +62,7 @@ def get_block_list(app, user_id: str, outline_id: str):
                     # outline_level=len(sub_outline.lesson_no) // 2,
                 )
             )
-            lesson_blocks = sorted(
-                [b for b in blocks if b.lesson_id == sub_outline.lesson_id],
-                key=lambda x: x.script_index,
-            )
-            for block in lesson_blocks:
+            for block in block_index.get_outline_blocks(sub_outline.lesson_id):
                 ret.append(generate_block_dto(block, profile_items))
         return ret
     pass
@@ -136,28 +117,13 @@ def save_block_list_internal(
             return SaveBlockListResultDto([], {})
         outline_id = outline.lesson_id
 
-        tree = get_original_outline_tree(app, outline.course_id)
-
-        q = queue.Queue()
-        for node in tree:
-            q.put(node)
-        sub_outline_ids = []
-        find_outline = False
-        sub_outlines = []
-        while not q.empty():
-            node = q.get()
-            if node.outline_id == outline_id:
-                find_outline = True
-                q.queue.clear()
-            if find_outline:
-                sub_outline_ids.append(node.outline_id)
-                sub_outlines.append(node.outline)
-            if node.children and len(node.children) > 0:
-                for child in node.children:
-                    q.put(child)
+        index = get_outline_tree_index(app, outline.course_id)
+        sub_outlines = [node.outline for node in index.get_sub_nodes(outline_id)]
+        sub_outline_ids = [sub_outline.lesson_id for sub_outline in sub_outlines]
         app.logger.info(f"new sub_outline_ids : {sub_outline_ids}")
         # get all blocks
         blocks = get_existing_blocks(app, sub_outline_ids)
+        existing_blocks = BlockIndex(blocks)
         app.logger.info(f"new blocks : {len(blocks)}")
         block_index = 1
         current_outline_id = outline_id
@@ -175,9 +141,7 @@ def save_block_list_internal(
                 app.logger.info(f"block_dto id : {block_dto.block_id}")
                 if block_dto.block_id is not None and block_dto.block_id != "":
                     block_id = block_dto.block_id
-                    check_block = next(
-                        (b for b in blocks if b.script_id == block_dto.block_id), None
-                    )
+                    check_block = existing_blocks.get_block(block_dto.block_id)
                     if check_block:
                         block_model = check_block
                     else:
@@ -336,8 +300,9 @@ def save_block_list_internal(
                 # pass the top outline
                 pass
         app.logger.info("save block ids : {}".format(save_block_ids))
+        saved_block_ids = set(save_block_ids)
         for block in blocks:
-            if block.script_id not in save_block_ids:
+            if block.script_id not in saved_block_ids:
                 app.logger.info("delete block : {}".format(block.script_id))
                 mark_block_to_delete(block, user_id, time)
         db.session.commit()
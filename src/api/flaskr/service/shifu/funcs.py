@@ -1,22 +1,21 @@
 from ...dao import redis_client as redis, db
 from datetime import datetime
 from .dtos import ShifuDto, ShifuDetailDto
-from ..lesson.models import AICourse, AILesson, AILessonScript
+from ..lesson.models import AICourse
 from ...util.uuid import generate_id
 from .models import FavoriteScenario, AiCourseAuth
 from ..common.dtos import PageNationDTO
 from ...service.lesson.const import (
     STATUS_PUBLISH,
     STATUS_DRAFT,
-    STATUS_DELETE,
     STATUS_HISTORY,
-    STATUS_TO_DELETE,
 )
 from ..check_risk.funcs import check_text_with_risk_control
 from ..common.models import raise_error, raise_error_with_args
 from ...common.config import get_config
 from ...service.resource.models import Resource
-from .utils import get_existing_outlines_for_publish, get_existing_blocks_for_publish
+from ..lesson.graph import bump_course_graph_version
+from .publish import publish_shifu_draft
 import oss2
 import uuid
 import json
@@ -267,117 +266,8 @@ def publish_shifu(app, user_id, shifu_id: str):
         )
         if shifu:
             check_shifu_can_publish(app, shifu_id)
-            shifu.status = STATUS_PUBLISH
-            shifu.updated_user_id = user_id
-            shifu.updated_at = datetime.now()
-            # deal with draft lessons
-            to_publish_lessons = get_existing_outlines_for_publish(app, shifu_id)
-            for to_publish_lesson in to_publish_lessons:
-                if to_publish_lesson.status == STATUS_TO_DELETE:
-                    # delete the lesson
-                    to_publish_lesson.status = STATUS_DELETE
-                    AILesson.query.filter(
-                        AILesson.lesson_id == to_publish_lesson.lesson_id,
-                        AILesson.status.in_([STATUS_PUBLISH]),
-                    ).update(
-                        {
-                            "status": STATUS_DELETE,
-                            "updated_user_id": user_id,
-                            "updated": datetime.now(),
-                        }
-                    )
-                elif to_publish_lesson.status == STATUS_PUBLISH:
-                    # change the lesson status to history
-                    # these logic would be removed in the future
-                    AILesson.query.filter(
-                        AILesson.lesson_id == to_publish_lesson.lesson_id,
-                        AILesson.status.in_([STATUS_PUBLISH]),
-                        AILesson.id != to_publish_lesson.id,
-                    ).update(
-                        {
-                            "status": STATUS_HISTORY,
-                            "updated_user_id": user_id,
-                            "updated": datetime.now(),
-                        }
-                    )
-
-                elif to_publish_lesson.status == STATUS_DRAFT:
-                    # create a new lesson to publish
-                    new_lesson = to_publish_lesson.clone()
-                    new_lesson.status = STATUS_PUBLISH
-                    new_lesson.updated_user_id = user_id
-                    new_lesson.updated = datetime.now()
-                    db.session.add(new_lesson)
-                    # change the lesson status to history
-                    AILesson.query.filter(
-                        AILesson.lesson_id == to_publish_lesson.lesson_id,
-                        AILesson.status.in_([STATUS_PUBLISH]),
-                        AILesson.id < to_publish_lesson.id,
-                    ).update(
-                        {
-                            "status": STATUS_HISTORY,
-                            "updated_user_id": user_id,
-                            "updated": datetime.now(),
-                        }
-                    )
-
-            lesson_ids = [lesson.lesson_id for lesson in to_publish_lessons]
-            block_scripts = get_existing_blocks_for_publish(app, lesson_ids)
-            if block_scripts:
-                for block_script in block_scripts:
-                    if block_script.status == STATUS_TO_DELETE:
-                        # delete the block script
-                        block_script.status = STATUS_DELETE
-                        AILessonScript.query.filter(
-                            AILessonScript.script_id == block_script.script_id,
-                            AILessonScript.status.in_([STATUS_PUBLISH]),
-                        ).update(
-                            {
-                                "status": STATUS_DELETE,
-                                "updated_user_id": user_id,
-                                "updated": datetime.now(),
-                            }
-                        )
-
-                    elif block_script.status == STATUS_DRAFT:
-                        # create a new block script to publish
-                        new_block_script = block_script.clone()
-                        new_block_script.status = STATUS_PUBLISH
-                        new_block_script.updated_user_id = user_id
-                        new_block_script.updated = datetime.now()
-                        db.session.add(new_block_script)
-                        # change the block status to history
-                        AILessonScript.query.filter(
-                            AILessonScript.script_id == block_script.script_id,
-                            AILessonScript.status.in_([STATUS_PUBLISH]),
-                            AILessonScript.id < block_script.id,
-                        ).update(
-                            {
-                                "status": STATUS_HISTORY,
-                                "updated_user_id": user_id,
-                                "updated": datetime.now(),
-                            }
-                        )
-
-                    elif block_script.status == STATUS_PUBLISH:
-                        # if the block is publish, then we need to change the status to history
-                        # these logic would be removed in the future
-                        block_script.status = STATUS_PUBLISH
-                        AILessonScript.query.filter(
-                            AILessonScript.script_id == block_script.script_id,
-                            AILessonScript.status.in_([STATUS_PUBLISH]),
-                            AILessonScript.id != block_script.id,
-                        ).update(
-                            {
-                                "status": STATUS_HISTORY,
-                                "updated_user_id": user_id,
-                                "updated": datetime.now(),
-                            }
-                        )
-                    block_script.updated_user_id = user_id
-                    block_script.updated = datetime.now()
-                    db.session.add(block_script)
-            db.session.commit()
+            publish_shifu_draft(app, user_id, shifu)
+            bump_course_graph_version(app, shifu_id)
             return get_config("WEB_URL", "UNCONFIGURED") + "/c/" + shifu.course_id
         raise_error("SHIFU.SHIFU_NOT_FOUND")
 
@@ -20,6 +20,7 @@ from .utils import (
     get_original_outline_tree,
     OutlineTreeNode,
     reorder_outline_tree_and_save,
+    bump_shifu_draft_version,
 )
 import queue
 from flaskr.service.check_risk.funcs import check_text_with_risk_control
@@ -114,6 +115,7 @@ def create_chapter(
                 db.session.add(new_outline)
 
         db.session.commit()
+        bump_shifu_draft_version(app, shifu_id)
         return ChapterDto(
             chapter.lesson_id,
             chapter.lesson_name,
@@ -172,6 +174,7 @@ def modify_chapter(
             if old_check_str != new_check_str:
                 check_text_with_risk_control(app, chapter_id, user_id, new_check_str)
             db.session.commit()
+            bump_shifu_draft_version(app, chapter.course_id)
             return ChapterDto(
                 chapter.lesson_id,
                 chapter.lesson_name,
@@ -232,6 +235,7 @@ def delete_chapter(app, user_id: str, chapter_id: str):
             for block in blocks:
                 change_block_status_to_history(block, user_id, time)
             db.session.commit()
+            bump_shifu_draft_version(app, chapter.course_id)
             return True
         raise_error("SHIFU.CHAPTER_NOT_FOUND")
 
@@ -281,6 +285,7 @@ def update_chapter_order(
         if reorder:
             reorder_outline_tree_and_save(app, root, user_id, time)
             db.session.commit()
+            bump_shifu_draft_version(app, shifu_id)
         else:
             raise_error("SHIFU.CHAPTER_IDS_NOT_FOUND")
 
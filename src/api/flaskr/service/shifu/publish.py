@@ -0,0 +1,175 @@
+import time
+from datetime import datetime
+
+from flask import Flask
+
+from ...dao import db
+from ..lesson.models import AICourse, AILesson, AILessonScript
+from ...service.lesson.const import (
+    STATUS_PUBLISH,
+    STATUS_DRAFT,
+    STATUS_DELETE,
+    STATUS_HISTORY,
+    STATUS_TO_DELETE,
+)
+from .utils import get_existing_outlines_for_publish, get_existing_blocks_for_publish
+
+# ids per IN (...) list of one statement
+PUBLISH_BATCH_SIZE = 1000
+
+
+def _chunks(items: list):
+    for start in range(0, len(items), PUBLISH_BATCH_SIZE):
+        end = start + PUBLISH_BATCH_SIZE
+        yield items[start:end]
+
+
+class PublishReport:
+    def __init__(self, shifu_id: str):
+        self.shifu_id = shifu_id
+        self.outlines = {}
+        self.blocks = {}
+        self.statements = 0
+        self.timings = {}
+
+    def __json__(self):
+        return {
+            "shifu_id": self.shifu_id,
+            "outlines": self.outlines,
+            "blocks": self.blocks,
+            "statements": self.statements,
+            "timings": self.timings,
+        }
+
+
+# the changes of one table: the drafts to copy as published rows,
+# and the ids of the rows to delete, to move to history and to touch
+class PublishPlan:
+    def __init__(self, model):
+        self.model = model
+        self.insert_rows = []
+        self.delete_ids = []
+        self.history_ids = []
+        self.touch_ids = []
+        self.unchanged = 0
+
+    def get_counts(self) -> dict:
+        return {
+            "published": len(self.insert_rows),
+            "deleted": len(self.delete_ids),
+            "history": len(self.history_ids),
+            "unchanged": self.unchanged,
+        }
+
+
+def _get_published_ids(model, key: str, values: list) -> dict:
+    published_ids = {}
+    column = getattr(model, key)
+    for chunk in _chunks(values):
+        for row_id, value in db.session.query(model.id, column).filter(
+            column.in_(chunk), model.status == STATUS_PUBLISH
+        ):
+            published_ids.setdefault(value, []).append(row_id)
+    return published_ids
+
+
+# the same diff the row by row publish made: for the latest row of each key
+# to delete: the row and the published rows are deleted
+# draft: the draft is copied as published and the older published rows go to history
+# published: the other published rows go to history
+def _make_plan(model, key: str, latest_rows: list, touch_latest: bool) -> PublishPlan:
+    plan = PublishPlan(model)
+    published_ids = _get_published_ids(
+        model, key, list({getattr(row, key) for row in latest_rows})
+    )
+    for row in latest_rows:
+        row_published_ids = published_ids.get(getattr(row, key), [])
+        if row.status == STATUS_TO_DELETE:
+            plan.delete_ids.append(row.id)
+            plan.delete_ids.extend(row_published_ids)
+        elif row.status == STATUS_DRAFT:
+            plan.insert_rows.append(row)
+            plan.history_ids.extend(x for x in row_published_ids if x < row.id)
+            if touch_latest:
+                plan.touch_ids.append(row.id)
+        elif row.status == STATUS_PUBLISH:
+            plan.history_ids.extend(x for x in row_published_ids if x != row.id)
+            plan.unchanged += 1
+            if touch_latest:
+                plan.touch_ids.append(row.id)
+    return plan
+
+
+def _update_ids(model, ids: list, values: dict) -> int:
+    statements = 0
+    for chunk in _chunks(ids):
+        db.session.query(model).filter(model.id.in_(chunk)).update(
+            values, synchronize_session=False
+        )
+        statements += 1
+    return statements
+
+
+def _apply_plan(plan: PublishPlan, user_id: str, now: datetime) -> int:
+    model = plan.model
+    audit = {"updated_user_id": user_id, "updated": now}
+    statements = _update_ids(model, plan.delete_ids, {"status": STATUS_DELETE, **audit})
+    statements += _update_ids(
+        model, plan.history_ids, {"status": STATUS_HISTORY, **audit}
+    )
+    statements += _update_ids(model, plan.touch_ids, audit)
+    if plan.insert_rows:
+        columns = [c.key for c in model.__table__.columns if c.key != "id"]
+        db.session.bulk_insert_mappings(
+            model,
+            [
+                {
+                    **{column: getattr(row, column) for column in columns},
+                    "status": STATUS_PUBLISH,
+                    **audit,
+                }
+                for row in plan.insert_rows
+            ],
+        )
+        statements += 1
+    return statements
+
+
+# publish the drafts of a shifu in one transaction: the diff is computed in
+# memory and written by a few set based updates and one bulk insert per table
+def publish_shifu_draft(app: Flask, user_id: str, shifu: AICourse) -> PublishReport:
+    start = time.perf_counter()
+    now = datetime.now()
+    shifu_id = shifu.course_id
+    report = PublishReport(shifu_id)
+    try:
+        outlines = get_existing_outlines_for_publish(app, shifu_id)
+        blocks = get_existing_blocks_for_publish(
+            app, [outline.lesson_id for outline in outlines]
+        )
+        report.timings["load_ms"] = (time.perf_counter() - start) * 1000
+
+        diff_start = time.perf_counter()
+        outline_plan = _make_plan(AILesson, "lesson_id", outlines, False)
+        block_plan = _make_plan(AILessonScript, "script_id", blocks, True)
+        report.outlines = outline_plan.get_counts()
+        report.blocks = block_plan.get_counts()
+        report.timings["diff_ms"] = (time.perf_counter() - diff_start) * 1000
+
+        write_start = time.perf_counter()
+        shifu.status = STATUS_PUBLISH
+        shifu.updated_user_id = user_id
+        shifu.updated_at = now
+        report.statements = _apply_plan(outline_plan, user_id, now)
+        report.statements += _apply_plan(block_plan, user_id, now)
+        report.timings["write_ms"] = (time.perf_counter() - write_start) * 1000
+
+        commit_start = time.perf_counter()
+        db.session.commit()
+        report.timings["commit_ms"] = (time.perf_counter() - commit_start) * 1000
+    except Exception:
+        db.session.rollback()
+        raise
+    report.timings["total_ms"] = (time.perf_counter() - start) * 1000
+    app.logger.info(f"publish shifu report: {report.__json__()}")
+    return report
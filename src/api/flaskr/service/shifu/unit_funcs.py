@@ -23,6 +23,7 @@ from flaskr.service.shifu.utils import (
     get_original_outline_tree,
     OutlineTreeNode,
     reorder_outline_tree_and_save,
+    bump_shifu_draft_version,
 )
 
 import queue
@@ -171,6 +172,7 @@ def create_unit(
 
             db.session.add(unit)
             db.session.commit()
+            bump_shifu_draft_version(app, shifu_id)
             return OutlineDto(
                 unit.lesson_id,
                 unit.lesson_no,
@@ -335,6 +337,7 @@ def modify_unit(
                         )
 
             db.session.commit()
+            bump_shifu_draft_version(app, unit.course_id)
             return OutlineDto(
                 unit.lesson_id,
                 unit.lesson_no,
@@ -384,3 +387,4 @@ def delete_unit(app, user_id: str, unit_id: str):
         # reorder the outline tree
         reorder_outline_tree_and_save(app, root, user_id, time)
         db.session.commit()
+        bump_shifu_draft_version(app, unit.course_id)
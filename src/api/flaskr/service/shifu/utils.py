@@ -6,9 +6,13 @@ from flaskr.service.lesson.const import (
     STATUS_HISTORY,
     STATUS_TO_DELETE,
 )
-from flask import Flask
-from flaskr.dao import db
+from flask import Flask, g
+from flaskr.dao import db, redis_client as redis
+from flaskr.common.config import get_config
+from flaskr.service.lesson.graph import get_course_graph_version
 from datetime import datetime
+from collections import OrderedDict, deque
+import threading
 import queue
 
 
@@ -230,7 +234,10 @@ def mark_block_to_delete(block_info: AILessonScript, user_id: str, time: datetim
 
 
 def get_original_outline_tree(app: Flask, shifu_id: str) -> list["OutlineTreeNode"]:
-    outlines = get_existing_outlines(app, shifu_id)
+    return build_outline_tree(app, get_existing_outlines(app, shifu_id))
+
+
+def build_outline_tree(app: Flask, outlines: list[AILesson]) -> list["OutlineTreeNode"]:
     sorted_outlines = sorted(outlines, key=lambda x: (len(x.lesson_no), x.lesson_no))
     outline_tree = []
 
@@ -279,3 +286,131 @@ def reorder_outline_tree_and_save(
             db.session.add(new_outline)
         for child in node.children:
             reorder_queue.put(child)
+
+
+# read-only index of the outline tree of a shifu draft for the block editor
+# the nodes hold detached copies of the outlines, so one index is shared
+# by the requests of a worker until the draft version changes
+class OutlineTreeIndex:
+    shifu_id: str
+    version: tuple
+    tree: list[OutlineTreeNode]
+    nodes: dict[str, OutlineTreeNode]
+
+    def __init__(
+        self, app: Flask, shifu_id: str, version: tuple, outlines: list[AILesson]
+    ):
+        self.shifu_id = shifu_id
+        self.version = version
+        self.tree = build_outline_tree(app, outlines)
+        self.nodes = {}
+        self.sub_nodes = {}
+        q = deque(self.tree)
+        while q:
+            node = q.popleft()
+            self.nodes.setdefault(node.outline_id, node)
+            q.extend(node.children)
+
+    def get_node(self, outline_id: str) -> OutlineTreeNode:
+        return self.nodes.get(outline_id)
+
+    # the node and all its descendants in breadth first order
+    def get_sub_nodes(self, outline_id: str) -> list[OutlineTreeNode]:
+        sub_nodes = self.sub_nodes.get(outline_id)
+        if sub_nodes is None:
+            sub_nodes = []
+            node = self.nodes.get(outline_id)
+            q = deque([node] if node else [])
+            while q:
+                node = q.popleft()
+                sub_nodes.append(node)
+                q.extend(node.children)
+            self.sub_nodes[outline_id] = sub_nodes
+        return sub_nodes
+
+    def get_sub_outline_ids(self, outline_id: str) -> list[str]:
+        return [node.outline_id for node in self.get_sub_nodes(outline_id)]
+
+
+# the blocks of some outlines grouped by outline and by block id
+# it is built per request, as the editor updates the rows it holds
+class BlockIndex:
+    def __init__(self, blocks: list[AILessonScript]):
+        self.blocks = blocks
+        self.outline_blocks = {}
+        self.blocks_by_id = {}
+        for block in blocks:
+            self.outline_blocks.setdefault(block.lesson_id, []).append(block)
+            self.blocks_by_id.setdefault(block.script_id, block)
+        for outline_blocks in self.outline_blocks.values():
+            outline_blocks.sort(key=lambda x: x.script_index)
+
+    def get_outline_blocks(self, outline_id: str) -> list[AILessonScript]:
+        return self.outline_blocks.get(outline_id, [])
+
+    def get_block(self, block_id: str) -> AILessonScript:
+        return self.blocks_by_id.get(block_id)
+
+
+_outline_indexes = OrderedDict()
+_outline_index_lock = threading.Lock()
+
+
+def _get_draft_version_key(shifu_id: str) -> str:
+    return (
+        get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "shifu_draft_version:" + shifu_id
+    )
+
+
+# the outlines change with the editor (draft version) and with the
+# publish and the lesson import (course graph version), read once per app context
+def get_shifu_draft_version(app: Flask, shifu_id: str) -> tuple:
+    versions = g.setdefault("shifu_draft_versions", {})
+    if shifu_id not in versions:
+        version = redis.get(_get_draft_version_key(shifu_id))
+        versions[shifu_id] = (
+            int(version) if version else 0,
+            get_course_graph_version(app, shifu_id),
+        )
+    return versions[shifu_id]
+
+
+# bump the draft version after the outlines of the shifu are committed
+def bump_shifu_draft_version(app: Flask, shifu_id: str) -> int:
+    version = redis.incr(_get_draft_version_key(shifu_id))
+    versions = g.get("shifu_draft_versions", None)
+    if versions is not None:
+        versions.pop(shifu_id, None)
+    app.logger.info(f"bump shifu draft version: {shifu_id} {version}")
+    return version
+
+
+def _snapshot_outline(outline: AILesson) -> AILesson:
+    obj = outline.clone()
+    obj.id = outline.id
+    return obj
+
+
+def get_outline_tree_index(app: Flask, shifu_id: str) -> OutlineTreeIndex:
+    version = get_shifu_draft_version(app, shifu_id)
+    index = _outline_indexes.get(shifu_id)
+    if index is not None and index.version == version:
+        return index
+    with _outline_index_lock:
+        index = _outline_indexes.get(shifu_id)
+        if index is None or index.version != version:
+            outlines = [
+                _snapshot_outline(outline)
+                for outline in get_existing_outlines(app, shifu_id)
+            ]
+            index = OutlineTreeIndex(app, shifu_id, version, outlines)
+            _outline_indexes[shifu_id] = index
+            app.logger.info(
+                f"build outline tree index: {shifu_id} version:{version} "
+                f"outlines:{len(index.nodes)}"
+            )
+        _outline_indexes.move_to_end(shifu_id)
+        max_size = int(get_config("SHIFU_OUTLINE_INDEX_CACHE_SIZE", "64"))
+        while len(_outline_indexes) > max_size:
+            _outline_indexes.popitem(last=False)
+    return index
@@ -26,3 +26,15 @@ VALID_INTERACTION_TYPES = {
     INTERACTION_TYPE_LIKE,
     INTERACTION_TYPE_DISLIKE,
 }
+
+
+STREAM_MODE_CHAR = "char"
+STREAM_MODE_WORD = "word"
+STREAM_MODE_SENTENCE = "sentence"
+STREAM_MODE_INSTANT = "instant"
+STREAM_MODES = {
+    STREAM_MODE_CHAR,
+    STREAM_MODE_WORD,
+    STREAM_MODE_SENTENCE,
+    STREAM_MODE_INSTANT,
+}
@@ -247,6 +247,8 @@ class StudyRecordDTO:
     ask_mode: bool
     teach_avator: str
     ask_ui: ScriptDTO
+    has_more: bool
+    next_cursor: str
 
     def __init__(self, records, ui=None, ask_mode=True, teach_avator=None):
         self.records = records
@@ -254,6 +256,10 @@ class StudyRecordDTO:
         self.ask_mode = ask_mode
         self.teach_avator = teach_avator
         self.ask_ui = None
+        # a page of the records: if there are older records,
+        # and the log id to fetch them with
+        self.has_more = False
+        self.next_cursor = None
 
     def __json__(self):
         return {
@@ -262,6 +268,19 @@ class StudyRecordDTO:
             "ask_mode": self.ask_mode,
             "teach_avator": self.teach_avator,
             "ask_ui": self.ask_ui,
+            "has_more": self.has_more,
+            "next_cursor": self.next_cursor,
+        }
+
+    # the page without the records, sent after them in a ndjson response
+    def get_page_info(self) -> dict:
+        return {
+            "ui": self.ui,
+            "ask_mode": self.ask_mode,
+            "teach_avator": self.teach_avator,
+            "ask_ui": self.ask_ui,
+            "has_more": self.has_more,
+            "next_cursor": self.next_cursor,
         }
 
 
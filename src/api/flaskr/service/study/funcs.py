@@ -28,6 +28,7 @@ from ...service.lesson.const import (
 )
 from ...dao import db
 
+from ...service.lesson.graph import build_lesson_tree, get_course_graph
 from ...service.lesson.models import AICourse, AILesson, AILessonScript
 from ...service.order.models import (
     AICourseBuyRecord,
@@ -41,13 +42,44 @@ from flaskr.util.uuid import generate_id
 from flaskr.service.user.models import User
 
 
+def _make_lesson_attend_dto(
+    lesson: AILesson, attend_map: dict, attend_status_values: dict
+) -> AILessonAttendDTO:
+    attend_info = attend_map.get(lesson.lesson_id, None)
+    status = attend_info.status if attend_info else ATTEND_STATUS_LOCKED
+    return AILessonAttendDTO(
+        lesson.lesson_no,
+        lesson.lesson_name,
+        lesson.lesson_id,
+        attend_status_values[status],
+        status,
+        lesson.lesson_type,
+        [],
+        unique_id=lesson.lesson_feishu_id,
+        updated=True if attend_info and attend_info.lesson_updated == 1 else False,
+    )
+
+
+def _add_lesson_children(
+    lesson_dto: AILessonAttendDTO,
+    children: list,
+    attend_map: dict,
+    attend_status_values: dict,
+):
+    for child, grandchildren in children:
+        child_dto = _make_lesson_attend_dto(child, attend_map, attend_status_values)
+        lesson_dto.children.append(child_dto)
+        lesson_dto.updated = lesson_dto.updated or child_dto.updated
+        _add_lesson_children(child_dto, grandchildren, attend_map, attend_status_values)
+
+
 def _get_lesson_tree_to_study_common(
     app: Flask,
     user_id: str,
     course_id: str,
     course_info: AICourse,
-    lessons: list,
     online_lessons: list,
+    lesson_tree: list,
     old_lessons: list,
     lesson_map: dict,
     attend_infos: list,
@@ -94,46 +126,20 @@ def _get_lesson_tree_to_study_common(
                 updated_attend = True
 
         attend_map = {i.lesson_id: i for i in attend_infos}
+        # lay the attend status of the user over the shared lesson tree
         lessonInfos = []
-        lesson_dict = {}
-        app.logger.info(
-            "online_lessons:{}".format([i.lesson_no for i in online_lessons])
-        )
-        # init the lesson info
-        for lesson in online_lessons:
-            if lesson_dict.get(lesson.lesson_no, None) is None:
-                attend_info = attend_map.get(lesson.lesson_id, None)
-                status = attend_info.status if attend_info else ATTEND_STATUS_LOCKED
-                lesson_dict[lesson.lesson_no] = AILessonAttendDTO(
-                    lesson.lesson_no,
-                    lesson.lesson_name,
-                    lesson.lesson_id,
-                    attend_status_values[status],
-                    status,
-                    lesson.lesson_type,
-                    [],
-                    unique_id=lesson.lesson_feishu_id,
-                    updated=(
-                        True
-                        if attend_info and attend_info.lesson_updated == 1
-                        else False
-                    ),
-                )
-        # init the lesson tree
-        for key in lesson_dict:
-            if len(lesson_dict[key].lesson_no) == 2:
-                lessonInfos.append(lesson_dict[key])
-            else:
-                parent_no = key[:-2]
-                if parent_no in lesson_dict:
-                    lesson_dict[parent_no].children.append(lesson_dict[key])
-                    lesson_dict[parent_no].updated = (
-                        lesson_dict[parent_no].updated or lesson_dict[key].updated
-                    )
-        for lesson in lessonInfos:
-            lesson.children = sorted(
-                lesson.children, key=lambda x: (len(x.lesson_no), x.lesson_no)
+        for lesson, children in lesson_tree:
+            lesson_dto = _make_lesson_attend_dto(
+                lesson, attend_map, attend_status_values
             )
+            lessonInfos.append(lesson_dto)
+            _add_lesson_children(lesson_dto, children, attend_map, attend_status_values)
+
+        old_lesson_index = {}
+        for old_lesson in old_lessons:
+            old_lesson_index.setdefault(
+                (old_lesson.lesson_feishu_id, len(old_lesson.lesson_no)), []
+            ).append(old_lesson)
 
         for lesson_index, lesson in enumerate(lessonInfos):
             attend_info = attend_map.get(lesson.lesson_id, None)
@@ -142,12 +148,9 @@ def _get_lesson_tree_to_study_common(
                 if lesson_info and lesson_info.lesson_type == LESSON_TYPE_NORMAL:
                     if not paid:
                         continue
-                old_lesson_infos = [
-                    i
-                    for i in old_lessons
-                    if i.lesson_feishu_id == lesson.unique_id
-                    and len(i.lesson_no) == len(lesson.lesson_no)
-                ]
+                old_lesson_infos = old_lesson_index.get(
+                    (lesson.unique_id, len(lesson.lesson_no)), []
+                )
                 if len(old_lesson_infos) > 0:
                     attend_info = attend_map.get(old_lesson_infos[0].lesson_id, None)
                     if attend_info:
@@ -170,12 +173,9 @@ def _get_lesson_tree_to_study_common(
                 if attend_info:
                     continue
                 is_updated_old_to_now = False
-                old_lesson_infos = [
-                    i
-                    for i in old_lessons
-                    if i.lesson_feishu_id == child.unique_id
-                    and len(i.lesson_no) == len(child.lesson_no)
-                ]
+                old_lesson_infos = old_lesson_index.get(
+                    (child.unique_id, len(child.lesson_no)), []
+                )
                 app.logger.info(
                     "old_lessons:{}".format([i.lesson_no for i in old_lesson_infos])
                 )
@@ -308,17 +308,17 @@ def get_preview_mode_lesson_tree_to_study_inner(
                 AILesson.status.in_(ai_course_status),
             ).all()
 
+        # a published lesson is hidden by its draft
+        draft_lesson_ids = {
+            lesson.lesson_id for lesson in lessons if lesson.status == STATUS_DRAFT
+        }
         lessons = [
             lesson
             for lesson in lessons
             if lesson.status == STATUS_DRAFT
             or (
                 lesson.status == STATUS_PUBLISH
-                and not any(
-                    lesson_item.lesson_id == lesson.lesson_id
-                    and lesson_item.status == STATUS_DRAFT
-                    for lesson_item in lessons
-                )
+                and lesson.lesson_id not in draft_lesson_ids
             )
         ]
 
@@ -351,8 +351,8 @@ def get_preview_mode_lesson_tree_to_study_inner(
             user_id,
             course_id,
             course_info,
-            lessons,
             online_lessons,
+            build_lesson_tree(online_lessons),
             old_lessons,
             lesson_map,
             attend_infos,
@@ -372,14 +372,8 @@ def get_lesson_tree_to_study_inner(
         app.logger.info("user_id:" + user_id)
         attend_status_values = get_attend_status_values()
         if course_id:
-            course_info = (
-                AICourse.query.filter(
-                    AICourse.course_id == course_id,
-                    AICourse.status.in_([STATUS_PUBLISH]),
-                )
-                .order_by(AICourse.id.desc())
-                .first()
-            )
+            graph = get_course_graph(app, course_id)
+            course_info = graph.course
             if not course_info:
                 raise_error("LESSON.COURSE_NOT_FOUND")
         else:
@@ -387,6 +381,7 @@ def get_lesson_tree_to_study_inner(
             if not course_info:
                 raise_error("LESSON.HAS_NOT_LESSON")
             course_id = course_info.course_id
+            graph = get_course_graph(app, course_id)
         buy_record = AICourseBuyRecord.query.filter_by(
             user_id=user_id, course_id=course_id
         ).first()
@@ -394,24 +389,9 @@ def get_lesson_tree_to_study_inner(
         if buy_record:
             paid = buy_record.status == BUY_STATUS_SUCCESS
 
-        lessons = (
-            AILesson.query.filter(
-                AILesson.course_id == course_id,
-                AILesson.lesson_type != LESSON_TYPE_BRANCH_HIDDEN,
-                AILesson.status == STATUS_PUBLISH,
-            )
-            .order_by(AILesson.id.desc())
-            .all()
-        )
-
-        online_lessons = [i for i in lessons if i.status == STATUS_PUBLISH]
-        online_lessons = sorted(
-            online_lessons, key=lambda x: (len(x.lesson_no), x.lesson_no)
-        )
-        old_lessons = [i for i in lessons if i.status != STATUS_PUBLISH]
-        old_lessons = sorted(old_lessons, key=lambda x: x.id, reverse=True)
-
-        lesson_map = {i.lesson_id: i for i in online_lessons}
+        # the published lessons and their tree come from the course graph,
+        # built once per publish and shared by all the users
+        online_lessons = graph.study_lessons
 
         attend_infos = AICourseLessonAttend.query.filter(
             AICourseLessonAttend.user_id == user_id,
@@ -425,10 +405,10 @@ def get_lesson_tree_to_study_inner(
             user_id,
             course_id,
             course_info,
-            lessons,
             online_lessons,
-            old_lessons,
-            lesson_map,
+            graph.study_tree,
+            [],
+            graph.study_lesson_map,
             attend_infos,
             updated_attend,
             attend_status_values,
@@ -449,9 +429,58 @@ def get_lesson_tree_to_study(
     )
 
 
+# the columns of a study record item, the other columns of the log are not read
+_STUDY_RECORD_COLUMNS = (
+    AICourseLessonAttendScript.id,
+    AICourseLessonAttendScript.script_index,
+    AICourseLessonAttendScript.script_role,
+    AICourseLessonAttendScript.script_content,
+    AICourseLessonAttendScript.script_id,
+    AICourseLessonAttendScript.lesson_id,
+    AICourseLessonAttendScript.log_id,
+    AICourseLessonAttendScript.interaction_type,
+    AICourseLessonAttendScript.script_ui_conf,
+)
+
+
+# load the study logs of the attends, the whole history or a page of it:
+# the latest `limit` logs, or the `limit` logs older than the `before` log
+# returns the logs in time order and if there are older ones
+def _load_study_logs(
+    app: Flask, attend_ids: list, limit: int = None, before: str = None
+) -> tuple[list, bool]:
+    query = db.session.query(*_STUDY_RECORD_COLUMNS).filter(
+        AICourseLessonAttendScript.attend_id.in_(attend_ids)
+    )
+    if limit is None and before is None:
+        return query.order_by(AICourseLessonAttendScript.id.asc()).all(), False
+    if before:
+        before_id = (
+            db.session.query(AICourseLessonAttendScript.id)
+            .filter(
+                AICourseLessonAttendScript.attend_id.in_(attend_ids),
+                AICourseLessonAttendScript.log_id == before,
+            )
+            .scalar()
+        )
+        if before_id is None:
+            return [], False
+        query = query.filter(AICourseLessonAttendScript.id < before_id)
+    query = query.order_by(AICourseLessonAttendScript.id.desc())
+    if limit is None:
+        return query.all()[::-1], False
+    logs = query.limit(limit + 1).all()
+    return logs[:limit][::-1], len(logs) > limit
+
+
 @extensible
 def get_study_record(
-    app: Flask, user_id: str, lesson_id: str, preview_mode: bool = False
+    app: Flask,
+    user_id: str,
+    lesson_id: str,
+    preview_mode: bool = False,
+    limit: int = None,
+    before: str = None,
 ) -> StudyRecordDTO:
     with app.app_context():
         ai_course_status = [STATUS_PUBLISH]
@@ -466,13 +495,13 @@ def get_study_record(
             .order_by(AILesson.id.desc())
             .first()
         )
+        if not lesson_info:
+            return None
         course_info = AICourse.query.filter_by(course_id=lesson_info.course_id).first()
         if not course_info:
             return None
         teach_avator = course_info.course_teacher_avator
         lesson_ids = [lesson_id]
-        if not lesson_info:
-            return None
         if len(lesson_info.lesson_no) <= 2:
             lesson_infos = (
                 AILesson.query.filter(
@@ -497,15 +526,10 @@ def get_study_record(
         if not attend_infos:
             return None
         attend_ids = [attend_info.attend_id for attend_info in attend_infos]
-        attend_scripts = (
-            AICourseLessonAttendScript.query.filter(
-                AICourseLessonAttendScript.attend_id.in_(attend_ids)
-            )
-            .order_by(AICourseLessonAttendScript.id.asc())
-            .all()
-        )
+        attend_scripts, has_more = _load_study_logs(app, attend_ids, limit, before)
         if len(attend_scripts) == 0:
             return StudyRecordDTO([])
+        lesson_id_set = set(lesson_ids)
         items = [
             StudyRecordItemDTO(
                 i.script_index,
@@ -513,15 +537,21 @@ def get_study_record(
                 0,
                 i.script_content,
                 i.script_id,
-                i.lesson_id if i.lesson_id in lesson_ids else lesson_id,
+                i.lesson_id if i.lesson_id in lesson_id_set else lesson_id,
                 i.log_id,
                 i.interaction_type,
                 ui=json.loads(i.script_ui_conf) if i.script_ui_conf else None,
             )
             for i in attend_scripts
         ]
-        user_info = User.query.filter_by(user_id=user_id).first()
         ret = StudyRecordDTO(items, teach_avator=teach_avator)
+        ret.has_more = has_more
+        if has_more:
+            ret.next_cursor = attend_scripts[0].log_id
+        if before:
+            # an older page, the ui belongs to the latest one
+            return ret
+        user_info = User.query.filter_by(user_id=user_id).first()
         last_script_id = attend_scripts[-1].script_id
         last_script = (
             AILessonScript.query.filter(
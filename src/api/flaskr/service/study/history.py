@@ -0,0 +1,147 @@
+import json
+import math
+import re
+
+from flask import Flask
+
+from ...common.config import get_config
+from ...dao import db
+from ...dao import redis_client as redis
+from .const import ROLE_STUDENT, ROLE_TEACHER
+from .models import AICourseLessonAttendScript
+
+_ROLE_NAMES = {ROLE_STUDENT: "学员", ROLE_TEACHER: "老师"}
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+# characters of a turn kept in the summary of the older turns
+SUMMARY_LINE_CHARS = 60
+# older turns folded into the summary by one ask
+SUMMARY_FOLD_LIMIT = 200
+SUMMARY_TTL = 24 * 3600
+
+
+# rough token count without a tokenizer: a cjk character is about one token,
+# other text about four characters per token
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def get_history_count(history_count: int) -> int:
+    if history_count and history_count > 0:
+        return history_count
+    return int(get_config("ASK_HISTORY_DEFAULT_COUNT", "10"))
+
+
+# ASK_HISTORY_MODEL_TOKEN_BUDGETS: model=tokens pairs split by commas
+def get_history_token_budget(model: str) -> int:
+    budgets = get_config("ASK_HISTORY_MODEL_TOKEN_BUDGETS", "")
+    for item in budgets.split(","):
+        name, _, tokens = item.partition("=")
+        if model and name.strip() == model and tokens.strip():
+            return int(tokens)
+    return int(get_config("ASK_HISTORY_TOKEN_BUDGET", "4000"))
+
+
+def _format_line(role: int, content: str) -> str:
+    return f"{_ROLE_NAMES[role]}: {content}\n"
+
+
+def _query_turns(attend_id: str):
+    return db.session.query(
+        AICourseLessonAttendScript.id,
+        AICourseLessonAttendScript.script_role,
+        AICourseLessonAttendScript.script_content,
+    ).filter(
+        AICourseLessonAttendScript.attend_id == attend_id,
+        AICourseLessonAttendScript.script_role.in_(list(_ROLE_NAMES.keys())),
+    )
+
+
+def _get_summary_key(attend_id: str) -> str:
+    return get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "ask_history:" + attend_id
+
+
+def _fit_lines(lines: list, budget: int) -> list:
+    tokens = 0
+    kept = []
+    for line in reversed(lines):
+        tokens = tokens + count_tokens(line)
+        if tokens > budget:
+            break
+        kept.append(line)
+    kept.reverse()
+    return kept
+
+
+# the turns before the window, clipped and folded into a summary kept in redis
+# each ask only reads the turns that left the window since the last one
+def _get_summary(app: Flask, attend_id: str, before_id: int, budget: int) -> str:
+    key = _get_summary_key(attend_id)
+    summary = {"id": 0, "lines": []}
+    try:
+        cached = redis.get(key)
+        if cached:
+            summary = json.loads(cached)
+    except Exception as e:
+        app.logger.warning(f"load ask history summary error: {e}")
+    if summary["id"] >= before_id - 1:
+        return "".join(summary["lines"])
+    rows = (
+        _query_turns(attend_id)
+        .filter(
+            AICourseLessonAttendScript.id > summary["id"],
+            AICourseLessonAttendScript.id < before_id,
+        )
+        .order_by(AICourseLessonAttendScript.id.desc())
+        .limit(SUMMARY_FOLD_LIMIT)
+        .all()
+    )
+    if rows:
+        rows.reverse()
+        lines = summary["lines"] + [
+            _format_line(
+                row.script_role, (row.script_content or "")[:SUMMARY_LINE_CHARS]
+            )
+            for row in rows
+        ]
+        summary = {"id": rows[-1].id, "lines": _fit_lines(lines, budget)}
+        try:
+            redis.set(key, json.dumps(summary, ensure_ascii=False), ex=SUMMARY_TTL)
+        except Exception as e:
+            app.logger.warning(f"save ask history summary error: {e}")
+    return "".join(summary["lines"])
+
+
+# the history of an attend for a follow up ask: the last turns by an indexed
+# limit query, trimmed from the oldest one to the token budget of the model,
+# and a summary of the older turns when ASK_HISTORY_SUMMARY_TOKENS is set
+def build_ask_history(
+    app: Flask, attend_id: str, history_count: int, model: str
+) -> str:
+    count = get_history_count(history_count)
+    rows = (
+        _query_turns(attend_id)
+        .order_by(AICourseLessonAttendScript.id.desc())
+        .limit(count)
+        .all()
+    )
+    rows.reverse()
+    budget = get_history_token_budget(model)
+    lines = _fit_lines(
+        [_format_line(row.script_role, row.script_content) for row in rows], budget
+    )
+    history = "".join(lines)
+    summary_budget = int(get_config("ASK_HISTORY_SUMMARY_TOKENS", "0"))
+    if summary_budget > 0 and rows:
+        # the turns dropped by the budget are summarized too
+        first_id = rows[len(rows) - len(lines)].id if lines else rows[-1].id + 1
+        summary = _get_summary(app, attend_id, first_id, summary_budget)
+        if summary:
+            history = "更早的会话摘要:\n" + summary + "最近的会话:\n" + history
+    app.logger.info(
+        f"ask history: turns:{len(lines)}/{len(rows)} tokens:{count_tokens(history)}"
+    )
+    return history
@@ -1,9 +1,8 @@
-import time
 from trace import Trace
 from flask import Flask
 from flaskr.api.llm import chat_llm
 from flaskr.service.study.const import INPUT_TYPE_ASK, ROLE_STUDENT, ROLE_TEACHER
-from flaskr.service.study.models import AICourseLessonAttendScript
+from flaskr.service.study.history import build_ask_history
 from flaskr.service.lesson.models import AILessonScript, AILesson
 from flaskr.service.order.models import AICourseLessonAttend
 from flaskr.service.study.plugin import register_input_handler
@@ -15,15 +14,17 @@ from flaskr.service.study.utils import (
     get_fmt_prompt,
 )
 from flaskr.dao import db
+from flaskr.common.metrics import measure_stage
 from flaskr.service.study.input_funcs import (
     BreakException,
     check_text_with_llm_response,
     generation_attend,
+    start_speculative_llm,
 )
 from flaskr.service.user.models import User
 from flaskr.service.rag.funs import (
     get_kb_list,
-    retrieval_fun,
+    retrieval_kbs,
 )
 from flaskr.service.lesson.const import UI_TYPE_ASK
 
@@ -43,52 +44,44 @@ def handle_input_ask(
 
     follow_up_info = get_follow_up_info(app, script_info)
     app.logger.info("follow_up_info:{}".format(follow_up_info.__json__()))
-    history_scripts = (
-        AICourseLessonAttendScript.query.filter(
-            AICourseLessonAttendScript.attend_id == attend.attend_id,
-        )
-        .order_by(AICourseLessonAttendScript.id.asc())
-        .all()
+    history = build_ask_history(
+        app,
+        attend.attend_id,
+        follow_up_info.ask_history_count,
+        follow_up_info.ask_model,
     )
 
     messages = []
     input = input.replace("{", "{{").replace("}", "}}")
-    system_prompt = get_lesson_system(app, script_info.lesson_id)
+    system_prompt = get_lesson_system(app, script_info.lesson_id, script_info)
     system_message = system_prompt if system_prompt else ""
     # format the system message
     system_message = get_fmt_prompt(
         app, user_info.user_id, attend.course_id, system_message
     )
-    system_message = system_message if system_message else "" + "\n 之前的会话历史为:\n"
-    for script in history_scripts:
-        if script.script_role == ROLE_STUDENT:
-            system_message = system_message + f"学员: {script.script_content}\n"
-        elif script.script_role == ROLE_TEACHER:
-            system_message = system_message + f"老师: {script.script_content}\n"
+    system_message = (
+        (system_message if system_message else "") + "\n 之前的会话历史为:\n" + history
+    )
 
     messages.append({"role": "system", "content": system_message})
 
-    time_1 = time.time()
-    retrieval_result_list = []
     course_id = lesson.course_id
     my_filter = ""
     limit = 3
     output_fields = ["text"]
     kb_list = get_kb_list(app, [], [course_id])
-    for kb in kb_list:
-        retrieval_result = retrieval_fun(
-            kb_id=kb["kb_id"],
-            query=input,
-            my_filter=my_filter,
-            limit=limit,
-            output_fields=output_fields,
-        )
-        retrieval_result_list.append(retrieval_result)
-        # break
-    all_retrieval_result = "\n\n".join(retrieval_result_list)
-    time_2 = time.time()
-    app.logger.info(f"all retrieval_fun takes: {time_2 - time_1}s")
-    app.logger.info(f"all_retrieval_result: {all_retrieval_result}")
+    all_retrieval_result = ""
+    if kb_list:
+        with measure_stage("rag"):
+            retrieval_result = retrieval_kbs(
+                kb_id_list=[kb["kb_id"] for kb in kb_list],
+                query=input,
+                my_filter=my_filter,
+                limit=limit,
+                output_fields=output_fields,
+            )
+        all_retrieval_result = retrieval_result.text
+    app.logger.debug("all_retrieval_result: %s", all_retrieval_result)
 
     messages.append(
         {
@@ -103,7 +96,7 @@ def handle_input_ask(
         }
     )
 
-    app.logger.info(f"messages: {messages}")
+    app.logger.debug("messages: %s", messages)
 
     # get follow up model
     follow_up_model = follow_up_info.ask_model
@@ -114,8 +107,36 @@ def handle_input_ask(
     log_script.script_ui_type = UI_TYPE_ASK
     db.session.add(log_script)
     span = trace.span(name="user_follow_up", input=input)
+
+    def make_stream():
+        return chat_llm(
+            app,
+            user_info.user_id,
+            span,
+            model=follow_up_model,
+            json=True,
+            stream=True,
+            temperature=script_info.script_temprature,
+            generation_name="user_follow_ask_"
+            + lesson.lesson_no
+            + "_"
+            + str(script_info.script_index)
+            + "_"
+            + script_info.script_name,
+            messages=messages,
+        )
+
+    speculative = start_speculative_llm(app, span, make_stream)
     res = check_text_with_llm_response(
-        app, user_info.user_id, log_script, input, span, lesson, script_info, attend
+        app,
+        user_info.user_id,
+        log_script,
+        input,
+        span,
+        lesson,
+        script_info,
+        attend,
+        speculative,
     )
     try:
         first_value = next(res)
@@ -126,22 +147,7 @@ def handle_input_ask(
         raise BreakException
     except StopIteration:
         app.logger.info("check_text_by_edun is None ,invoke_llm")
-    resp = chat_llm(
-        app,
-        user_info.user_id,
-        span,
-        model=follow_up_model,
-        json=True,
-        stream=True,
-        temperature=script_info.script_temprature,
-        generation_name="user_follow_ask_"
-        + lesson.lesson_no
-        + "_"
-        + str(script_info.script_index)
-        + "_"
-        + script_info.script_name,
-        messages=messages,
-    )
+    resp = speculative if speculative is not None else make_stream()
     response_text = ""
     for i in resp:
         current_content = i.result
@@ -156,8 +162,7 @@ def handle_input_ask(
     log_script.script_ui_type = UI_TYPE_ASK
     db.session.add(log_script)
     span.end(output=response_text)
-    trace_args["output"] = trace_args["output"] + "\r\n" + response_text
-    trace.update(**trace_args)
+    trace.append_output("\r\n" + response_text)
     db.session.flush()
     yield make_script_dto(
         "text_end", "", script_info.script_id, script_info.lesson_id, log_script.log_id
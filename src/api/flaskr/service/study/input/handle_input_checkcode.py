@@ -1,4 +1,3 @@
-import time
 from trace import Trace
 from flask import Flask
 from flaskr.service.common.models import AppException
@@ -7,7 +6,11 @@ from flaskr.service.order.models import AICourseLessonAttend
 from flaskr.service.study.const import INPUT_TYPE_CHECKCODE, ROLE_TEACHER
 from flaskr.service.study.input_funcs import BreakException
 from flaskr.service.study.plugin import register_input_handler
-from flaskr.service.study.utils import generation_attend, make_script_dto
+from flaskr.service.study.utils import (
+    generation_attend,
+    make_script_dto,
+    make_script_dto_chunks,
+)
 from flaskr.service.user.common import verify_sms_code_without_phone
 from flaskr.service.study.const import ROLE_STUDENT
 from flaskr.dao import db
@@ -52,11 +55,9 @@ def handle_input_checkcode(
         span = trace.span(name="user_input_phone", input=input)
         span.end()
     except AppException as e:
-        for i in e.message:
-            yield make_script_dto(
-                "text", i, script_info.script_id, script_info.lesson_id
-            )
-            time.sleep(0.01)
+        yield from make_script_dto_chunks(
+            app, "text", e.message, script_info.script_id, script_info.lesson_id
+        )
         yield make_script_dto(
             "text_end", "", script_info.script_id, script_info.lesson_id
         )
@@ -1,4 +1,3 @@
-import time
 from trace import Trace
 from flask import Flask
 from flaskr.service.lesson.models import AILessonScript, AILesson
@@ -10,6 +9,7 @@ from flaskr.service.study.utils import (
     check_phone_number,
     generation_attend,
     make_script_dto,
+    make_script_dto_chunks,
 )
 from flaskr.dao import db
 from flaskr.framework.plugin.plugin_manager import extensible_generic
@@ -35,11 +35,9 @@ def handle_input_phone(
     span = trace.span(name="user_input_phone", input=input)
     response_text = "请输入正确的手机号"
     if not check_phone_number(app, user_info.user_id, input):
-        for i in response_text:
-            yield make_script_dto(
-                "text", i, script_info.script_id, script_info.lesson_id
-            )
-            time.sleep(0.01)
+        yield from make_script_dto_chunks(
+            app, "text", response_text, script_info.script_id, script_info.lesson_id
+        )
         yield make_script_dto(
             "text_end", "", script_info.script_id, script_info.lesson_id
         )
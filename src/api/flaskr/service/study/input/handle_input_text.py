@@ -6,6 +6,7 @@ from flaskr.service.profile.funcs import save_user_profiles
 from flaskr.service.study.input_funcs import (
     BreakException,
     check_text_with_llm_response,
+    start_speculative_llm,
 )
 from flaskr.service.lesson.models import AILessonScript, AILesson
 from flaskr.service.order.models import AICourseLessonAttend
@@ -16,6 +17,7 @@ from flaskr.service.study.utils import (
     generation_attend,
     get_fmt_prompt,
     make_script_dto,
+    make_script_dto_chunks,
     get_model_setting,
 )
 from flaskr.dao import db
@@ -58,8 +60,36 @@ def handle_input_text(
     )
     db.session.add(log_script)
     span = trace.span(name="user_input", input=input)
+
+    def make_stream():
+        return invoke_llm(
+            app,
+            user_info.user_id,
+            span,
+            model=model_setting.model_name,
+            json=True,
+            stream=True,
+            message=prompt,
+            generation_name="user_input_"
+            + lesson.lesson_no
+            + "_"
+            + str(script_info.script_index)
+            + "_"
+            + script_info.script_name,
+            **model_setting.model_args,
+        )
+
+    speculative = start_speculative_llm(app, span, make_stream)
     res = check_text_with_llm_response(
-        app, user_info.user_id, log_script, input, span, lesson, script_info, attend
+        app,
+        user_info.user_id,
+        log_script,
+        input,
+        span,
+        lesson,
+        script_info,
+        attend,
+        speculative,
     )
     try:
         first_value = next(res)
@@ -71,22 +101,7 @@ def handle_input_text(
     except StopIteration:
         app.logger.info("check_text_by_edun is None ,invoke_llm")
 
-    resp = invoke_llm(
-        app,
-        user_info.user_id,
-        span,
-        model=model_setting.model_name,
-        json=True,
-        stream=True,
-        message=prompt,
-        generation_name="user_input_"
-        + lesson.lesson_no
-        + "_"
-        + str(script_info.script_index)
-        + "_"
-        + script_info.script_name,
-        **model_setting.model_args,
-    )
+    resp = speculative if speculative is not None else make_stream()
     response_text = ""
     check_success = False
     for i in resp:
@@ -112,18 +127,15 @@ def handle_input_text(
 
     else:
         reason = jsonObj.get("reason", response_text)
-        for text in reason:
-            yield make_script_dto(
-                "text", text, script_info.script_id, script_info.lesson_id
-            )
-            time.sleep(0.01)
+        yield from make_script_dto_chunks(
+            app, "text", reason, script_info.script_id, script_info.lesson_id
+        )
         log_script = generation_attend(app, attend, script_info)
         log_script.script_content = reason
         log_script.script_role = ROLE_TEACHER
         db.session.add(log_script)
         span.end(output=response_text)
-        trace_args["output"] = trace_args["output"] + "\r\n" + response_text
-        trace.update(**trace_args)
+        trace.append_output("\r\n" + response_text)
         db.session.flush()
         yield make_script_dto(
             "text_end",
@@ -1,4 +1,7 @@
+import queue
+import threading
 import time
+from typing import Callable
 
 from flask import Flask
 
@@ -16,6 +19,8 @@ from flaskr.service.order.models import AICourseLessonAttend
 from flaskr.service.study.const import (
     ROLE_TEACHER,
 )
+from flaskr.common.config import get_config
+from flaskr.common.metrics import get_study_step, set_study_step
 from flaskr.dao import db
 from flaskr.service.study.utils import make_script_dto
 
@@ -24,6 +29,102 @@ class BreakException(Exception):
     pass
 
 
+_STREAM_END = object()
+
+
+# the llm request of an input, started together with its content check
+# a background thread buffers the chunks until the check returns, then they
+# are streamed, or the request is dropped when the text is rejected
+class SpeculativeLLMStream:
+    def __init__(self, app: Flask, span, make_stream: Callable):
+        self.app = app
+        self.span = span
+        self.start = time.perf_counter()
+        self.check_ms = None
+        self.first_chunk_ms = None
+        self.chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(
+            target=self._produce,
+            args=(make_stream, get_study_step()),
+            name="speculative-llm",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def _produce(self, make_stream: Callable, step):
+        set_study_step(step)
+        with self.app.app_context():
+            stream = None
+            try:
+                stream = make_stream()
+                for chunk in stream:
+                    if self.first_chunk_ms is None:
+                        self.first_chunk_ms = (time.perf_counter() - self.start) * 1000
+                    if self.cancelled.is_set():
+                        break
+                    self.chunks.put(chunk)
+            except Exception as e:
+                self.chunks.put(e)
+            finally:
+                # closing the generator closes the upstream response
+                if stream is not None:
+                    stream.close()
+                self.chunks.put(_STREAM_END)
+
+    def checked(self, passed: bool):
+        self.check_ms = (time.perf_counter() - self.start) * 1000
+        if not passed:
+            self.cancelled.set()
+            self.app.logger.info(
+                f"speculative llm cancelled: check_ms:{self.check_ms:.0f}"
+            )
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _report(self):
+        wait_ms = (time.perf_counter() - self.start) * 1000
+        check_ms = self.check_ms or 0
+        ttft_ms = self.first_chunk_ms or wait_ms
+        # the sequential path waits for the check, then for the first chunk
+        metrics = {
+            "check_ms": round(check_ms),
+            "ttft_ms": round(ttft_ms),
+            "wait_ms": round(wait_ms),
+            "saved_ms": round(max(check_ms + ttft_ms - wait_ms, 0)),
+        }
+        self.app.logger.info(f"speculative llm: {metrics}")
+        self.span.event(name="speculative_llm", output=metrics)
+
+    def __iter__(self):
+        reported = False
+        try:
+            while True:
+                item = self.chunks.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if not reported:
+                    self._report()
+                    reported = True
+                yield item
+        finally:
+            # a consumer that stops early stops the request too
+            self.cancelled.set()
+
+
+# CHECK_TEXT_SPECULATIVE starts the llm request before the content check returns
+# the tokens of a rejected text are paid for but never shown
+def start_speculative_llm(
+    app: Flask, span, make_stream: Callable
+) -> SpeculativeLLMStream:
+    if str(get_config("CHECK_TEXT_SPECULATIVE", "false")).lower() != "true":
+        return None
+    return SpeculativeLLMStream(app, span, make_stream)
+
+
 def check_text_with_llm_response(
     app: Flask,
     user_id: str,
@@ -33,9 +134,17 @@ def check_text_with_llm_response(
     lesson: AILesson,
     script_info: AILessonScript,
     attend: AICourseLessonAttend,
+    speculative: SpeculativeLLMStream = None,
 ):
-    res = check_text(app, log_script.log_id, input, user_id)
+    try:
+        res = check_text(app, log_script.log_id, input, user_id)
+    except Exception:
+        if speculative is not None:
+            speculative.cancel()
+        raise
     span.event(name="check_text", input=input, output=res)
+    if speculative is not None:
+        speculative.checked(res.check_result != CHECK_RESULT_REJECT)
     add_risk_control_result(
         app,
         log_script.log_id,
@@ -1,4 +1,3 @@
-import time
 from trace import Trace
 from flask import Flask
 
@@ -19,7 +18,7 @@ from ...service.lesson.models import AILessonScript, AILesson
 from ...service.order.models import AICourseLessonAttend
 from ...service.study.const import ROLE_TEACHER
 from ...dao import db
-from .utils import make_script_dto, get_lesson_system
+from .utils import make_script_dto, make_script_dto_chunks, get_lesson_system
 from flaskr.framework import extensible_generic
 
 
@@ -48,20 +47,16 @@ def generate_fix_output(
         )
         if not prompt:
             prompt = ""
-        for i in prompt:
-            msg = make_script_dto(
-                "text", i, script_info.script_id, script_info.lesson_id
-            )
-            yield msg
-            time.sleep(0.01)
+        yield from make_script_dto_chunks(
+            app, "text", prompt, script_info.script_id, script_info.lesson_id
+        )
     log_script = generation_attend(app, attend, script_info)
     log_script.script_content = prompt
     log_script.script_role = ROLE_TEACHER
     db.session.add(log_script)
     span = trace.span(name="fix_script")
     span.end(output=prompt)
-    trace_args["output"] = trace_args["output"] + "\r\n" + prompt
-    trace.update(**trace_args)
+    trace.append_output("\r\n" + prompt)
     yield make_script_dto(
         "text_end", "", script_info.script_id, script_info.lesson_id, log_script.log_id
     )
@@ -77,7 +72,7 @@ def generate_prompt_output(
     trace_args,
 ):
     span = trace.span(name="prompt_sript")
-    system = get_lesson_system(app, script_info.lesson_id)
+    system = get_lesson_system(app, script_info.lesson_id, script_info)
     system_prompt = (
         None
         if system is None or system == ""
@@ -114,8 +109,7 @@ def generate_prompt_output(
             yield make_script_dto(
                 "text", current_content, script_info.script_id, script_info.lesson_id
             )
-    trace_args["output"] = trace_args["output"] + "\r\n" + response_text
-    trace.update(**trace_args)
+    trace.append_output("\r\n" + response_text)
     log_script = generation_attend(app, attend, script_info)
     log_script.script_content = response_text
     log_script.script_role = ROLE_TEACHER
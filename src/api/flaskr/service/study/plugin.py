@@ -140,7 +140,6 @@ def handle_ui(
     trace_args,
 ):
     app.logger.info(f"handle_ui {script_info.script_ui_type}")
-    app.logger.info(UI_HANDLE_MAP.keys())
     if script_info.script_ui_type in UI_HANDLE_MAP:
         app.logger.info(
             "generation ui lesson_id:{}  script type:{},user_id:{},script_index:{}".format(
@@ -1,3 +1,4 @@
+import time
 import traceback
 from typing import Generator
 from flask import Flask
@@ -5,13 +6,16 @@ from flask import Flask
 from flaskr.service.common.models import AppException, raise_error
 from flaskr.service.user.models import User
 from flaskr.i18n import _
-from ...api.langfuse import langfuse_client as langfuse
+from ...api.langfuse import start_trace
+from ...common.metrics import get_study_step, study_step
+from ...dao.profiler import get_sql_profile
 from ...service.lesson.const import (
     LESSON_TYPE_TRIAL,
     STATUS_PUBLISH,
     STATUS_DRAFT,
 )
 from ...service.lesson.models import AICourse, AILesson
+from ...service.lesson.graph import get_course_graph_by_lesson
 from ...service.order.consts import (
     ATTEND_STATUS_BRANCH,
     ATTEND_STATUS_COMPLETED,
@@ -33,6 +37,7 @@ from ...service.study.const import (
     INPUT_TYPE_ASK,
     INPUT_TYPE_START,
     INPUT_TYPE_CONTINUE,
+    STREAM_MODE_INSTANT,
 )
 from ...service.study.dtos import ScriptDTO
 from ...dao import db, redis_client
@@ -43,6 +48,7 @@ from .utils import (
     get_current_lesson,
     check_script_is_last_script,
     get_script_by_id,
+    set_stream_mode,
 )
 from .input_funcs import BreakException
 from .output_funcs import handle_output
@@ -100,7 +106,7 @@ def handle_preview_script(
     trace_args["session_id"] = attend.attend_id
     trace_args["input"] = input
     trace_args["name"] = course_info.course_name
-    trace = langfuse.trace(**trace_args)
+    trace = start_trace(course_id=course_id, **trace_args)
     trace_args["output"] = ""
 
     user_info = User.query.filter(User.user_id == user_id).first()
@@ -145,6 +151,7 @@ def handle_preview_script(
         trace_args,
     ):
         app.logger.info(f"check_continue: {script_info}")
+        trace.flush()
         return
 
     # Handle UI
@@ -179,6 +186,7 @@ def handle_preview_script(
                         )
                 elif isinstance(attend_update, ScriptDTO):
                     yield make_script_dto_to_stream(attend_update)
+    trace.flush()
 
 
 def run_script_inner(
@@ -192,6 +200,7 @@ def run_script_inner(
     log_id: str = None,
     preview_mode: bool = False,
     preview_script_id: str = None,
+    stream_mode: str = None,
 ) -> Generator[str, None, None]:
     """
     Core function for running course scripts
@@ -200,8 +209,12 @@ def run_script_inner(
         ai_course_status = [STATUS_PUBLISH]
         if preview_mode:
             ai_course_status = [STATUS_DRAFT, STATUS_PUBLISH]
+            # render the fixed text of previews instantly by default
+            stream_mode = stream_mode or STREAM_MODE_INSTANT
+        set_stream_mode(stream_mode)
 
         script_info = None
+        trace = None
         try:
             attend_status_values = get_attend_status_values()
             user_info = User.query.filter(User.user_id == user_id).first()
@@ -262,10 +275,9 @@ def run_script_inner(
                         AILesson.status.in_(ai_course_status),
                     ).first()
                 else:
-                    lesson_info = AILesson.query.filter(
-                        AILesson.lesson_id == lesson_id,
-                        AILesson.status.in_(ai_course_status),
-                    ).first()
+                    graph = get_course_graph_by_lesson(app, lesson_id)
+                    if graph is not None:
+                        lesson_info = graph.get_lesson(lesson_id)
                 if not lesson_info:
                     raise_error("LESSON.LESSON_NOT_FOUND_IN_COURSE")
                 course_id = lesson_info.course_id
@@ -276,14 +288,17 @@ def run_script_inner(
                 )
                 if not lesson_info:
                     raise_error("LESSON.LESSON_NOT_FOUND_IN_COURSE")
-                course_info = (
-                    AICourse.query.filter(
-                        AICourse.course_id == course_id,
-                        AICourse.status.in_(ai_course_status),
+                if preview_mode:
+                    course_info = (
+                        AICourse.query.filter(
+                            AICourse.course_id == course_id,
+                            AICourse.status.in_(ai_course_status),
+                        )
+                        .order_by(AICourse.id.desc())
+                        .first()
                     )
-                    .order_by(AICourse.id.desc())
-                    .first()
-                )
+                else:
+                    course_info = graph.course
                 if not course_info:
                     raise_error("LESSON.COURSE_NOT_FOUND")
                 # return the teacher avator
@@ -322,11 +337,14 @@ def run_script_inner(
                     parent_no = lesson_info.lesson_no
                     if len(parent_no) >= 2:
                         parent_no = parent_no[:-2]
-                    lessons = AILesson.query.filter(
-                        AILesson.lesson_no.like(parent_no + "__"),
-                        AILesson.course_id == course_id,
-                        AILesson.status.in_(ai_course_status),
-                    ).all()
+                    if preview_mode:
+                        lessons = AILesson.query.filter(
+                            AILesson.lesson_no.like(parent_no + "__"),
+                            AILesson.course_id == course_id,
+                            AILesson.status.in_(ai_course_status),
+                        ).all()
+                    else:
+                        lessons = graph.get_children(parent_no)
                     app.logger.info(
                         "study lesson no :{}".format(
                             ",".join([lesson.lesson_no for lesson in lessons])
@@ -377,8 +395,11 @@ def run_script_inner(
             trace_args["session_id"] = attend.attend_id
             trace_args["input"] = input
             trace_args["name"] = course_info.course_name
-            trace = langfuse.trace(**trace_args)
+            trace = start_trace(course_id=course_id, **trace_args)
             trace_args["output"] = ""
+            step = get_study_step()
+            if step is not None:
+                step.course_id = course_id
             next = 0
             is_first_add = False
             # get the script info and the attend updates
@@ -608,6 +629,10 @@ def run_script_inner(
         except GeneratorExit:
             db.session.rollback()
             app.logger.info("GeneratorExit")
+        finally:
+            # the trace of the step is updated once, with all its output
+            if trace is not None:
+                trace.flush()
 
 
 def run_script(
@@ -620,6 +645,7 @@ def run_script(
     script_id: str = None,
     log_id: str = None,
     preview_mode: bool = False,
+    stream_mode: str = None,
 ) -> Generator[ScriptDTO, None, None]:
     timeout = 5 * 60
     blocking_timeout = 1
@@ -628,18 +654,32 @@ def run_script(
         lock_key, timeout=timeout, blocking_timeout=blocking_timeout
     )
     if lock.acquire(blocking=True):
+        profile = get_sql_profile()
+        db_start = profile.total_ms if profile is not None else 0.0
         try:
-            yield from run_script_inner(
-                app,
-                user_id,
-                course_id,
-                lesson_id,
-                input,
-                input_type,
-                script_id,
-                log_id,
-                preview_mode,
-            )
+            with study_step(course_id) as step:
+                stream = run_script_inner(
+                    app,
+                    user_id,
+                    course_id,
+                    lesson_id,
+                    input,
+                    input_type,
+                    script_id,
+                    log_id,
+                    preview_mode,
+                    stream_mode=stream_mode,
+                )
+                try:
+                    # the time a chunk is held by the yield is its sse write
+                    for chunk in stream:
+                        start = time.perf_counter()
+                        yield chunk
+                        step.add("sse", time.perf_counter() - start)
+                finally:
+                    stream.close()
+                    if profile is not None:
+                        step.add("db", (profile.total_ms - db_start) / 1000)
         except Exception as e:
             app.logger.error("run_script error")
             # 输出详细的错误信息
@@ -1,10 +1,11 @@
 import datetime
 import json
 import re
+import time
 from flaskr.service.common.models import raise_error
-from flask import Flask
+from flask import Flask, g
 from flaskr.util.uuid import generate_id
-from langchain.prompts import PromptTemplate
+from flaskr.util.prompt_template import get_prompt_template
 from ...service.lesson.const import (
     ASK_MODE_DEFAULT,
     ASK_MODE_DISABLE,
@@ -31,6 +32,13 @@ from ...service.order.funs import (
 from ...service.order.models import AICourseLessonAttend
 from ...service.profile.funcs import get_user_profiles
 from ...service.study.dtos import AILessonAttendDTO, ScriptDTO
+from ...service.study.const import (
+    STREAM_MODE_CHAR,
+    STREAM_MODE_INSTANT,
+    STREAM_MODE_SENTENCE,
+    STREAM_MODE_WORD,
+    STREAM_MODES,
+)
 from ...service.study.models import AICourseAttendAsssotion, AICourseLessonAttendScript
 from ...dao import db
 from ...service.order.funs import query_raw_buy_record
@@ -38,6 +46,10 @@ from ...service.order.consts import BUY_STATUS_SUCCESS
 from flaskr.service.user.models import User
 from flaskr.framework import extensible
 from ...service.lesson.const import STATUS_PUBLISH, STATUS_DRAFT
+from ...service.lesson.graph import (
+    get_course_graph,
+    get_course_graph_of_script,
+)
 
 
 def get_current_lesson(
@@ -74,7 +86,13 @@ def check_phone_number(app, user_info: User, input):
 # 得到一个课程的System Prompt
 
 
-def get_lesson_system(app: Flask, lesson_id: str) -> str:
+def get_lesson_system(
+    app: Flask, lesson_id: str, script_info: AILessonScript = None
+) -> str:
+    if script_info is not None:
+        graph = get_course_graph_of_script(app, script_info)
+        if graph is not None:
+            return graph.get_lesson_system(lesson_id)
     status = [STATUS_PUBLISH, STATUS_DRAFT]
     # 缓存逻辑
     lesson_ids = [lesson_id]
@@ -111,7 +129,7 @@ def get_lesson_system(app: Flask, lesson_id: str) -> str:
         .order_by(AILessonScript.id.desc())
         .all()
     )
-    app.logger.info("scripts:{}".format(scripts))
+    app.logger.debug("scripts:%s", scripts)
     if len(scripts) > 0:
         for script in scripts:
             if script.lesson_id == lesson_id:
@@ -137,16 +155,24 @@ def get_lesson_and_attend_info(
     status = [STATUS_PUBLISH]
     if preview_mode:
         status.append(STATUS_DRAFT)
-    lessons = (
-        AILesson.query.filter(
-            AILesson.lesson_no.like(parent_no + "%"),
-            AILesson.course_id == course_id,
-            AILesson.lesson_type != LESSON_TYPE_BRANCH_HIDDEN,
-            AILesson.status.in_(status),
+    graph = None if preview_mode else get_course_graph(app, course_id)
+    if graph is not None:
+        lessons = [
+            lesson
+            for lesson in graph.get_lessons_by_prefix(parent_no)
+            if lesson.lesson_type != LESSON_TYPE_BRANCH_HIDDEN
+        ]
+    else:
+        lessons = (
+            AILesson.query.filter(
+                AILesson.lesson_no.like(parent_no + "%"),
+                AILesson.course_id == course_id,
+                AILesson.lesson_type != LESSON_TYPE_BRANCH_HIDDEN,
+                AILesson.status.in_(status),
+            )
+            .order_by(AILesson.id.desc())
+            .all()
         )
-        .order_by(AILesson.id.desc())
-        .all()
-    )
     if len(lessons) == 0:
         return []
     app.logger.info(
@@ -245,17 +271,6 @@ def extract_json(app: Flask, text: str):
     return {}
 
 
-def extract_variables(template: str) -> list:
-    # 使用正则表达式匹配单层 {} 中的内容，忽略双层大括号
-    pattern = r"\{([^{}]+)\}(?!})"
-    matches = re.findall(pattern, template)
-
-    # 去重并过滤包含双引号的元素
-    variables = list(set(matches))
-    filtered_variables = [var for var in variables if '"' not in var]
-    return filtered_variables
-
-
 def get_fmt_prompt(
     app: Flask,
     user_id: str,
@@ -264,7 +279,7 @@ def get_fmt_prompt(
     input: str = None,
     profile_array_str: str = None,
 ) -> str:
-    app.logger.info("raw prompt:" + profile_tmplate)
+    app.logger.debug("raw prompt:%s", profile_tmplate)
     propmpt_keys = []
     profiles = {}
 
@@ -273,26 +288,25 @@ def get_fmt_prompt(
     if input:
         profiles["input"] = input
         propmpt_keys.append("input")
-    app.logger.info(propmpt_keys)
-    app.logger.info(profiles)
-    prompt_template_lc = PromptTemplate.from_template(profile_tmplate)
-    keys = extract_variables(profile_tmplate)
+    app.logger.debug("%s", propmpt_keys)
+    app.logger.debug("%s", profiles)
+    prompt_template = get_prompt_template(profile_tmplate)
     fmt_keys = {}
-    for key in keys:
+    for key in prompt_template.variables:
         if key in profiles:
             fmt_keys[key] = profiles[key]
         else:
             fmt_keys[key] = key
             app.logger.info("key not found:" + key + " ,user_id:" + user_id)
-    app.logger.info(fmt_keys)
+    app.logger.debug("%s", fmt_keys)
     if len(fmt_keys) == 0:
         if len(profile_tmplate) == 0:
             prompt = input
         else:
             prompt = profile_tmplate
     else:
-        prompt = prompt_template_lc.format(**fmt_keys)
-    app.logger.info("fomat input:{}".format(prompt))
+        prompt = prompt_template.format(fmt_keys)
+    app.logger.debug("fomat input:%s", prompt)
     return prompt
 
 
@@ -304,6 +318,8 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
     attend_info = AICourseLessonAttend.query.filter(
         AICourseLessonAttend.attend_id == attend_id
     ).first()
+    # the published content is served from the compiled course graph
+    graph = None if preview_mode else get_course_graph(app, attend_info.course_id)
     attend_infos = []
     attend_status_values = get_attend_status_values()
     app.logger.info(
@@ -313,14 +329,17 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
         attend_info.status = ATTEND_STATUS_IN_PROGRESS
         attend_info.script_index = 1
         # 检查是否是第一节课
-        lesson = (
-            AILesson.query.filter(
-                AILesson.lesson_id == attend_info.lesson_id,
-                AILesson.status.in_(status),
+        if graph is not None:
+            lesson = graph.get_lesson(attend_info.lesson_id)
+        else:
+            lesson = (
+                AILesson.query.filter(
+                    AILesson.lesson_id == attend_info.lesson_id,
+                    AILesson.status.in_(status),
+                )
+                .order_by(AILesson.id.desc())
+                .first()
             )
-            .order_by(AILesson.id.desc())
-            .first()
-        )
         attend_infos.append(
             AILessonAttendDTO(
                 lesson.lesson_no,
@@ -336,15 +355,18 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
         if len(lesson.lesson_no) >= 2 and lesson.lesson_no[-2:] == "01":
             # 第一节课
             app.logger.info("first lesson")
-            parent_lesson = (
-                AILesson.query.filter(
-                    AILesson.lesson_no == lesson.lesson_no[:-2],
-                    AILesson.course_id == lesson.course_id,
-                    AILesson.status.in_(status),
+            if graph is not None:
+                parent_lesson = graph.get_lesson_by_no(lesson.lesson_no[:-2])
+            else:
+                parent_lesson = (
+                    AILesson.query.filter(
+                        AILesson.lesson_no == lesson.lesson_no[:-2],
+                        AILesson.course_id == lesson.course_id,
+                        AILesson.status.in_(status),
+                    )
+                    .order_by(AILesson.id.desc())
+                    .first()
                 )
-                .order_by(AILesson.id.desc())
-                .first()
-            )
             parent_attend = (
                 AICourseLessonAttend.query.filter(
                     AICourseLessonAttend.lesson_id == parent_lesson.lesson_id,
@@ -428,6 +450,8 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
             .order_by(AILessonScript.id.desc())
             .first()
         )
+    elif graph is not None:
+        script_info = graph.get_script(attend_info.lesson_id, attend_info.script_index)
     else:
         script_info = (
             AILessonScript.query.filter(
@@ -444,14 +468,17 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
         app.logger.info(attend_info.lesson_id)
         if attend_info.status == ATTEND_STATUS_IN_PROGRESS:
             attend_info.status = ATTEND_STATUS_COMPLETED
-            lesson = (
-                AILesson.query.filter(
-                    AILesson.lesson_id == attend_info.lesson_id,
-                    AILesson.status.in_(status),
+            if graph is not None:
+                lesson = graph.get_lesson(attend_info.lesson_id)
+            else:
+                lesson = (
+                    AILesson.query.filter(
+                        AILesson.lesson_id == attend_info.lesson_id,
+                        AILesson.status.in_(status),
+                    )
+                    .order_by(AILesson.id.desc())
+                    .first()
                 )
-                .order_by(AILesson.id.desc())
-                .first()
-            )
             attend_infos.append(
                 AILessonAttendDTO(
                     lesson.lesson_no,
@@ -467,11 +494,15 @@ def get_script(app: Flask, attend_id: str, next: int = 0, preview_mode: bool = F
 
 
 def get_script_by_id(
-    app: Flask, script_id: str, preview_mode: bool = False
+    app: Flask, script_id: str, preview_mode: bool = False, course_id: str = None
 ) -> AILessonScript:
     status = [STATUS_PUBLISH]
     if preview_mode:
         status.append(STATUS_DRAFT)
+    if course_id and not preview_mode:
+        graph = get_course_graph(app, course_id)
+        if graph is not None:
+            return graph.get_script_by_id(script_id)
     return (
         AILessonScript.query.filter(
             AILessonScript.script_id == script_id,
@@ -501,6 +532,87 @@ def make_script_dto_to_stream(dto: ScriptDTO) -> str:
     )
 
 
+SENTENCE_END_CHARS = "。！？；!?;\n"
+
+
+def get_stream_mode(app: Flask) -> str:
+    mode = g.get("stream_mode", None)
+    if mode not in STREAM_MODES:
+        mode = app.config.get("FIX_OUTPUT_STREAM_MODE", STREAM_MODE_WORD)
+    if mode not in STREAM_MODES:
+        mode = STREAM_MODE_WORD
+    return mode
+
+
+# set the stream mode of fixed text for the current step,
+# ex. instant for replays and previews
+def set_stream_mode(mode: str):
+    if mode in STREAM_MODES:
+        g.stream_mode = mode
+
+
+def _is_word_boundary(char: str) -> bool:
+    # ascii letters and digits build words, cjk chars and
+    # punctuations are boundaries by themselves
+    return not (char.isascii() and char.isalnum())
+
+
+def _is_sentence_boundary(text: str, index: int) -> bool:
+    char = text[index]
+    if char in SENTENCE_END_CHARS:
+        return True
+    return char == "." and (index + 1 == len(text) or text[index + 1].isspace())
+
+
+# split the text into word or sentence sized chunks
+def split_text_chunks(text: str, mode: str, chunk_size: int) -> list[str]:
+    if not text:
+        return []
+    if mode == STREAM_MODE_INSTANT:
+        return [text]
+    if mode == STREAM_MODE_CHAR or chunk_size <= 1:
+        return list(text)
+    max_size = chunk_size * 8 if mode == STREAM_MODE_SENTENCE else chunk_size * 4
+    chunks = []
+    start = 0
+    for index in range(len(text)):
+        size = index + 1 - start
+        if mode == STREAM_MODE_SENTENCE:
+            boundary = _is_sentence_boundary(text, index)
+        else:
+            boundary = size >= chunk_size and _is_word_boundary(text[index])
+        if boundary or size >= max_size:
+            chunks.append(text[start : index + 1])  # noqa
+            start = index + 1
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+# emit the fixed text as script dto frames,
+# paced at FIX_OUTPUT_CHARS_PER_SECOND unless the mode is instant
+def make_script_dto_chunks(
+    app: Flask,
+    script_type: str,
+    text: str,
+    script_id: str,
+    lesson_id: str = None,
+):
+    mode = get_stream_mode(app)
+    chunk_size = int(app.config.get("FIX_OUTPUT_CHUNK_SIZE", 16))
+    chars_per_second = float(app.config.get("FIX_OUTPUT_CHARS_PER_SECOND", 100))
+    start = time.time()
+    sent = 0
+    for chunk in split_text_chunks(text, mode, chunk_size):
+        yield make_script_dto(script_type, chunk, script_id, lesson_id)
+        sent += len(chunk)
+        if mode == STREAM_MODE_INSTANT or chars_per_second <= 0:
+            continue
+        delay = start + sent / chars_per_second - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
 @extensible
 def update_lesson_status(app: Flask, attend_id: str, preview_mode: bool = False):
     status = [STATUS_PUBLISH]
@@ -511,14 +623,18 @@ def update_lesson_status(app: Flask, attend_id: str, preview_mode: bool = False)
     attend_info = AICourseLessonAttend.query.filter(
         AICourseLessonAttend.attend_id == attend_id
     ).first()
-    lesson = (
-        AILesson.query.filter(
-            AILesson.lesson_id == attend_info.lesson_id,
-            AILesson.status.in_(status),
+    graph = None if preview_mode else get_course_graph(app, attend_info.course_id)
+    if graph is not None:
+        lesson = graph.get_lesson(attend_info.lesson_id)
+    else:
+        lesson = (
+            AILesson.query.filter(
+                AILesson.lesson_id == attend_info.lesson_id,
+                AILesson.status.in_(status),
+            )
+            .order_by(AILesson.id.desc())
+            .first()
         )
-        .order_by(AILesson.id.desc())
-        .first()
-    )
     lesson_no = lesson.lesson_no
     parent_no = lesson_no
     attend_info.status = ATTEND_STATUS_COMPLETED
@@ -669,6 +785,9 @@ class FollowUpInfo:
 
 
 def get_follow_up_info(app: Flask, script_info: AILessonScript) -> FollowUpInfo:
+    graph = get_course_graph_of_script(app, script_info)
+    if graph is not None:
+        return FollowUpInfo(**graph.get_follow_up(script_info.script_id))
     if script_info.ask_mode != ASK_MODE_DEFAULT:
         app.logger.info(f"script_info.ask_mode: {script_info.ask_mode}")
         return FollowUpInfo(
@@ -773,11 +892,9 @@ class ModelSetting:
         return {"model_name": self.model_name, "model_args": self.model_args}
 
 
-def get_model_setting(
-    app: Flask, script_info: AILessonScript, status: list[int] = None
+def get_model_setting_from_db(
+    app: Flask, script_info: AILessonScript, status: list[int]
 ) -> ModelSetting:
-    if status is None:
-        status = [STATUS_PUBLISH, STATUS_DRAFT]
     if script_info.script_model and script_info.script_model.strip():
         return ModelSetting(
             script_info.script_model, {"temperature": script_info.script_temprature}
@@ -816,6 +933,23 @@ def get_model_setting(
             ai_course.course_default_model,
             {"temperature": ai_course.course_default_temprature},
         )
+    return None
+
+
+def get_model_setting(
+    app: Flask, script_info: AILessonScript, status: list[int] = None
+) -> ModelSetting:
+    if status is None:
+        status = [STATUS_PUBLISH, STATUS_DRAFT]
+    graph = get_course_graph_of_script(app, script_info)
+    if graph is not None:
+        model_setting = graph.get_model_setting(script_info.script_id)
+        if model_setting is not None:
+            return ModelSetting(**model_setting)
+    else:
+        model_setting = get_model_setting_from_db(app, script_info, status)
+        if model_setting is not None:
+            return model_setting
     default_model = app.config.get("DEFAULT_LLM_MODEL", "")
     if not default_model or default_model == "":
         raise_error("LLM.NO_DEFAULT_LLM")
@@ -835,6 +969,10 @@ def check_script_is_last_script(
     status = [STATUS_PUBLISH]
     if preview_mode:
         status.append(STATUS_DRAFT)
+    else:
+        graph = get_course_graph(app, lesson_info.course_id)
+        if graph is not None:
+            return graph.is_last_script(script_info, lesson_info.lesson_no)
     parent_lesson_no = lesson_info.lesson_no
     if len(parent_lesson_no) > 2:
         parent_lesson_no = parent_lesson_no[:2]
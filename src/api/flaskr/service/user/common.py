@@ -23,6 +23,11 @@ from ..common.dtos import (
 )
 from ..common.models import raise_error
 from .utils import generate_token, get_user_language, get_user_openid
+from .token_cache import (
+    cache_user_info,
+    get_cached_user_info,
+    get_user_cache_generation,
+)
 from ...dao import redis_client as redis, db
 from .models import User as CommonUser, AdminUser as AdminUser
 from flaskr.common.log import get_mode
@@ -99,12 +104,16 @@ def validate_user(app: Flask, token: str) -> UserInfo:
                         has_password=user.password_hash != "",
                     )
             else:
+                user_info = get_cached_user_info(app, token)
+                if user_info:
+                    return user_info
                 user_id = jwt.decode(
                     token, app.config["SECRET_KEY"], algorithms=["HS256"]
                 )["user_id"]
                 app.logger.info("user_id:" + user_id)
 
             app.logger.info("user_id:" + user_id)
+            generation = get_user_cache_generation()
             redis_user_id = redis.get(app.config["REDIS_KEY_PREFIX_USER"] + token)
             if redis_user_id is None:
                 raise_error("USER.USER_TOKEN_EXPIRED")
@@ -115,7 +124,7 @@ def validate_user(app: Flask, token: str) -> UserInfo:
             if set_user_id == user_id:
                 user = User.query.filter_by(user_id=user_id).first()
                 if user:
-                    return UserInfo(
+                    user_info = UserInfo(
                         user_id=user.user_id,
                         username=user.username,
                         name=user.name,
@@ -127,6 +136,8 @@ def validate_user(app: Flask, token: str) -> UserInfo:
                         user_avatar=user.user_avatar,
                         has_password=user.password_hash != "",
                     )
+                    cache_user_info(app, token, user_info, generation)
+                    return user_info
                 else:
                     raise_error("USER.USER_TOKEN_EXPIRED")
             else:
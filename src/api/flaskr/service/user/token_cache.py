@@ -0,0 +1,168 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ...common.config import get_config
+from ...dao import redis_client as redis
+from ..common.dtos import UserInfo
+from .models import User, AdminUser
+
+# validated token -> UserInfo, held by each worker process for a few seconds
+# any change of a user row drops the tokens of the user in every process
+# through a redis channel, while the channel is not subscribed the cache
+# is bypassed, so a missed message can not keep a stale entry
+_cache = OrderedDict()
+_user_tokens = {}
+_lock = threading.Lock()
+# bumped by every invalidation, an entry loaded before it is not stored
+_generation = 0
+
+_listener_lock = threading.Lock()
+_listener_thread = None
+_listener_ready = threading.Event()
+
+_SESSION_KEY = "user_token_cache_invalidate"
+
+
+def _get_channel() -> str:
+    return get_config("REDIS_KEY_PREFIX", "ai-shifu:") + "user_token_invalidate"
+
+
+def _get_ttl() -> float:
+    return float(get_config("USER_TOKEN_CACHE_TTL", "30"))
+
+
+def _drop_user(user_id: str):
+    global _generation
+    with _lock:
+        _generation += 1
+        for token in _user_tokens.pop(user_id, ()):
+            _cache.pop(token, None)
+
+
+def _clear():
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+        _user_tokens.clear()
+
+
+def _listen(app: Flask):
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            pubsub.subscribe(_get_channel())
+            for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    _listener_ready.set()
+                elif message["type"] == "message":
+                    _drop_user(message["data"].decode("utf-8"))
+        except Exception as e:
+            app.logger.warning(f"user token cache listener error: {e}")
+        finally:
+            _listener_ready.clear()
+            _clear()
+            pubsub.close()
+        time.sleep(1)
+
+
+# started lazily, so each worker forked by gunicorn subscribes by itself
+def _start_listener(app: Flask):
+    global _listener_thread
+    if _listener_thread is not None:
+        return
+    with _listener_lock:
+        if _listener_thread is not None:
+            return
+        _listener_thread = threading.Thread(
+            target=_listen,
+            args=(app,),
+            name="user-token-cache",
+            daemon=True,
+        )
+        _listener_thread.start()
+
+
+def get_user_cache_generation() -> int:
+    return _generation
+
+
+def get_cached_user_info(app: Flask, token: str) -> UserInfo:
+    if _get_ttl() <= 0:
+        return None
+    _start_listener(app)
+    if not _listener_ready.is_set():
+        return None
+    with _lock:
+        item = _cache.get(token)
+        if item is None:
+            return None
+        expire_at, user_info = item
+        if expire_at < time.monotonic():
+            _cache.pop(token, None)
+            return None
+        _cache.move_to_end(token)
+    # the request may change its user info, so it gets its own copy
+    return copy.copy(user_info)
+
+
+def cache_user_info(app: Flask, token: str, user_info: UserInfo, generation: int):
+    ttl = _get_ttl()
+    if ttl <= 0 or not _listener_ready.is_set():
+        return
+    max_size = int(get_config("USER_TOKEN_CACHE_SIZE", "10000"))
+    with _lock:
+        if generation != _generation:
+            return
+        _cache[token] = (time.monotonic() + ttl, copy.copy(user_info))
+        _cache.move_to_end(token)
+        _user_tokens.setdefault(user_info.user_id, set()).add(token)
+        while len(_cache) > max_size:
+            old_token, (_, old_user_info) = _cache.popitem(last=False)
+            tokens = _user_tokens.get(old_user_info.user_id)
+            if tokens is not None:
+                tokens.discard(old_token)
+                if not tokens:
+                    _user_tokens.pop(old_user_info.user_id, None)
+
+
+# drop the cached tokens of a user in every process
+def invalidate_user_cache(app: Flask, user_id: str):
+    _drop_user(user_id)
+    try:
+        redis.publish(_get_channel(), user_id)
+    except Exception as e:
+        app.logger.warning(f"publish user token invalidation error: {e}")
+
+
+# the user rows changed by a flush are invalidated when the session commits
+def _on_user_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.user_id:
+        session.info.setdefault(_SESSION_KEY, set()).add(target.user_id)
+
+
+def _on_commit(session):
+    user_ids = session.info.pop(_SESSION_KEY, None)
+    if user_ids:
+        app = current_app._get_current_object()
+        for user_id in user_ids:
+            invalidate_user_cache(app, user_id)
+
+
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+for _model in (User, AdminUser):
+    event.listen(_model, "after_insert", _on_user_change)
+    event.listen(_model, "after_update", _on_user_change)
+    event.listen(_model, "after_delete", _on_user_change)
+event.listen(Session, "after_commit", _on_commit)
+event.listen(Session, "after_rollback", _on_rollback)
@@ -0,0 +1,49 @@
+import re
+import threading
+from collections import OrderedDict
+
+from flaskr.common.config import get_config
+
+
+# match the content of a single-level {}, ignoring the escaped {{}}
+VARIABLE_PATTERN = re.compile(r"\{([^{}]+)\}(?!})")
+
+
+def extract_variables(template: str) -> list:
+    # 去重并过滤包含双引号的元素
+    variables = list(set(VARIABLE_PATTERN.findall(template)))
+    return [var for var in variables if '"' not in var]
+
+
+# a prompt template parsed once and formatted many times,
+# formatting follows the f-string rules of langchain's PromptTemplate
+class CompiledPromptTemplate:
+    template: str
+    variables: list
+
+    def __init__(self, template: str):
+        self.template = template
+        self.variables = extract_variables(template)
+
+    def format(self, values: dict) -> str:
+        return self.template.format(**values)
+
+
+_templates = OrderedDict()
+_template_lock = threading.Lock()
+
+
+# get the parsed template from a bounded lru cache keyed by the template text
+def get_prompt_template(template: str) -> CompiledPromptTemplate:
+    with _template_lock:
+        compiled = _templates.get(template)
+        if compiled is not None:
+            _templates.move_to_end(template)
+            return compiled
+    compiled = CompiledPromptTemplate(template)
+    with _template_lock:
+        _templates[template] = compiled
+        max_size = int(get_config("PROMPT_TEMPLATE_CACHE_SIZE", "1024"))
+        while len(_templates) > max_size:
+            _templates.popitem(last=False)
+    return compiled
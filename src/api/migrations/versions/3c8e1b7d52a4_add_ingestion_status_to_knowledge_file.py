@@ -0,0 +1,75 @@
+"""Add ingestion status to knowledge_file
+
+Revision ID: 3c8e1b7d52a4
+Revises: 88c0fd574bdd
+Create Date: 2025-06-10 08:12:45.217390
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3c8e1b7d52a4"
+down_revision = "88c0fd574bdd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("knowledge_file", schema=None) as batch_op:
+        # the files ingested before this revision are complete
+        batch_op.add_column(
+            sa.Column(
+                "status",
+                sa.Integer(),
+                nullable=False,
+                server_default="2",
+                comment="Ingestion status: 0 pending, 1 processing, 2 done, 3 failed",
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "chunk_count",
+                sa.Integer(),
+                nullable=False,
+                server_default="0",
+                comment="Chunk count",
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "chunk_done",
+                sa.Integer(),
+                nullable=False,
+                server_default="0",
+                comment="Ingested chunk count",
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "retry_count",
+                sa.Integer(),
+                nullable=False,
+                server_default="0",
+                comment="Retry count",
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "error_message", sa.Text(), nullable=True, comment="Last error message"
+            )
+        )
+        batch_op.create_index(
+            batch_op.f("ix_knowledge_file_status"), ["status"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("knowledge_file", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_knowledge_file_status"))
+        batch_op.drop_column("error_message")
+        batch_op.drop_column("retry_count")
+        batch_op.drop_column("chunk_done")
+        batch_op.drop_column("chunk_count")
+        batch_op.drop_column("status")
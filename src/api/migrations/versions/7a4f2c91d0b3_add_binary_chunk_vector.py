@@ -0,0 +1,49 @@
+"""Add binary chunk vector to knowledge_chunk
+
+Revision ID: 7a4f2c91d0b3
+Revises: 3c8e1b7d52a4
+Create Date: 2025-06-12 10:26:31.482913
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7a4f2c91d0b3"
+down_revision = "3c8e1b7d52a4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the json vectors of existing rows are converted by
+    # `flask console kb_vector_backfill`
+    with op.batch_alter_table("knowledge_chunk", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "chunk_vector_data",
+                sa.LargeBinary(),
+                nullable=True,
+                comment="Chunk vector, encoded by vector_codec",
+            )
+        )
+        batch_op.alter_column(
+            "chunk_vector",
+            existing_type=sa.Text(),
+            comment="Chunk vector (legacy JSON)",
+            existing_comment="Chunk vector",
+            existing_nullable=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("knowledge_chunk", schema=None) as batch_op:
+        batch_op.alter_column(
+            "chunk_vector",
+            existing_type=sa.Text(),
+            comment="Chunk vector",
+            existing_comment="Chunk vector (legacy JSON)",
+            existing_nullable=True,
+        )
+        batch_op.drop_column("chunk_vector_data")
@@ -0,0 +1,14 @@
+# End to end benchmark of the study stream of one api worker, run from src/api:
+#
+#     pip install "fakeredis[lua]"
+#     python -m tests.benchmark --learners 20 --steps 30 --ttft 0.5 --token-rate 50
+#
+# The worker serves the app in a process of its own with gevent, like one
+# gunicorn worker, on a temporary sqlite database (--database-url for mysql)
+# and fakeredis (--redis-host for a real redis). The llm and the text check
+# are fake servers started by the benchmark, their pace is set by --ttft,
+# --token-rate, --tokens and --check-latency. A course of --chapters,
+# --lessons and --scripts is seeded, each learner goes through it for
+# --steps study steps, and the report gives the p50/p95/p99 step latency,
+# the sql queries of a step, the time of each stage of a step and the
+# throughput of the worker. --output writes the report as json.
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .fakes import FakeCheckServer, FakeLLMServer
+from .runner import (
+    METRICS_HEADERS,
+    fetch_sql_metrics,
+    fetch_stage_seconds,
+    run_learners,
+)
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.benchmark",
+        description="Load test of the study stream of one api worker",
+    )
+    group = parser.add_argument_group("learners")
+    group.add_argument("--learners", type=int, default=10)
+    group.add_argument("--steps", type=int, default=20, help="steps of each learner")
+    group.add_argument("--timeout", type=float, default=120)
+    group = parser.add_argument_group("course")
+    group.add_argument("--chapters", type=int, default=2)
+    group.add_argument("--lessons", type=int, default=3, help="lessons of a chapter")
+    group.add_argument("--scripts", type=int, default=9, help="scripts of a lesson")
+    group.add_argument("--model", default="gpt-bench")
+    group = parser.add_argument_group("fake services")
+    group.add_argument("--ttft", type=float, default=0.5, help="llm first token")
+    group.add_argument("--token-rate", type=float, default=50, help="tokens/s")
+    group.add_argument("--tokens", type=int, default=100, help="tokens of a reply")
+    group.add_argument("--check-latency", type=float, default=0.1)
+    group = parser.add_argument_group("worker")
+    group.add_argument(
+        "--database-url", help="sqlalchemy url, a temporary sqlite file by default"
+    )
+    group.add_argument("--redis-host", help="a real redis instead of fakeredis")
+    group.add_argument("--redis-port", type=int, default=6379)
+    group.add_argument("--redis-db", type=int, default=0)
+    group.add_argument(
+        "--server",
+        choices=("gevent", "threaded"),
+        help="gevent like the gunicorn workers, threaded by default on sqlite",
+    )
+    group.add_argument("--stream-mode", default="instant", help="of the fixed texts")
+    group.add_argument("--log-level", default="WARNING")
+    group.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", help="write the report as json to this file")
+    # the worker process itself, started by the benchmark
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--llm-url", help=argparse.SUPPRESS)
+    parser.add_argument("--check-url", help=argparse.SUPPRESS)
+    parser.add_argument("--ready-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_worker(args, llm: FakeLLMServer, check: FakeCheckServer, workdir: str):
+    ready_file = os.path.join(workdir, "ready.json")
+    command = [
+        sys.executable,
+        "-m",
+        "tests.benchmark",
+        "--serve",
+        f"--port={args.port}",
+        f"--server={args.server}",
+        f"--database-url={args.database_url}",
+        f"--redis-port={args.redis_port}",
+        f"--redis-db={args.redis_db}",
+        f"--chapters={args.chapters}",
+        f"--lessons={args.lessons}",
+        f"--scripts={args.scripts}",
+        f"--model={args.model}",
+        f"--stream-mode={args.stream_mode}",
+        f"--log-level={args.log_level}",
+        f"--llm-url={llm.url}",
+        f"--check-url={check.url}",
+        f"--ready-file={ready_file}",
+    ]
+    if args.redis_host:
+        command.append(f"--redis-host={args.redis_host}")
+    process = subprocess.Popen(command, cwd=API_DIR)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the worker exited with {process.returncode}")
+        if os.path.exists(ready_file):
+            try:
+                with open(ready_file) as f:
+                    ready = json.load(f)
+            except ValueError:
+                ready = None
+            if ready:
+                return process, ready
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("the worker did not start in 120s")
+
+
+def _wait_for_port(base_url: str, timeout: float):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            requests.get(f"{base_url}/metrics/sql", headers=METRICS_HEADERS, timeout=5)
+            return
+        except requests.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _print_report(report: dict):
+    print(f"worker:              {report['server']}, {report['database']}")
+    print(
+        f"course:              {report['chapters']} chapters x {report['lessons']} lessons x {report['scripts']} scripts"
+    )
+    print(
+        f"learners:            {report['learners']}, {report['steps']} steps, {report['errors']} errors"
+    )
+    if report.get("first_error"):
+        print(f"first error:         {report['first_error']}")
+    step = report["step_seconds"]
+    print(
+        f"step latency:        p50 {step['p50']}s  p95 {step['p95']}s  p99 {step['p99']}s"
+    )
+    first = report["first_byte_seconds"]
+    print(
+        f"first byte:          p50 {first['p50']}s  p95 {first['p95']}s  p99 {first['p99']}s"
+    )
+    print(f"throughput:          {report['steps_per_second']} steps/s per worker")
+    sql = report["sql"]
+    print(
+        f"sql per step:        {sql.get('queries_per_request')} queries, {sql.get('db_ms_per_request')}ms, max {sql.get('max_queries')}"
+    )
+    stages = "  ".join(f"{k} {v}s" for k, v in report["stage_seconds"].items())
+    print(f"stages per step:     {stages}")
+    print(f"llm requests:        {report['llm_requests']}")
+    if report["database"].startswith("sqlite") and report["learners"] > 1:
+        print(
+            "note: sqlite has one writer at a time, the db time of concurrent steps is mostly waits for its lock, use --database-url with mysql for the latency of a deployment"
+        )
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if args.serve:
+        from .server import serve
+
+        serve(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="ai-shifu-bench-")
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}?timeout=30"
+    # a sqlite lock waited for blocks the whole gevent loop, the transaction
+    # holding it can not end, so sqlite runs with a thread per request
+    if not args.server:
+        args.server = "threaded" if args.database_url.startswith("sqlite") else "gevent"
+    if not args.port:
+        args.port = _free_port()
+    llm = FakeLLMServer(
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        model=args.model,
+    ).start()
+    check = FakeCheckServer(latency=args.check_latency).start()
+    process = None
+    try:
+        process, ready = _start_worker(args, llm, check, workdir)
+        base_url = f"http://127.0.0.1:{args.port}/api"
+        _wait_for_port(base_url, 30)
+        report = run_learners(
+            base_url, ready["course_id"], args.learners, args.steps, args.timeout
+        )
+        report.update(
+            {
+                "database": ready["database"],
+                "server": args.server,
+                "chapters": args.chapters,
+                "lessons": args.lessons,
+                "scripts": args.scripts,
+                "sql": fetch_sql_metrics(base_url, args.timeout),
+                "stage_seconds": fetch_stage_seconds(
+                    base_url, args.timeout, report["steps"]
+                ),
+                "llm_requests": llm.requests,
+            }
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(30)
+        llm.stop()
+        check.stop()
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
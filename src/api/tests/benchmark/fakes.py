@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# stand-ins of the external services of a study step, served on local ports:
+# an openai compatible llm streaming its tokens at a configured pace, and the
+# ilivedata text check answering after a configured latency
+
+BENCH_PROFILE_KEY = "bench_name"
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _FakeServer:
+    handler = None
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), self.handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name=type(self).__name__, daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _LLMHandler(_QuietHandler):
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                {
+                    "object": "list",
+                    "data": [
+                        {
+                            "id": self.server.fake.model,
+                            "object": "model",
+                            "owned_by": "bench",
+                        }
+                    ],
+                }
+            )
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        fake = self.server.fake
+        request = self._read_json()
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            # the check of a text input, the learner input is always accepted
+            tokens = [
+                json.dumps(
+                    {"result": "ok", "parse_vars": {BENCH_PROFILE_KEY: "learner"}}
+                )
+            ]
+        else:
+            tokens = ["字"] * fake.tokens
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        time.sleep(fake.ttft)
+        interval = 1 / fake.token_rate if fake.token_rate > 0 else 0
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", fake.model),
+        }
+        for index, token in enumerate(tokens):
+            if index and interval:
+                time.sleep(interval)
+            delta = {"index": 0, "delta": {"content": token}, "finish_reason": None}
+            self._send_event(dict(chunk, choices=[delta]))
+        done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        self._send_event(dict(chunk, choices=[done]))
+        prompt_tokens = sum(
+            len(str(message.get("content", ""))) for message in request["messages"]
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        self._send_event(dict(chunk, choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        with fake.lock:
+            fake.requests += 1
+
+    def _send_event(self, data: dict):
+        self.wfile.write(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer(_FakeServer):
+    handler = _LLMHandler
+
+    def __init__(
+        self,
+        ttft: float = 0.5,
+        token_rate: float = 50,
+        tokens: int = 100,
+        model: str = "gpt-bench",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.model = model
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class _CheckHandler(_QuietHandler):
+    def do_POST(self):
+        self._read_json()
+        time.sleep(self.server.fake.latency)
+        self._send_json({"errorCode": 0, "textSpam": {"result": 0, "tags": []}})
+
+
+class FakeCheckServer(_FakeServer):
+    handler = _CheckHandler
+
+    def __init__(self, latency: float = 0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
@@ -0,0 +1,217 @@
+import json
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+from .server import METRICS_TOKEN
+
+# a learner logs in as a temporary user and goes through the course one
+# study step after another, a step is a /study/run request read to the end
+# of its stream, the next step answers the buttons or the input it ended on,
+# or starts the next lesson like the web client does
+
+# ATTEND_STATUS_NOT_STARTED, the status of a lesson the learner can start
+LESSON_PREPARE_LEARNING = 601
+
+METRICS_HEADERS = {"Authorization": f"Bearer {METRICS_TOKEN}"}
+
+
+class StepResult:
+    def __init__(self, seconds: float, first_byte: float, events: int, error=None):
+        self.seconds = seconds
+        self.first_byte = first_byte
+        self.events = events
+        self.error = error
+
+
+class Learner:
+    def __init__(self, base_url: str, course_id: str, steps: int, timeout: float):
+        self.base_url = base_url
+        self.course_id = course_id
+        self.steps = steps
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.results = []
+        self.token = None
+
+    def login(self):
+        response = self.session.post(
+            f"{self.base_url}/user/require_tmp",
+            json={"temp_id": uuid.uuid4().hex, "source": "web"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        self.token = response.json()["data"]["token"]
+
+    def step(self, body: dict):
+        start = time.perf_counter()
+        first_byte = None
+        events = []
+        try:
+            with self.session.post(
+                f"{self.base_url}/study/run",
+                json=dict(body, course_id=self.course_id),
+                headers={"Token": self.token},
+                stream=True,
+                timeout=self.timeout,
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    if line.startswith(b"data: "):
+                        events.append(json.loads(line[6:]))
+        except Exception as e:
+            self.results.append(
+                StepResult(time.perf_counter() - start, first_byte, len(events), e)
+            )
+            return None
+        # run_script ends a failed step with a text and a text_end of no script
+        if events and events[-1].get("type") == "text_end":
+            if events[-1].get("script_id") is None:
+                message = events[-2].get("content") if len(events) > 1 else ""
+                self.results.append(
+                    StepResult(
+                        time.perf_counter() - start,
+                        first_byte,
+                        len(events),
+                        RuntimeError(f"the step failed: {message}"),
+                    )
+                )
+                return None
+        self.results.append(
+            StepResult(time.perf_counter() - start, first_byte, len(events))
+        )
+        return events
+
+    def next_input(self, events: list):
+        for event in events:
+            content = event.get("content")
+            if (
+                event.get("type") == "lesson_update"
+                and isinstance(content, dict)
+                and content.get("status_value") == LESSON_PREPARE_LEARNING
+            ):
+                return {"lesson_id": content["lesson_id"], "input_type": "start"}
+        for event in reversed(events):
+            if event.get("type") == "buttons":
+                buttons = event["content"].get("buttons") or []
+                if not buttons:
+                    return None
+                button = buttons[0]
+                return {
+                    "lesson_id": event.get("lesson_id"),
+                    "script_id": event.get("script_id"),
+                    "input_type": button.get("type") or "continue",
+                    "input": button.get("value"),
+                }
+            if event.get("type") == "input":
+                return {
+                    "lesson_id": event.get("lesson_id"),
+                    "script_id": event.get("script_id"),
+                    "input_type": "text",
+                    "input": "小明",
+                }
+        return None
+
+    def run(self):
+        try:
+            self.login()
+        except Exception as e:
+            self.results.append(StepResult(0.0, None, 0, e))
+            return
+        body = {"input_type": "start"}
+        for _ in range(self.steps):
+            events = self.step(body)
+            if not events:
+                return
+            body = self.next_input(events)
+            if body is None:
+                return
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_learners(
+    base_url: str, course_id: str, learners: int, steps: int, timeout: float
+) -> dict:
+    group = [Learner(base_url, course_id, steps, timeout) for _ in range(learners)]
+    threads = [
+        threading.Thread(target=learner.run, name=f"learner-{index}", daemon=True)
+        for index, learner in enumerate(group)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = [result for learner in group for result in learner.results]
+    succeeded = [result for result in results if result.error is None]
+    errors = [result for result in results if result.error is not None]
+    seconds = [result.seconds for result in succeeded]
+    first_bytes = [
+        result.first_byte for result in succeeded if result.first_byte is not None
+    ]
+    report = {
+        "learners": learners,
+        "steps": len(succeeded),
+        "errors": len(errors),
+        "elapsed_seconds": round(elapsed, 3),
+        "steps_per_second": round(len(succeeded) / elapsed, 3) if elapsed else 0.0,
+        "step_seconds": {
+            f"p{percent}": round(_percentile(seconds, percent), 3)
+            for percent in (50, 95, 99)
+        },
+        "first_byte_seconds": {
+            f"p{percent}": round(_percentile(first_bytes, percent), 3)
+            for percent in (50, 95, 99)
+        },
+    }
+    if errors:
+        report["first_error"] = repr(errors[0].error)
+    return report
+
+
+# the queries of the study steps counted by the sql profiler of the worker
+def fetch_sql_metrics(base_url: str, timeout: float) -> dict:
+    response = requests.get(
+        f"{base_url}/metrics/sql", headers=METRICS_HEADERS, timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()["data"]
+    return data.get("POST /api/study/run") or {}
+
+
+_STAGE_SUM = re.compile(
+    r'^ai_shifu_study_stage_seconds_sum\{stage="([^"]*)".*\} ([0-9.e+-]+)$'
+)
+
+
+# the seconds each stage takes in a study step, from the histograms of the
+# worker, the llm stage leaves out the sse writes made while it streams
+def fetch_stage_seconds(base_url: str, timeout: float, steps: int) -> dict:
+    response = requests.get(
+        f"{base_url}/metrics", headers=METRICS_HEADERS, timeout=timeout
+    )
+    response.raise_for_status()
+    stages = {}
+    for line in response.text.splitlines():
+        match = _STAGE_SUM.match(line)
+        if match:
+            stage = match.group(1)
+            stages[stage] = stages.get(stage, 0.0) + float(match.group(2))
+    return {
+        stage: round(seconds / steps, 3) if steps else 0.0
+        for stage, seconds in sorted(stages.items())
+    }
@@ -0,0 +1,102 @@
+import uuid
+
+from flask import Flask
+
+from flaskr.dao import db
+from flaskr.service.lesson.const import (
+    CONTENT_TYPE_TEXT,
+    LESSON_TYPE_TRIAL,
+    SCRIPT_TYPE_FIX,
+    SCRIPT_TYPE_PROMPT,
+    UI_TYPE_BUTTON,
+    UI_TYPE_INPUT,
+)
+from flaskr.service.lesson.models import AICourse, AILesson, AILessonScript
+
+from .fakes import BENCH_PROFILE_KEY
+
+# the scripts of a lesson cycle through a fixed text, an llm prompt and a
+# text input checked by the llm, the lessons are trial lessons, so a learner
+# goes through the course without an order
+SCRIPT_KINDS = ("fix", "prompt", "input")
+
+
+def _uuid() -> str:
+    return uuid.uuid4().hex
+
+
+def _make_script(lesson_id: str, index: int) -> AILessonScript:
+    kind = SCRIPT_KINDS[(index - 1) % len(SCRIPT_KINDS)]
+    script = AILessonScript(
+        script_id=_uuid(),
+        lesson_id=lesson_id,
+        script_name=f"{kind}-{index}",
+        script_index=index,
+        script_content_type=CONTENT_TYPE_TEXT,
+        script_ui_type=UI_TYPE_BUTTON,
+        script_ui_content="继续",
+        status=1,
+    )
+    if kind == "fix":
+        script.script_type = SCRIPT_TYPE_FIX
+        script.script_prompt = "这是一段固定的讲解内容，" * 10
+    elif kind == "prompt":
+        script.script_type = SCRIPT_TYPE_PROMPT
+        script.script_prompt = f"请给{{{BENCH_PROFILE_KEY}}}讲解第 {index} 个知识点"
+    else:
+        script.script_type = SCRIPT_TYPE_FIX
+        script.script_prompt = "你叫什么名字？"
+        script.script_ui_type = UI_TYPE_INPUT
+        script.script_ui_content = "请输入名字"
+        script.script_check_prompt = "检查名字是否合理：{input}"
+        script.script_profile = f"[{BENCH_PROFILE_KEY}]"
+    return script
+
+
+# chapters "00", "01", ... with the lessons "0001", "0002", ... under them
+def seed_course(
+    app: Flask, chapters: int, lessons: int, scripts: int, model: str
+) -> str:
+    with app.app_context():
+        course_id = _uuid()
+        db.session.add(
+            AICourse(
+                course_id=course_id,
+                course_name="benchmark",
+                course_default_model=model,
+                status=1,
+            )
+        )
+        lesson_index = 0
+        for chapter_no in range(chapters):
+            chapter_id = _uuid()
+            db.session.add(
+                AILesson(
+                    lesson_id=chapter_id,
+                    course_id=course_id,
+                    lesson_name=f"chapter {chapter_no}",
+                    lesson_no=f"{chapter_no:02d}",
+                    lesson_index=lesson_index,
+                    lesson_type=LESSON_TYPE_TRIAL,
+                    status=1,
+                )
+            )
+            for lesson_no in range(1, lessons + 1):
+                lesson_index += 1
+                lesson_id = _uuid()
+                db.session.add(
+                    AILesson(
+                        lesson_id=lesson_id,
+                        course_id=course_id,
+                        lesson_name=f"lesson {chapter_no}-{lesson_no}",
+                        lesson_no=f"{chapter_no:02d}{lesson_no:02d}",
+                        lesson_index=lesson_index,
+                        lesson_type=LESSON_TYPE_TRIAL,
+                        parent_id=chapter_id,
+                        status=1,
+                    )
+                )
+                for index in range(1, scripts + 1):
+                    db.session.add(_make_script(lesson_id, index))
+        db.session.commit()
+        return course_id
@@ -0,0 +1,142 @@
+import json
+import os
+from datetime import datetime
+
+from dotenv import dotenv_values
+
+# the app under test, run in a process of its own like a gunicorn worker:
+# its database is sqlite unless --database-url is given, its redis is
+# fakeredis unless --redis-host is given, and its llm and text check are
+# the fake servers of the benchmark
+
+ENV_EXAMPLE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../../../../docker/.env.example"
+)
+
+# the scrape token of the metrics the report is made of
+METRICS_TOKEN = "ai-shifu-bench"
+
+
+def _prepare(args):
+    if args.server == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+    workdir = os.path.dirname(os.path.abspath(args.ready_file))
+    # the settings of a deployment, then the ones of the benchmark
+    for key, value in dotenv_values(ENV_EXAMPLE).items():
+        if value:
+            os.environ.setdefault(key, value)
+    os.environ.update(
+        {
+            "SQLALCHEMY_DATABASE_URI": args.database_url,
+            "OPENAI_BASE_URL": args.llm_url + "/v1",
+            "OPENAI_API_KEY": "bench",
+            "CHECK_PROVIDER": "ilivedata",
+            "ILIVEDATA_PID": "bench",
+            "ILIVEDATA_SECRET_KEY": "bench",
+            "LOGGING_PATH": os.path.join(workdir, "ai-shifu-bench.log"),
+            "LOCAL_VECTOR_STORE_PATH": os.path.join(workdir, "vector_store"),
+            "LOG_LEVEL": args.log_level,
+            "FIX_OUTPUT_STREAM_MODE": args.stream_mode,
+            "REDIS_HOST": args.redis_host or "localhost",
+            "REDIS_PORT": str(args.redis_port),
+            "REDIS_DB": str(args.redis_db),
+            "REDIS_PASSWORD": "",
+            "REDIS_KEY_PREFIX": "ai-shifu-bench:",
+            "PATH_PREFIX": "/api",
+            "SQL_PROFILE_ENABLED": "true",
+            "METRICS_TOKEN": METRICS_TOKEN,
+        }
+    )
+    for key in ("MYSQL_HOST", "MYSQL_PORT", "MYSQL_DB", "MYSQL_USER"):
+        os.environ.pop(key, None)
+    if not args.redis_host:
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit(
+                'the benchmark needs fakeredis without --redis-host: pip install "fakeredis[lua]"'
+            )
+
+        import flaskr.dao
+
+        flaskr.dao.Redis = fakeredis.FakeRedis
+    if args.database_url.startswith("sqlite"):
+        from sqlalchemy.dialects.mysql import BIGINT
+        from sqlalchemy.ext.compiler import compiles
+
+        # the autoincrement ids of sqlite must be INTEGER PRIMARY KEY
+        @compiles(BIGINT, "sqlite")
+        def _compile_bigint(type_, compiler, **kwargs):
+            return "INTEGER"
+
+
+# sqlite only binds date objects to a date column, mysql takes the strings
+# some of the models have as the default of a date
+def _fix_sqlite_date_defaults(metadata):
+    from sqlalchemy import Date
+    from sqlalchemy.schema import ColumnDefault
+
+    for table in metadata.tables.values():
+        for column in table.columns:
+            default = column.default
+            if (
+                isinstance(column.type, Date)
+                and default is not None
+                and isinstance(default.arg, str)
+            ):
+                value = datetime.strptime(default.arg, "%Y-%m-%d").date()
+                column.default = ColumnDefault(value)
+                column.default._set_parent_with_dispatch(column)
+
+
+def _create_tables(app):
+    from flaskr.dao import db
+
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            _fix_sqlite_date_defaults(db.metadata)
+            db.create_all()
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+        else:
+            from flask_migrate import upgrade
+
+            upgrade("migrations")
+
+
+def serve(args):
+    _prepare(args)
+    from app import create_app
+
+    app = create_app()
+    _create_tables(app)
+
+    from flaskr.api.check import ilivedata
+
+    ilivedata.endpoint_url = args.check_url
+
+    from .seed import seed_course
+
+    course_id = seed_course(app, args.chapters, args.lessons, args.scripts, args.model)
+    from flaskr.dao import db
+
+    with app.app_context():
+        # a MYSQL_* setting of a .env file wins over --database-url
+        database = db.engine.url.render_as_string(hide_password=True)
+    with open(args.ready_file, "w") as f:
+        json.dump({"course_id": course_id, "database": database}, f)
+    app.logger.info(f"benchmark course {course_id} on port {args.port}")
+    if args.server == "gevent":
+        from gevent.pywsgi import WSGIServer
+
+        WSGIServer(("127.0.0.1", args.port), app, log=None).serve_forever()
+    else:
+        import logging
+
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        make_server("127.0.0.1", args.port, app, threaded=True).serve_forever()
@@ -0,0 +1,78 @@
+import uuid
+
+
+def test_count_tokens():
+    from flaskr.service.study.history import count_tokens
+
+    assert count_tokens("") == 0
+    assert count_tokens("你好") == 2
+    assert count_tokens("hello world!") == 3
+
+
+def test_build_ask_history(app, monkeypatch):
+    from flaskr.dao import db
+    from flaskr.dao import redis_client as redis
+    from flaskr.service.study.const import ROLE_STUDENT, ROLE_TEACHER, ROLE_UI
+    from flaskr.service.study.history import (
+        SUMMARY_LINE_CHARS,
+        _get_summary_key,
+        build_ask_history,
+        count_tokens,
+    )
+    from flaskr.service.study.models import AICourseLessonAttendScript
+
+    monkeypatch.setenv("ASK_HISTORY_TOKEN_BUDGET", "100000")
+    monkeypatch.setenv("ASK_HISTORY_SUMMARY_TOKENS", "0")
+    attend_id = uuid.uuid4().hex
+    turns = []
+    with app.app_context():
+        for index in range(12):
+            role = ROLE_STUDENT if index % 2 == 0 else ROLE_TEACHER
+            # the answers are markdown of several lines
+            content = f"turn {index}\n- point one\n- point two " + "x" * 80
+            turns.append(("学员" if role == ROLE_STUDENT else "老师", content))
+            db.session.add(
+                AICourseLessonAttendScript(
+                    log_id=uuid.uuid4().hex,
+                    attend_id=attend_id,
+                    script_id=uuid.uuid4().hex,
+                    script_index=index,
+                    script_role=role,
+                    script_content=content,
+                )
+            )
+        # the ui records are not turns
+        db.session.add(
+            AICourseLessonAttendScript(
+                log_id=uuid.uuid4().hex,
+                attend_id=attend_id,
+                script_id=uuid.uuid4().hex,
+                script_role=ROLE_UI,
+                script_content="ui",
+            )
+        )
+        db.session.commit()
+        lines = [f"{name}: {content}\n" for name, content in turns]
+        try:
+            # the last turns of the count
+            assert build_ask_history(app, attend_id, 5, "") == "".join(lines[-5:])
+
+            # the budget drops the oldest turns
+            budget = count_tokens(lines[-1]) + count_tokens(lines[-2])
+            monkeypatch.setenv("ASK_HISTORY_TOKEN_BUDGET", str(budget))
+            assert build_ask_history(app, attend_id, 5, "") == "".join(lines[-2:])
+
+            # the turns out of the window are folded into the summary, clipped
+            monkeypatch.setenv("ASK_HISTORY_SUMMARY_TOKENS", "100000")
+            history = build_ask_history(app, attend_id, 5, "")
+            summary = "".join(
+                f"{name}: {content[:SUMMARY_LINE_CHARS]}\n"
+                for name, content in turns[:10]
+            )
+            assert history == (
+                "更早的会话摘要:\n" + summary + "最近的会话:\n" + "".join(lines[-2:])
+            )
+        finally:
+            redis.delete(_get_summary_key(attend_id))
+            AICourseLessonAttendScript.query.filter_by(attend_id=attend_id).delete()
+            db.session.commit()
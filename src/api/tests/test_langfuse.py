@@ -0,0 +1,85 @@
+import time
+
+
+class _Observation:
+    def __init__(self, calls, name):
+        self.calls = calls
+        self.name = name
+
+    def span(self, **kwargs):
+        self.calls.append((self.name, "span", kwargs))
+        return _Observation(self.calls, kwargs.get("name"))
+
+    def update(self, **kwargs):
+        self.calls.append((self.name, "update", kwargs))
+
+    def end(self, **kwargs):
+        self.calls.append((self.name, "end", kwargs))
+
+
+class _Client:
+    def __init__(self):
+        self.calls = []
+
+    def trace(self, **kwargs):
+        self.calls.append(("client", "trace", kwargs))
+        return _Observation(self.calls, "trace")
+
+
+def _wait(exporter):
+    for _ in range(100):
+        if exporter.queue.empty():
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+
+def test_step_trace(app):
+    from flaskr.api.langfuse import StepTrace, TraceExporter
+
+    exporter = TraceExporter(app, 100)
+    client = _Client()
+    trace = StepTrace(exporter, client, user_id="u", input="hi")
+    span = trace.span(name="s")
+    span.end(output="o")
+    trace.append_output("a").append_output("b")
+    trace.update(metadata={"k": 1})
+    trace.flush()
+    _wait(exporter)
+    assert client.calls == [
+        ("client", "trace", {"id": trace.id, "user_id": "u", "input": "hi"}),
+        ("trace", "span", {"name": "s"}),
+        ("s", "end", {"output": "o"}),
+        ("trace", "update", {"metadata": {"k": 1}, "output": "ab"}),
+    ]
+
+
+def test_trace_sample(app, monkeypatch):
+    from flaskr.api import langfuse
+
+    monkeypatch.setenv("LANGFUSE_SAMPLE_RATE", "0")
+    monkeypatch.setenv("LANGFUSE_COURSE_SAMPLE_RATES", "c1=1")
+    assert not langfuse.is_trace_sampled("u", "c0", "s")
+    assert langfuse.is_trace_sampled("u", "c1", "s")
+    monkeypatch.setenv("LANGFUSE_USER_SAMPLE_RATES", "u=0")
+    assert not langfuse.is_trace_sampled("u", "c1", "s")
+    monkeypatch.setenv("LANGFUSE_SAMPLE_RATE", "0.5")
+    monkeypatch.setenv("LANGFUSE_COURSE_SAMPLE_RATES", "")
+    monkeypatch.setenv("LANGFUSE_USER_SAMPLE_RATES", "")
+    sampled = [langfuse.is_trace_sampled("u", "c", f"s{i}") for i in range(1000)]
+    assert 400 < sum(sampled) < 600
+    assert sampled == [
+        langfuse.is_trace_sampled("u", "c", f"s{i}") for i in range(1000)
+    ]
+
+
+def test_unsampled_trace(app, monkeypatch):
+    from flaskr.api import langfuse
+
+    monkeypatch.setenv("LANGFUSE_SAMPLE_RATE", "0")
+    trace = langfuse.start_trace(user_id="u", session_id="debug-b", input="hi")
+    assert isinstance(trace.id, str)
+    span = trace.span(name="s")
+    span.end(output="o")
+    trace.append_output("a").flush()
+    trace.end()
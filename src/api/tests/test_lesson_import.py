@@ -0,0 +1,98 @@
+import json
+import time
+import uuid
+
+
+SECTION_COUNT = 20
+RECORD_COUNT = 2000
+PAGE_SIZE = 100
+
+
+def _make_pages(run_id: str, content: str) -> list:
+    records = [
+        {
+            "record_id": f"{run_id}_{i}",
+            "fields": {
+                "小节": [
+                    {
+                        "text": f"section {i * SECTION_COUNT // RECORD_COUNT}",
+                        "type": "text",
+                    }
+                ],
+                "剧本简述": [{"text": f"block {i}", "type": "text"}],
+                "剧本类型": "固定剧本",
+                "模版内容": [{"text": f"{content} {i}", "type": "text"}],
+            },
+        }
+        for i in range(RECORD_COUNT)
+    ]
+    pages = []
+    for start in range(0, RECORD_COUNT, PAGE_SIZE):
+        end = start + PAGE_SIZE
+        pages.append(
+            {
+                "code": 0,
+                "data": {
+                    "items": records[start:end],
+                    "has_more": end < RECORD_COUNT,
+                    "page_token": str(end),
+                    "total": RECORD_COUNT,
+                },
+            }
+        )
+    return pages
+
+
+def test_update_lesson_info_from_dump(app, tmp_path):
+    from flaskr.dao import db
+    from flaskr.service.lesson.funs import update_lesson_info
+    from flaskr.service.lesson.models import AICourse, AILesson, AILessonScript
+
+    run_id = uuid.uuid4().hex
+    course_id = uuid.uuid4().hex
+    table_id = "tbl" + run_id[:12]
+    file_name = tmp_path / "lesson.json"
+    try:
+        for content in ["first", "second"]:
+            file_name.write_text(
+                json.dumps(_make_pages(run_id, content), ensure_ascii=False),
+                encoding="UTF-8",
+            )
+            start = time.perf_counter()
+            update_lesson_info(
+                app,
+                "doc",
+                table_id,
+                "view",
+                "benchmark",
+                1,
+                course_id=course_id,
+                file_name=str(file_name),
+            )
+            app.logger.info(
+                "import {} records: {:.2f}s".format(
+                    RECORD_COUNT, time.perf_counter() - start
+                )
+            )
+        with app.app_context():
+            lessons = AILesson.query.filter(AILesson.course_id == course_id).all()
+            assert len(lessons) == SECTION_COUNT + 1
+            scripts = AILessonScript.query.filter(
+                AILessonScript.lesson_id.in_([x.lesson_id for x in lessons])
+            ).all()
+            # the second import updates the scripts of the first one
+            assert len(scripts) == RECORD_COUNT
+            assert all(x.script_prompt.startswith("second") for x in scripts)
+            assert all(x.status == 1 for x in scripts)
+    finally:
+        with app.app_context():
+            lesson_ids = [
+                x.lesson_id
+                for x in AILesson.query.filter(AILesson.course_id == course_id)
+            ]
+            AILessonScript.query.filter(
+                AILessonScript.lesson_id.in_(lesson_ids)
+            ).delete(synchronize_session=False)
+            AILesson.query.filter(AILesson.course_id == course_id).delete()
+            AICourse.query.filter(AICourse.course_id == course_id).delete()
+            db.session.commit()
@@ -42,3 +42,89 @@ def test_llm_glm(app):
     for message in res:
         print(message)
     pass
+
+
+def test_model_registry(app):
+    with app.app_context():
+        from flaskr.api.llm import (
+            get_current_models,
+            get_model_provider,
+            refresh_models,
+        )
+
+        assert get_model_provider("ERNIE-3.5-8K") == "ernie"
+        assert get_model_provider("GLM-4") == "glm"
+        assert get_model_provider("not-a-model") is None
+        models = refresh_models(app)
+        assert models == get_current_models(app)
+        app.logger.info(models)
+
+
+def test_model_registry_load(app, monkeypatch):
+    import threading
+
+    with app.app_context():
+        from flaskr.api.llm import registry as registry_module
+        from flaskr.api.llm.registry import ModelRegistry
+
+        # the models of the test are not shared with the other processes
+        monkeypatch.setattr(registry_module, "redis", None)
+        calls = []
+        release = threading.Event()
+
+        def loader(app):
+            calls.append(1)
+            release.wait(5)
+            if len(calls) == 1:
+                raise ValueError("unavailable")
+            return {"remote-model": "remote-model"}
+
+        registry = ModelRegistry()
+        registry.register_provider("remote", loader=loader)
+        registry._load_from_cache = lambda app: False
+        registry.load_in_background(app)
+        # a lookup waits for the first load, which fails
+        release.set()
+        assert registry.get("remote-model") == (None, "remote-model")
+        assert registry.first_load.is_set()
+        assert registry.loaded_at == 0
+        assert registry.retry_at > 0
+
+        # the failed load is retried after its delay
+        registry.retry_at = 0
+        registry.get("remote-model")
+        for _ in range(50):
+            if not registry.loading:
+                break
+            threading.Event().wait(0.1)
+        assert len(calls) == 2
+        assert registry.loaded_at > 0
+        assert registry.get("remote-model") == ("remote", "remote-model")
+
+
+def test_chat_llm_dify_ttft(app, monkeypatch):
+    with app.app_context():
+        import flaskr.api.llm as llm_module
+        from flaskr.api.langfuse import langfuse_client
+        from flaskr.api.llm.dify import DifyChunkChatCompletionResponse
+        from flaskr.common.metrics import LLM_TTFT_SECONDS
+
+        def dify_chat_message(app, message, user_id):
+            for answer in ("你", "好"):
+                yield DifyChunkChatCompletionResponse(
+                    event="message", task_id="task", answer=answer
+                )
+
+        monkeypatch.setattr(llm_module, "dify_chat_message", dify_chat_message)
+        monkeypatch.setattr(llm_module, "get_model_provider", lambda model: "dify")
+        monkeypatch.setattr(
+            llm_module, "get_openai_client_and_model", lambda model: (None, model)
+        )
+        key = ("dify", "dify-test", "")
+        before = LLM_TTFT_SECONDS.values.get(key, [0])[-1]
+        messages = [{"role": "user", "content": "你好"}]
+        chunks = llm_module.chat_llm(
+            app, "user", langfuse_client.span(), "dify-test", messages
+        )
+        assert "".join(chunk.result for chunk in chunks) == "你好"
+        assert LLM_TTFT_SECONDS.values[key][-1] == before + 1
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_COUNT = 20
+CHUNK_DELAY = 0.01
+
+
+# a local openai compatible server streaming a fixed completion
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # the streams wait for each other, so they only end if they are
+        # all in flight at once
+        if self.server.barrier is not None:
+            self.server.barrier.wait()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(CHUNK_COUNT):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "fake",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": "字"},
+                        "finish_reason": "stop" if i == CHUNK_COUNT - 1 else None,
+                    }
+                ],
+            }
+            self._write("data: " + json.dumps(chunk) + "\n\n")
+            time.sleep(CHUNK_DELAY)
+        self._write("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(("%x\r\n" % len(data)).encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    barrier = None
+
+    # pooled connections are dropped by the client without a goodbye
+    def handle_error(self, request, client_address):
+        pass
+
+
+def start_fake_server():
+    server = FakeOpenAIServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}/v1".format(server.server_address[1])
+
+
+def test_provider_stream(app):
+    with app.app_context():
+        from flaskr.api.llm.stream import get_llm_provider
+
+        server, base_url = start_fake_server()
+        try:
+            url = base_url + "/chat/completions"
+            chunks = list(get_llm_provider(url).stream("POST", url, json={}))
+            assert len(chunks) == CHUNK_COUNT
+            assert json.loads(chunks[0])["choices"][0]["delta"]["content"] == "字"
+        finally:
+            server.shutdown()
+
+
+def test_concurrent_stream_benchmark(app):
+    from flaskr.api.llm.stream import create_openai_client
+
+    server, base_url = start_fake_server()
+    client = create_openai_client("fake", base_url)
+    results = []
+
+    def run_stream():
+        with app.app_context():
+            text = ""
+            for res in client.chat.completions.create(
+                model="fake", messages=[{"role": "user", "content": "hi"}], stream=True
+            ):
+                if res.choices and res.choices[0].delta.content:
+                    text += res.choices[0].delta.content
+            results.append(text)
+
+    try:
+        for concurrency in [1, 8, 32]:
+            results.clear()
+            server.barrier = threading.Barrier(concurrency, timeout=5)
+            start = time.perf_counter()
+            threads = [threading.Thread(target=run_stream) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cost = time.perf_counter() - start
+            app.logger.info(
+                "concurrent streams: {} cost: {:.2f}s streams/s: {:.1f}".format(
+                    concurrency, cost, concurrency / cost
+                )
+            )
+            assert len(results) == concurrency
+            assert all(len(text) == CHUNK_COUNT for text in results)
+    finally:
+        server.shutdown()
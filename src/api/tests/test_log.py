@@ -0,0 +1,105 @@
+import logging
+import time
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_request_queue_handler():
+    from flaskr.common.log import RequestQueueHandler, thread_local
+
+    target = _ListHandler()
+    handler = RequestQueueHandler([target], 100, 10)
+    logger = logging.getLogger("test_request_queue_handler")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    thread_local.request_id = "r1"
+    logger.info("%s", "x" * 20)
+    handler.stop()
+    record = target.records[0]
+    assert record.request_id == "r1"
+    assert record.getMessage() == "x" * 10 + "...(20 chars)"
+
+
+# a traceback of depth frames, each on a line of its own like a real stack
+def _deep_traceback(error: Exception, depth: int) -> str:
+    import traceback
+
+    source = "".join(
+        f"def call_{n}(error):\n    call_{n - 1}(error)\n" for n in range(1, depth)
+    )
+    scope = {}
+    source = "def call_0(error):\n    raise error\n" + source
+    exec(compile(source, "/app/flaskr/service/study/funcs.py", "exec"), scope)
+    try:
+        scope[f"call_{depth - 1}"](error)
+    except Exception:
+        return traceback.format_exc()
+
+
+def test_request_queue_handler_error():
+    from flaskr.common.log import RequestQueueHandler
+
+    target = _ListHandler()
+    handler = RequestQueueHandler([target], 100, 2000)
+    logger = logging.getLogger("test_request_queue_handler_error")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    message = _deep_traceback(ValueError("the cause"), 40)
+    assert len(message) > 2000
+    logger.error(message)
+    logger.info(message)
+    handler.stop()
+    assert target.records[0].getMessage() == message
+    assert target.records[1].getMessage().endswith(f"...({len(message)} chars)")
+
+
+def test_feishu_log_handler():
+    from flaskr.common.log import FeishuLogHandler
+
+    handler = FeishuLogHandler("http://localhost", rate_limit=2, dedup_seconds=60)
+    record = logging.makeLogRecord(
+        {"msg": "error a", "pathname": "a.py", "lineno": 1, "levelno": logging.ERROR}
+    )
+    now = time.monotonic()
+    assert handler._allow(record, now)
+    assert not handler._allow(record, now + 1)
+    record.msg = "error b"
+    assert handler._allow(record, now + 2)
+    record.msg = "error c"
+    assert not handler._allow(record, now + 3)
+    assert handler._allow(record, now + 61)
+
+
+def test_feishu_log_handler_traceback():
+    from flaskr.common.log import FeishuLogHandler
+
+    handler = FeishuLogHandler("http://localhost", max_length=1000)
+    sent = []
+    handler._start = lambda: None
+    handler.queue.put_nowait = sent.append
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # the error handler of the app logs every traceback from the same line
+    for error in (KeyError("course_id"), ZeroDivisionError("division by zero")):
+        record = logging.makeLogRecord(
+            {
+                "msg": _deep_traceback(error, 40),
+                "pathname": "route/common.py",
+                "lineno": 51,
+                "levelno": logging.ERROR,
+            }
+        )
+        handler.emit(record)
+    assert len(sent) == 2
+    assert sent[0]["content"]["text"].endswith("KeyError: 'course_id'\n\n")
+    assert sent[1]["content"]["text"].endswith(
+        "ZeroDivisionError: division by zero\n\n"
+    )
@@ -0,0 +1,45 @@
+def test_histogram_render():
+    from flaskr.common.metrics import Histogram
+
+    histogram = Histogram("test_seconds", "test", ("model",), (0.1, 1))
+    histogram.observe(0.05, model="a")
+    histogram.observe(0.5, model="a")
+    histogram.observe(5, model="a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{model="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{model="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{model="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{model="a"} 3' in lines
+
+
+def test_study_step():
+    from flaskr.common.metrics import (
+        STUDY_STAGE_SECONDS,
+        measure_llm,
+        measure_stage,
+        study_step,
+    )
+
+    with study_step("test-course") as step:
+        with measure_stage("rag"):
+            pass
+        with measure_llm("test", "test-model") as timer:
+            timer.chunk()
+            step.add("sse", 0.5)
+            timer.usage(1, 2)
+        # the sse writes made while streaming are not llm time
+        assert step.get("llm") < 0.5
+    stages = [key[0] for key in STUDY_STAGE_SECONDS.values if key[1] == "test-course"]
+    assert sorted(stages) == ["llm", "rag", "sse"]
+
+
+def test_metrics_token(app, test_client, monkeypatch):
+    url = app.config.get("PATH_PREFIX", "") + "/metrics"
+    monkeypatch.setenv("METRICS_TOKEN", "")
+    assert test_client.get(url).status_code == 404
+    monkeypatch.setenv("METRICS_TOKEN", "secret")
+    response = test_client.get(url, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    response = test_client.get(url, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
@@ -126,3 +126,20 @@ def test_delete_profile_item(test_client, app, token):
     app.logger.info(response.data)
     profile_item_definition_list = json.loads(response.data).get("data")
     assert len(profile_item_definition_list) == original_length - 1
+
+
+def test_user_profile_snapshot(app):
+    with app.app_context():
+        from flaskr.service.profile.funcs import (
+            get_user_profiles,
+            save_user_profile,
+        )
+
+        user_id = "test_user_profile_snapshot"
+        save_user_profile(user_id, "snapshot_key", "v1", 1)
+        assert get_user_profiles(app, user_id, "")["snapshot_key"] == "v1"
+        save_user_profile(user_id, "snapshot_key", "v2", 1)
+        profiles = get_user_profiles(app, user_id, "", ["snapshot_key"])
+        assert profiles == {"snapshot_key": "v2"}
+        profiles["input"] = "input"
+        assert "input" not in get_user_profiles(app, user_id, "")
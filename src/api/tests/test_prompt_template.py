@@ -0,0 +1,108 @@
+import time
+
+# prompts taken from published courses
+PROMPTS = [
+    """你好， {nickname}，欢迎来到 Python 编程学习。""",
+    """你是一位 AI 编程老师，学员的称呼是 {nickname}，背景是 {user_background}。
+请用{style}的风格，结合学员的背景，向学员讲解什么是变量。
+不要超过 200 字。""",
+    """学员的回答是：{input}
+如果学员的回答和「做饭」相关，输出 {{"result":"ok"}}，否则用 {nickname} 称呼学员并引导学员重新回答。""",
+    """1对1向学员讲解可以把不懂的事情，交还给 AI 让它解释和处理。
+
+`代码`是：
+```python
+import os
+
+def batch_rename(folder_path, new_name_format):
+    files = os.listdir(folder_path)
+    for index, filename in enumerate(files):
+        new_name = new_name_format.format(index + 1)
+        os.rename(filename, new_name)
+
+    print(f"成功重命名了 {{len(files)}} 个文件。")
+```
+用 {nickname} 称呼学员，以{style}的风格讲下去。""",
+]
+
+PROFILES = {
+    "nickname": "小明",
+    "user_background": "产品经理",
+    "style": "幽默",
+    "input": "我想学做饭",
+}
+
+
+def format_with_langchain(template: str) -> str:
+    from langchain.prompts import PromptTemplate
+    from flaskr.util.prompt_template import extract_variables
+
+    prompt_template_lc = PromptTemplate.from_template(template)
+    fmt_keys = {key: PROFILES.get(key, key) for key in extract_variables(template)}
+    return prompt_template_lc.format(**fmt_keys)
+
+
+def format_with_cache(template: str) -> str:
+    from flaskr.util.prompt_template import get_prompt_template
+
+    prompt_template = get_prompt_template(template)
+    fmt_keys = {key: PROFILES.get(key, key) for key in prompt_template.variables}
+    return prompt_template.format(fmt_keys)
+
+
+def test_prompt_template_same_as_langchain(app):
+    with app.app_context():
+        for prompt in PROMPTS:
+            assert format_with_cache(prompt) == format_with_langchain(prompt)
+            assert format_with_cache(prompt) == format_with_langchain(prompt)
+
+
+def test_prompt_template_benchmark(app, monkeypatch):
+    from collections import OrderedDict
+
+    from flaskr.util import prompt_template
+
+    # each template is parsed once, then formatted from the cache
+    parsed = []
+
+    class CompiledPromptTemplate(prompt_template.CompiledPromptTemplate):
+        def __init__(self, template: str):
+            parsed.append(template)
+            super().__init__(template)
+
+    monkeypatch.setattr(prompt_template, "_templates", OrderedDict())
+    monkeypatch.setattr(
+        prompt_template, "CompiledPromptTemplate", CompiledPromptTemplate
+    )
+    with app.app_context():
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for prompt in PROMPTS:
+                format_with_langchain(prompt)
+        langchain_cost = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for prompt in PROMPTS:
+                format_with_cache(prompt)
+        cache_cost = time.perf_counter() - start
+
+        count = rounds * len(PROMPTS)
+        app.logger.info(
+            "prompt format langchain: {:.0f}/s cached: {:.0f}/s".format(
+                count / langchain_cost, count / cache_cost
+            )
+        )
+        assert parsed == PROMPTS
+        assert prompt_template.get_prompt_template(PROMPTS[0]) is (
+            prompt_template.get_prompt_template(PROMPTS[0])
+        )
+
+        # the least recently used templates are evicted
+        monkeypatch.setenv("PROMPT_TEMPLATE_CACHE_SIZE", "2")
+        prompt_template.get_prompt_template("{nickname}")
+        assert list(prompt_template._templates) == [PROMPTS[0], "{nickname}"]
+        format_with_cache(PROMPTS[1])
+        assert parsed == PROMPTS + ["{nickname}", PROMPTS[1]]
+        assert list(prompt_template._templates) == ["{nickname}", PROMPTS[1]]
@@ -0,0 +1,341 @@
+import io
+import threading
+import time
+
+
+# the searches of the knowledge bases wait for each other at the barrier,
+# so a retrieval only ends if they are all in flight at once
+class FakeMilvusClient:
+    def __init__(self, parties: int):
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def search(self, collection_name, data, limit, **kwargs):
+        self.barrier.wait()
+        return [
+            [
+                {
+                    "id": f"{collection_name}-{i}",
+                    "distance": 0.9
+                    - i * 0.1
+                    - (0.05 if collection_name == "kb2" else 0),
+                    "entity": {"text": f"{collection_name}-{i}"},
+                }
+                for i in range(limit)
+            ]
+        ]
+
+
+def test_retrieval_kbs(app, monkeypatch):
+    from flaskr.service.rag import funs
+    from flaskr.service.rag.vector_store import MilvusVectorStore
+
+    embedding_calls = []
+    vector_store = MilvusVectorStore(FakeMilvusClient(4))
+    monkeypatch.setattr(funs, "get_vector_store", lambda: vector_store)
+    monkeypatch.setattr(
+        funs,
+        "get_vector_list",
+        lambda text_list, embedding_model: embedding_calls.append(text_list)
+        or [[0.1] * 4],
+    )
+    with app.app_context():
+        start = time.time()
+        result = funs.retrieval_kbs(["kb1", "kb2", "kb3", "kb4"], "query", "", 3, [])
+        cost = time.time() - start
+    app.logger.info(f"retrieval of 4 knowledge bases {cost:.3f}s {result.timings}")
+    assert len(embedding_calls) == 1
+    assert [hit["id"] for hit in result.hits] == ["kb1-0", "kb3-0", "kb4-0"]
+    assert result.text == "kb1-0\n\nkb3-0\n\nkb4-0"
+
+
+def test_embedding_cache(app):
+    import uuid
+    from flaskr.service.rag.embedding import EmbeddingCache
+
+    embed_calls = []
+
+    def embed(text_list, embedding_model):
+        embed_calls.append(text_list)
+        return [[float(len(text)), 0.5, 0.25] for text in text_list]
+
+    embedding_model = "test-" + uuid.uuid4().hex
+    with app.app_context():
+        cache = EmbeddingCache()
+        vectors = cache.get_vectors(["a  b", "c", "a b"], embedding_model, embed)
+        assert vectors == [[4.0, 0.5, 0.25], [1.0, 0.5, 0.25], [4.0, 0.5, 0.25]]
+        assert cache.get_vectors(["c"], embedding_model, embed) == [[1.0, 0.5, 0.25]]
+        assert len(embed_calls) == 1
+        # another process hits the redis tier
+        other_cache = EmbeddingCache()
+        assert other_cache.get_vectors(["c"], embedding_model, embed) == [
+            [1.0, 0.5, 0.25]
+        ]
+        assert len(embed_calls) == 1
+        assert cache.get_stats()["lru_hits"] == 1
+        assert other_cache.get_stats()["redis_hits"] == 1
+
+
+def test_kb_file_ingest_resume(app, monkeypatch):
+    import io
+    import uuid
+    from flaskr.service.rag import funs
+    from flaskr.service.rag.models import KB_FILE_STATUS_DONE
+    from flaskr.service.rag.vector_store import MilvusVectorStore
+
+    # unique texts, so no embedding is served from the cache of an earlier run
+    run_id = uuid.uuid4().hex
+
+    class FakeBucket:
+        def get_object(self, file_key):
+            return io.BytesIO(
+                "\n\n".join(f"段落 {i} {run_id}" for i in range(10)).encode()
+            )
+
+    class FakeMilvus:
+        def __init__(self):
+            self.rows = {}
+
+        def upsert(self, collection_name, data):
+            for row in data:
+                self.rows[row["id"]] = row
+
+    embed_calls = []
+
+    def embed(text_list, embedding_model):
+        embed_calls.append(text_list)
+        if len(embed_calls) == 2:
+            raise Exception("embedding service unavailable")
+        return [[float(len(text)), 1.0] for text in text_list]
+
+    milvus = FakeMilvus()
+    vector_store = MilvusVectorStore(milvus)
+    monkeypatch.setattr(funs, "get_vector_store", lambda: vector_store)
+    monkeypatch.setattr(funs, "bucket", FakeBucket(), raising=False)
+    monkeypatch.setattr(funs, "embed_text_list", embed)
+    monkeypatch.setattr(funs, "enqueue_kb_file_job", lambda app, file_id: None)
+    monkeypatch.setenv("KB_INGEST_BATCH_SIZE", "4")
+    monkeypatch.setenv("KB_INGEST_EMBEDDING_CONCURRENCY", "1")
+
+    job = funs.kb_file_add(app, "test_kb", "test.txt", "test", "", "\n\n", 500, 50, "")
+    funs.ingest_kb_file(app, job["job_id"])
+    status = funs.get_kb_file_status(app, job["job_id"])
+    assert status["retry_count"] == 1
+    assert status["chunk_done"] == 4
+    funs.ingest_kb_file(app, job["job_id"])
+    status = funs.get_kb_file_status(app, job["job_id"])
+    assert status["status"] == KB_FILE_STATUS_DONE
+    assert status["chunk_done"] == status["chunk_count"] == 10
+    assert len(milvus.rows) == 10
+
+
+def test_kb_file_ingest_lock(app, monkeypatch):
+    import uuid
+    from flaskr.dao import db
+    from flaskr.service.rag import funs
+    from flaskr.service.rag.ingest import get_kb_file_lock
+    from flaskr.service.rag.models import (
+        KB_FILE_STATUS_DONE,
+        KB_FILE_STATUS_PENDING,
+        KB_FILE_STATUS_PROCESSING,
+        KnowledgeFile,
+    )
+    from flaskr.service.rag.vector_store import MilvusVectorStore
+
+    run_id = uuid.uuid4().hex
+
+    class FakeBucket:
+        def get_object(self, file_key):
+            return io.BytesIO(f"段落 {run_id}".encode())
+
+    class FakeMilvus:
+        def upsert(self, collection_name, data):
+            pass
+
+    embed_calls = []
+
+    def embed(text_list, embedding_model):
+        embed_calls.append(text_list)
+        return [[1.0, 0.0] for _ in text_list]
+
+    enqueued = []
+    vector_store = MilvusVectorStore(FakeMilvus())
+    monkeypatch.setattr(funs, "get_vector_store", lambda: vector_store)
+    monkeypatch.setattr(funs, "bucket", FakeBucket(), raising=False)
+    monkeypatch.setattr(funs, "embed_text_list", embed)
+    monkeypatch.setattr(
+        funs, "enqueue_kb_file_job", lambda app, file_id: enqueued.append(file_id)
+    )
+
+    job = funs.kb_file_add(app, "test_kb", "test.txt", "test", "", "\n\n", 500, 50, "")
+    file_id = job["job_id"]
+    with app.app_context():
+        # another worker is ingesting the file
+        lock = get_kb_file_lock(file_id)
+        assert lock.acquire(blocking=False)
+        funs.ingest_kb_file(app, file_id)
+        assert embed_calls == []
+        assert funs.get_kb_file_status(app, file_id)["status"] == KB_FILE_STATUS_PENDING
+        KnowledgeFile.query.filter_by(file_id=file_id).update(
+            {"status": KB_FILE_STATUS_PROCESSING}
+        )
+        db.session.commit()
+        enqueued.clear()
+        status = funs.kb_file_retry(app, file_id)
+        assert status["status"] == KB_FILE_STATUS_PROCESSING
+        assert enqueued == []
+        # the worker crashed and its lock expired
+        lock.release()
+        status = funs.kb_file_retry(app, file_id)
+        assert status["status"] == KB_FILE_STATUS_PENDING
+        assert enqueued == [file_id]
+    funs.ingest_kb_file(app, file_id)
+    assert funs.get_kb_file_status(app, file_id)["status"] == KB_FILE_STATUS_DONE
+    assert len(embed_calls) == 1
+    with app.app_context():
+        assert not get_kb_file_lock(file_id).locked()
+
+
+def test_vector_codec(app):
+    import json
+    import numpy as np
+    from flaskr.service.rag.vector_codec import (
+        encode_vector,
+        decode_vector,
+        decode_vectors,
+    )
+
+    dim = 1024
+    vectors = np.random.default_rng(0).uniform(-1, 1, (1000, dim)).tolist()
+
+    data = encode_vector(vectors[0], "float32")
+    assert len(data) == 1 + dim * 4
+    assert np.array_equal(decode_vector(data), np.float32(vectors[0]))
+    assert len(encode_vector(vectors[0], "float16")) == 1 + dim * 2
+    assert np.allclose(
+        decode_vector(encode_vector(vectors[0], "float16")), vectors[0], atol=1e-3
+    )
+    assert len(encode_vector(vectors[0], "int8")) == 1 + 4 + dim
+    assert np.allclose(
+        decode_vector(encode_vector(vectors[0], "int8")), vectors[0], atol=1e-2
+    )
+    # the json rows written before the binary column
+    assert np.allclose(decode_vector(json.dumps(vectors[0])), vectors[0])
+
+    for codec in ["float32", "float16", "int8"]:
+        data_list = [encode_vector(vector, codec) for vector in vectors]
+        matrix = decode_vectors(data_list)
+        assert matrix.shape == (len(vectors), dim)
+        assert np.array_equal(matrix[3], decode_vector(data_list[3]))
+    mixed = decode_vectors([encode_vector(vectors[0]), json.dumps(vectors[1])])
+    assert np.allclose(mixed, np.float32(vectors[:2]))
+
+    json_list = [json.dumps(vector) for vector in vectors]
+    start = time.perf_counter()
+    json_matrix = np.asarray([json.loads(x) for x in json_list], dtype=np.float32)
+    json_cost = time.perf_counter() - start
+    data_list = [encode_vector(vector, "float32") for vector in vectors]
+    start = time.perf_counter()
+    matrix = decode_vectors(data_list)
+    binary_cost = time.perf_counter() - start
+    json_size = sum(len(x) for x in json_list)
+    binary_size = sum(len(x) for x in data_list)
+    app.logger.info(
+        "json: {} bytes {:.4f}s binary: {} bytes {:.4f}s".format(
+            json_size, json_cost, binary_size, binary_cost
+        )
+    )
+    assert np.array_equal(matrix, json_matrix)
+    # the float32 rows are a flag byte and 4 bytes a dimension, the json
+    # text of the same vectors is several times larger
+    assert binary_size == len(vectors) * (1 + dim * 4)
+    assert binary_size * 3 < json_size
+
+
+def test_local_vector_store(app, tmp_path):
+    from flaskr.service.rag.vector_store import LocalVectorStore
+
+    with app.app_context():
+        store = LocalVectorStore(str(tmp_path))
+        store.create_collection("kb1", 3)
+        store.upsert(
+            "kb1",
+            [
+                {"id": "a", "vector": [1, 0, 0], "text": "a", "file_id": "f1"},
+                {"id": "b", "vector": [0, 1, 0], "text": "b", "file_id": "f1"},
+                {"id": "c", "vector": [1, 1, 0], "text": "c", "file_id": "f2"},
+            ],
+        )
+        hits = store.search("kb1", [1, 0.1, 0], "", 2, ["text"])
+        assert [hit["id"] for hit in hits] == ["a", "c"]
+        assert hits[0]["entity"] == {"text": "a"}
+        assert abs(hits[0]["distance"] - 0.995) < 0.001
+        hits = store.search("kb1", [1, 0.1, 0], 'file_id == "f2"', 2, [])
+        assert [hit["id"] for hit in hits] == ["c"]
+        hits = store.search(
+            "kb1", [1, 0, 0], 'file_id in ["f1"] and text != "a"', 5, []
+        )
+        assert [hit["id"] for hit in hits] == ["b"]
+        # an upsert replaces the chunk of the same id
+        store.upsert("kb1", [{"id": "a", "vector": [0, 0, 1], "text": "a2"}])
+        hits = store.search("kb1", [0, 0, 1], "", 5, ["text"])
+        assert len(hits) == 3
+        assert hits[0]["entity"]["text"] == "a2"
+
+        # the collections are loaded from disk by a new store,
+        # and a store sees the writes of the other stores
+        other = LocalVectorStore(str(tmp_path))
+        assert other.load() == ["kb1"]
+        store.upsert("kb1", [{"id": "d", "vector": [0, 1, 1], "text": "d"}])
+        hits = other.search("kb1", [0, 1, 1], "", 1, ["text"])
+        assert hits[0]["entity"]["text"] == "d"
+        other.drop_collection("kb1")
+        assert not store.has_collection("kb1")
+
+
+# recall and latency of the local store against the exact cosine top k,
+# the results milvus returns with a flat index
+def test_local_vector_store_benchmark(app, tmp_path, monkeypatch):
+    import numpy as np
+    from flaskr.service.rag.vector_store import LocalVectorStore
+
+    rng = np.random.default_rng(0)
+    count, dim, query_count, limit = 50000, 128, 50, 10
+    centers = rng.normal(size=(200, dim))
+    corpus = centers[rng.integers(200, size=count)] + rng.normal(
+        scale=0.6, size=(count, dim)
+    )
+    queries = centers[rng.integers(200, size=query_count)] + rng.normal(
+        scale=0.6, size=(query_count, dim)
+    )
+    normalized = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    expected = [
+        set(np.argsort(-(normalized @ query))[:limit].tolist()) for query in queries
+    ]
+
+    with app.app_context():
+        store = LocalVectorStore(str(tmp_path))
+        store.create_collection("kb", dim)
+        for start in range(0, count, 1000):
+            store.upsert(
+                "kb",
+                [
+                    {"id": str(i), "vector": corpus[i].tolist()}
+                    for i in range(start, min(count, start + 1000))
+                ],
+            )
+        for index, min_rows in [("flat", "0"), ("ivf", "1")]:
+            monkeypatch.setenv("LOCAL_VECTOR_ANN_MIN_ROWS", min_rows)
+            store.search("kb", queries[0].tolist(), "", limit, [])
+            recall = 0
+            start = time.perf_counter()
+            for query, expected_ids in zip(queries, expected):
+                hits = store.search("kb", query.tolist(), "", limit, [])
+                recall += len(expected_ids & {int(hit["id"]) for hit in hits}) / limit
+            cost = (time.perf_counter() - start) / query_count * 1000
+            recall /= query_count
+            app.logger.info(
+                "local vector store {}: {:.2f}ms/query recall@{}: {:.3f}".format(
+                    index, cost, limit, recall
+                )
+            )
+            assert recall >= (0.99 if index == "flat" else 0.9)
@@ -0,0 +1,80 @@
+import time
+import uuid
+
+
+def test_add_risk_control_result(app):
+    from flaskr.dao import db
+    from flaskr.service.check_risk import add_risk_control_result
+    from flaskr.service.check_risk.models import RiskControlResult
+    from flaskr.service.check_risk.writer import flush_risk_control_results
+
+    chat_id = uuid.uuid4().hex
+    start = time.perf_counter()
+    for i in range(100):
+        add_risk_control_result(
+            app, chat_id, "user", f"text {i}", "test", 1, "{}", 1, "check_text"
+        )
+    app.logger.info(
+        "add 100 results: {:.2f}ms".format((time.perf_counter() - start) * 1000)
+    )
+    # the background writer may have taken them already
+    flush_risk_control_results(app)
+    with app.app_context():
+        try:
+            for _ in range(50):
+                count = RiskControlResult.query.filter_by(chat_id=chat_id).count()
+                if count == 100:
+                    break
+                time.sleep(0.1)
+            assert count == 100
+        finally:
+            RiskControlResult.query.filter_by(chat_id=chat_id).delete()
+            db.session.commit()
+
+
+def test_risk_control_dead_letter(app, tmp_path, monkeypatch):
+    import json
+    from datetime import datetime
+
+    from flaskr.dao import db
+    from flaskr.service.check_risk import writer
+    from flaskr.service.check_risk.models import RiskControlResult
+
+    spill_path = tmp_path / "risk.jsonl"
+    monkeypatch.setenv("RISK_CONTROL_SPILL_PATH", str(spill_path))
+    chat_id = uuid.uuid4().hex
+    now = datetime.now()
+
+    def make_row(text):
+        return {
+            "chat_id": chat_id,
+            "user_id": "user",
+            "text": text,
+            "check_vendor": "test",
+            "check_result": 1,
+            "check_resp": "{}",
+            "is_pass": 1,
+            "check_strategy": "check_text",
+            "created": now,
+            "updated": now,
+        }
+
+    # a spilled batch with a row the database rejects and a broken line
+    writer._spill(app, [make_row("a"), make_row(None), make_row("b")])
+    with open(spill_path, "a", encoding="UTF-8") as f:
+        f.write("{broken\n")
+    writer._replay_spill(app)
+    with app.app_context():
+        try:
+            texts = [r.text for r in RiskControlResult.query.filter_by(chat_id=chat_id)]
+            assert sorted(texts) == ["a", "b"]
+        finally:
+            RiskControlResult.query.filter_by(chat_id=chat_id).delete()
+            db.session.commit()
+    assert not spill_path.exists()
+    with open(str(spill_path) + ".dead", encoding="UTF-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "{broken"
+    dead = json.loads(lines[1])
+    assert dead["text"] is None and dead["error"]
+    assert len(lines) == 2
@@ -0,0 +1,126 @@
+import time
+import uuid
+
+
+OUTLINE_COUNT = 50
+BLOCK_COUNT = 100
+
+
+def test_publish_shifu_benchmark(app):
+    from flaskr.dao import db
+    from flaskr.service.lesson.const import (
+        STATUS_DRAFT,
+        STATUS_PUBLISH,
+        STATUS_HISTORY,
+        STATUS_DELETE,
+        STATUS_TO_DELETE,
+    )
+    from flaskr.service.lesson.models import AICourse, AILesson, AILessonScript
+    from flaskr.service.shifu.publish import publish_shifu_draft
+
+    shifu_id = uuid.uuid4().hex
+    lesson_ids = [uuid.uuid4().hex for _ in range(OUTLINE_COUNT)]
+    with app.app_context():
+        db.session.add(
+            AICourse(course_id=shifu_id, course_name="benchmark", status=STATUS_DRAFT)
+        )
+        db.session.bulk_insert_mappings(
+            AILesson,
+            [
+                {
+                    "course_id": shifu_id,
+                    "lesson_id": lesson_id,
+                    "lesson_name": f"outline {i}",
+                    "lesson_no": str(i).zfill(2),
+                    "status": STATUS_DRAFT,
+                }
+                for i, lesson_id in enumerate(lesson_ids)
+            ],
+        )
+        db.session.bulk_insert_mappings(
+            AILessonScript,
+            [
+                {
+                    "lesson_id": lesson_id,
+                    "script_id": uuid.uuid4().hex,
+                    "script_name": f"block {j}",
+                    "script_index": j,
+                    "status": STATUS_DRAFT,
+                }
+                for lesson_id in lesson_ids
+                for j in range(BLOCK_COUNT)
+            ],
+        )
+        db.session.commit()
+
+        try:
+            shifu = AICourse.query.filter_by(course_id=shifu_id).first()
+            start = time.perf_counter()
+            report = publish_shifu_draft(app, "benchmark", shifu)
+            cost = time.perf_counter() - start
+            app.logger.info(
+                "publish {} blocks: {:.2f}s {}".format(
+                    OUTLINE_COUNT * BLOCK_COUNT, cost, report.__json__()
+                )
+            )
+            assert report.outlines["published"] == OUTLINE_COUNT
+            assert report.blocks["published"] == OUTLINE_COUNT * BLOCK_COUNT
+            assert (
+                AILessonScript.query.filter(
+                    AILessonScript.lesson_id.in_(lesson_ids),
+                    AILessonScript.status == STATUS_PUBLISH,
+                ).count()
+                == OUTLINE_COUNT * BLOCK_COUNT
+            )
+
+            # edit one block and delete another, then publish again
+            blocks = (
+                AILessonScript.query.filter(
+                    AILessonScript.lesson_id == lesson_ids[0],
+                    AILessonScript.status == STATUS_PUBLISH,
+                )
+                .order_by(AILessonScript.script_index)
+                .limit(2)
+                .all()
+            )
+            edited = blocks[0].clone()
+            edited.script_name = "edited"
+            edited.status = STATUS_DRAFT
+            deleted = blocks[1].clone()
+            deleted.status = STATUS_TO_DELETE
+            db.session.add_all([edited, deleted])
+            db.session.commit()
+
+            report = publish_shifu_draft(app, "benchmark", shifu)
+            app.logger.info(f"publish again: {report.__json__()}")
+            assert report.blocks["published"] == 1
+            assert report.blocks["history"] == 1
+            assert report.blocks["deleted"] == 2
+            assert report.blocks["unchanged"] == OUTLINE_COUNT * BLOCK_COUNT - 2
+            statuses = [
+                x.status
+                for x in AILessonScript.query.filter_by(script_id=blocks[0].script_id)
+                .order_by(AILessonScript.id)
+                .all()
+            ]
+            # the drafts stay, each publish adds a published copy
+            assert statuses == [
+                STATUS_DRAFT,
+                STATUS_HISTORY,
+                STATUS_DRAFT,
+                STATUS_PUBLISH,
+            ]
+            statuses = [
+                x.status
+                for x in AILessonScript.query.filter_by(script_id=blocks[1].script_id)
+                .order_by(AILessonScript.id)
+                .all()
+            ]
+            assert statuses == [STATUS_DRAFT, STATUS_DELETE, STATUS_DELETE]
+        finally:
+            AILessonScript.query.filter(
+                AILessonScript.lesson_id.in_(lesson_ids)
+            ).delete(synchronize_session=False)
+            AILesson.query.filter_by(course_id=shifu_id).delete()
+            AICourse.query.filter_by(course_id=shifu_id).delete()
+            db.session.commit()
@@ -6,3 +6,38 @@ def test_get_original_outline_tree(app):
     with app.app_context():
         data = get_original_outline_tree(app, "282851210b7d4ecbb46e8a39b938fd78")
         dump(data)
+
+
+def test_outline_tree_index(app):
+    from flaskr.service.lesson.models import AILesson, AILessonScript
+    from flaskr.service.shifu.utils import OutlineTreeIndex, BlockIndex
+
+    outlines = [
+        AILesson(lesson_id=f"lesson_{no}", lesson_no=no)
+        for no in ["01", "0101", "0102", "010101", "02", "0201"]
+    ]
+    with app.app_context():
+        index = OutlineTreeIndex(app, "shifu", (0, 0), outlines)
+    assert [node.outline_id for node in index.tree] == ["lesson_01", "lesson_02"]
+    assert index.get_sub_outline_ids("lesson_01") == [
+        "lesson_01",
+        "lesson_0101",
+        "lesson_0102",
+        "lesson_010101",
+    ]
+    assert index.get_sub_outline_ids("lesson_0201") == ["lesson_0201"]
+    assert index.get_sub_outline_ids("missing") == []
+
+    blocks = [
+        AILessonScript(script_id="b", lesson_id="lesson_0101", script_index=2),
+        AILessonScript(script_id="a", lesson_id="lesson_0101", script_index=1),
+        AILessonScript(script_id="c", lesson_id="lesson_0102", script_index=1),
+    ]
+    block_index = BlockIndex(blocks)
+    assert [b.script_id for b in block_index.get_outline_blocks("lesson_0101")] == [
+        "a",
+        "b",
+    ]
+    assert block_index.get_outline_blocks("lesson_01") == []
+    assert block_index.get_block("c") is blocks[2]
+    assert block_index.get_block("d") is None
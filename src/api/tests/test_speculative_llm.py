@@ -0,0 +1,38 @@
+import time
+
+
+class _Span:
+    def __init__(self):
+        self.events = []
+
+    def event(self, **kwargs):
+        self.events.append(kwargs)
+
+
+def test_speculative_llm_stream(app):
+    from flaskr.service.study.input_funcs import SpeculativeLLMStream
+
+    state = {}
+
+    def make_stream():
+        try:
+            time.sleep(0.2)
+            for i in range(5):
+                yield i
+        finally:
+            state["closed"] = True
+
+    span = _Span()
+    stream = SpeculativeLLMStream(app, span, make_stream)
+    # the check takes as long as the first token
+    time.sleep(0.2)
+    stream.checked(True)
+    assert list(stream) == [0, 1, 2, 3, 4]
+    assert span.events[0]["name"] == "speculative_llm"
+    app.logger.info(f"speculative llm: {span.events[0]['output']}")
+
+    state.clear()
+    stream = SpeculativeLLMStream(app, _Span(), make_stream)
+    stream.checked(False)
+    stream.thread.join(timeout=5)
+    assert state["closed"]
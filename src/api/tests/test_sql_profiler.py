@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+def test_sql_profile(app):
+    from flaskr.dao import db
+    from flaskr.dao.profiler import (
+        end_sql_profile,
+        get_sql_metrics,
+        record_sql_profile,
+        start_sql_profile,
+    )
+
+    with app.app_context():
+        start_sql_profile("GET /test/sql-profile")
+        for i in range(3):
+            db.session.execute(text("select :i"), {"i": i})
+        db.session.execute(text("select 1 + 1"))
+        profile = end_sql_profile()
+    assert profile.count == 4
+    assert profile.duplicates() == 2
+    assert profile.top_statement()[1] == 3
+    record_sql_profile(app, profile)
+    metrics = get_sql_metrics()["GET /test/sql-profile"]
+    assert metrics["queries"] == 4
+    assert metrics["duplicates"] == 2
+
+
+def test_sql_profile_error(app):
+    from flaskr.dao import db
+    from flaskr.dao.profiler import end_sql_profile, start_sql_profile
+
+    with app.app_context():
+        start_sql_profile("GET /test/sql-profile-error")
+        with pytest.raises(DBAPIError):
+            db.session.execute(text("select * from no_such_table"))
+        db.session.rollback()
+        db.session.execute(text("select 1"))
+        profile = end_sql_profile()
+    assert profile.statements == {"select * from no_such_table": 1, "select 1": 1}
+
+
+def test_sql_metrics_token(app, test_client, monkeypatch):
+    url = app.config.get("PATH_PREFIX", "") + "/metrics/sql"
+    monkeypatch.setenv("METRICS_TOKEN", "")
+    assert test_client.get(url).status_code == 404
+    monkeypatch.setenv("METRICS_TOKEN", "secret")
+    assert test_client.get(url).status_code == 401
+    response = test_client.get(url, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    response = test_client.get(url, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert json.loads(response.data)["code"] == 0
@@ -0,0 +1,22 @@
+def test_split_text_chunks(app):
+    from flaskr.service.study.utils import split_text_chunks
+
+    text = (
+        "你好，欢迎来到 Python 编程学习。This is a test sentence. 我们开始吧！\n" * 20
+    )
+    with app.app_context():
+        for mode in ["char", "word", "sentence", "instant"]:
+            chunks = split_text_chunks(text, mode, 16)
+            assert "".join(chunks) == text
+            app.logger.info(f"{mode}: {len(text)} chars, {len(chunks)} chunks")
+        assert len(split_text_chunks(text, "word", 16)) * 10 < len(text)
+        assert len(split_text_chunks(text, "instant", 16)) == 1
+
+
+def test_make_script_dto_chunks(app):
+    from flaskr.service.study.utils import make_script_dto_chunks, set_stream_mode
+
+    with app.app_context():
+        set_stream_mode("instant")
+        frames = list(make_script_dto_chunks(app, "text", "你好，世界", "script_id"))
+        assert len(frames) == 1
@@ -1,3 +1,9 @@
+import json
+import uuid
+
+import pytest
+
+
 def test_study_record(app):
     from flaskr.service.study import get_study_record
 
@@ -10,3 +16,121 @@ def test_study_record(app):
             app, user_id, lesson_id="4eb763e98ba140ffaae83eaa8e9ba198"
         )
         app.logger.info("res:{}".format(make_common_response(res)))
+
+
+@pytest.fixture
+def study_logs(app):
+    from flaskr.dao import db
+    from flaskr.service.lesson.const import LESSON_TYPE_TRIAL
+    from flaskr.service.lesson.models import AICourse, AILesson
+    from flaskr.service.order.consts import ATTEND_STATUS_IN_PROGRESS
+    from flaskr.service.order.models import AICourseLessonAttend
+    from flaskr.service.study.const import ROLE_STUDENT, ROLE_TEACHER
+    from flaskr.service.study.models import AICourseLessonAttendScript
+    from flaskr.service.user import generate_temp_user
+
+    with app.app_context():
+        user = generate_temp_user(app, uuid.uuid4().hex)
+        user_id = user.userInfo.user_id
+        course_id = uuid.uuid4().hex
+        lesson_id = uuid.uuid4().hex
+        attend_id = uuid.uuid4().hex
+        db.session.add(AICourse(course_id=course_id, course_name="record", status=1))
+        db.session.add(
+            AILesson(
+                lesson_id=lesson_id,
+                course_id=course_id,
+                lesson_name="record",
+                lesson_no="0001",
+                lesson_type=LESSON_TYPE_TRIAL,
+                status=1,
+            )
+        )
+        db.session.add(
+            AICourseLessonAttend(
+                attend_id=attend_id,
+                lesson_id=lesson_id,
+                course_id=course_id,
+                user_id=user_id,
+                status=ATTEND_STATUS_IN_PROGRESS,
+            )
+        )
+        log_ids = []
+        for index in range(25):
+            log_id = uuid.uuid4().hex
+            log_ids.append(log_id)
+            db.session.add(
+                AICourseLessonAttendScript(
+                    log_id=log_id,
+                    attend_id=attend_id,
+                    script_id=uuid.uuid4().hex,
+                    lesson_id=lesson_id,
+                    course_id=course_id,
+                    user_id=user_id,
+                    script_index=index,
+                    script_role=ROLE_TEACHER if index % 2 else ROLE_STUDENT,
+                    script_content=f"content {index}",
+                )
+            )
+        db.session.commit()
+    yield user, lesson_id, log_ids
+    with app.app_context():
+        AICourseLessonAttendScript.query.filter_by(attend_id=attend_id).delete()
+        AICourseLessonAttend.query.filter_by(attend_id=attend_id).delete()
+        AILesson.query.filter_by(lesson_id=lesson_id).delete()
+        AICourse.query.filter_by(course_id=course_id).delete()
+        db.session.commit()
+
+
+def test_study_record_pages(app, study_logs):
+    from flaskr.service.study import get_study_record
+
+    user, lesson_id, log_ids = study_logs
+    user_id = user.userInfo.user_id
+    with app.app_context():
+        res = get_study_record(app, user_id, lesson_id)
+        assert [record.id for record in res.records] == log_ids
+        assert not res.has_more and res.next_cursor is None
+
+        # read the records back from the latest page to the oldest one
+        pages = []
+        before = None
+        while True:
+            page = get_study_record(app, user_id, lesson_id, False, 10, before)
+            pages.append([record.id for record in page.records])
+            if not page.has_more:
+                assert page.next_cursor is None
+                break
+            assert page.next_cursor == page.records[0].id
+            before = page.next_cursor
+        assert pages == [log_ids[15:], log_ids[5:15], log_ids[:5]]
+        assert get_study_record(app, user_id, "not-a-lesson") is None
+
+
+def test_lesson_study_records_route(app, test_client, study_logs):
+    user, lesson_id, log_ids = study_logs
+    url = app.config.get("PATH_PREFIX", "") + "/study/lesson-study-records"
+
+    def get_page(**params):
+        response = test_client.get(
+            url,
+            query_string=dict(params, lesson_id=lesson_id),
+            headers={"Token": user.token},
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.get_data(True).splitlines()]
+        assert all(line["type"] == "record" for line in lines[:-1])
+        assert lines[-1]["type"] == "page"
+        return [line["data"] for line in lines[:-1]], lines[-1]["data"]
+
+    records, page = get_page(limit=20)
+    assert [record["id"] for record in records] == log_ids[5:]
+    assert records[-1]["script_content"] == "content 24"
+    assert page["has_more"] is True
+    assert page["next_cursor"] == log_ids[5]
+
+    records, page = get_page(limit=20, before=page["next_cursor"])
+    assert [record["id"] for record in records] == log_ids[:5]
+    assert page["has_more"] is False
+    assert page["next_cursor"] is None
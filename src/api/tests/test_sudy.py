@@ -10,3 +10,28 @@ def test_get_study_record(app):
     print(study_record.ui.lesson_id)
     print([i.lesson_id for i in study_record.records])
     pass
+
+
+def test_build_lesson_tree(app):
+    from flaskr.service.lesson.graph import build_lesson_tree
+    from flaskr.service.lesson.models import AILesson
+
+    lessons = [
+        AILesson(lesson_id=lesson_id, lesson_no=no)
+        for lesson_id, no in [
+            ("new_01", "01"),
+            ("old_01", "01"),
+            ("lesson_02", "02"),
+            ("lesson_0101", "0101"),
+            ("lesson_0102", "0102"),
+            ("lesson_0201", "0201"),
+            ("orphan", "0301"),
+        ]
+    ]
+    tree = build_lesson_tree(lessons)
+    assert [
+        (x.lesson_id, [c.lesson_id for c, _ in children]) for x, children in tree
+    ] == [
+        ("new_01", ["lesson_0101", "lesson_0102"]),
+        ("lesson_02", ["lesson_0201"]),
+    ]
@@ -28,3 +28,27 @@ def test_get_user_profile(app):
 #     assert len(user_token.token) > 0
 #     print(user_token)
 #     pass
+
+
+def test_user_token_cache(app):
+    import time
+    import uuid
+
+    from flaskr.service.user import generate_temp_user
+    from flaskr.service.user.common import validate_user, update_user_info
+    from flaskr.service.user import token_cache
+
+    temp_id = uuid.uuid4().hex
+    token = generate_temp_user(app, temp_id).token
+    validate_user(app, token)
+    # the cache is used once the invalidation channel is subscribed
+    for _ in range(50):
+        if token_cache._listener_ready.is_set():
+            break
+        time.sleep(0.1)
+    user = validate_user(app, token)
+    assert validate_user(app, token).name == user.name
+
+    name = "cached_" + temp_id[:8]
+    update_user_info(app, user, name)
+    assert validate_user(app, token).name == name